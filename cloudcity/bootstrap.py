@@ -1,69 +1,320 @@
-from cloudcity.errors import MissingMandatoryOptions, CloudCityError, BadOptionFormat
+from cloudcity.errors import CloudCityError
 from cloudcity.configurations import ConfigurationResolver, ConfigurationFinder
+from cloudcity.config_index import ConfigIndex
+from cloudcity.clients import ClientPool
+from cloudcity.metrics import Metrics
+from cloudcity.profiling import NoProfiler
 from cloudcity.resolution.resolver import StackResolver
+from cloudcity.validation import Validator
+from cloudcity.rendering import Renderer
 from cloudcity.layers import Layers
 
 from option_merge import MergedOptions
-from collections import defaultdict
 
+from multiprocessing.pool import ThreadPool
+from collections import defaultdict
 import logging
+import os
 
 log = logging.getLogger("Bootstrap")
 
 class BootStrapper(object):
-    """Knows how to bootstrap our configuration"""
+    """
+    Knows how to bootstrap our configuration
+
+    Each phase of the bootstrap is wrapped in profiler.phase(name)
+
+    client_pool is the ClientPool that is shared by all the stacks we deploy
+
+    uploader is the Uploader for the artifacts of our stacks, if we have one
+
+    metrics is the Metrics object we record what we did into
+
+    dry_run says to only log the artifacts we would upload
+    """
 
-    def find_configurations(self, configs, forced_options):
-        """Find all the configurations from disk and return as a MergedOptions"""
-        finder = ConfigurationFinder(configs)
-        resolved = ConfigurationResolver(finder, forced_options).resolved()
+    def __init__(self, profiler=None, client_pool=None, uploader=None, metrics=None, dry_run=False):
+        self.dry_run = dry_run
+        self.uploader = uploader
 
-        # Make sure we have all the mandatory options
-        not_present = []
-        for option in resolved["global"].get("mandatory_options", []):
-            if not resolved.get(option):
-                not_present.append(option)
+        self.metrics = metrics
+        if self.metrics is None:
+            self.metrics = Metrics()
+        self.profiler = profiler
+        if self.profiler is None:
+            self.profiler = NoProfiler()
 
-        if not_present:
-            raise MissingMandatoryOptions(missing=not_present)
+        self.client_pool = client_pool
+        if self.client_pool is None:
+            self.client_pool = ClientPool()
+
+    def find_configurations(self, configs, forced_options, streaming=False, wanted=None, only_files=None):
+        """
+        Find all the configurations from disk and return as a MergedOptions
+
+        streaming, wanted and only_files are passed onto the ConfigurationFinder
+
+        Mandatory options are checked along with everything else in get_stacks
+        """
+        with self.profiler.phase("find_configurations"):
+            finder = self.finder = ConfigurationFinder(configs, streaming=streaming, wanted=wanted, only_files=only_files, metrics=self.metrics)
+            resolved = ConfigurationResolver(finder, forced_options).resolved()
 
         return resolved
 
+    def scope_with_index(self, configs, index_location, target):
+        """
+        Use a ConfigIndex to return (stacks, files) needed for deploying target
+
+        The index is only kept in memory if index_location is None
+        """
+        with self.profiler.phase("config_index"):
+            index = ConfigIndex(index_location)
+            index.update(configs)
+            return index.closure(target)
+
     def get_layers(self, options, target):
         """Find us the layers and in the order we want to deploy them given a target stack"""
-        if target not in options:
-            raise CloudCityError("Missing stack", available=options.keys(), wanted=target)
+        with self.profiler.phase("get_layers"):
+            if target not in options:
+                raise CloudCityError("Missing stack", available=options.keys(), wanted=target)
+
+            stacks = self.get_stacks(options)
+            with self.profiler.phase("layering"), self.metrics.timer("cloudcity_layering_seconds"):
+                layers = Layers(stacks)
+                layers.add_to_layers(target)
+
+        return layers
+
+    def get_impacted_layers(self, options, changed):
+        """
+        Find the layers of stacks that need redeploying when some stacks change
+
+        changed is a list of stack names and/or paths to config files that were
+        found by find_configurations.
+
+        global isn't deployed itself, so a change to global is a change to
+        every stack that references it.
+        """
+        changed_stacks = set()
+        for change in changed:
+            if os.path.isfile(change):
+                changed_stacks.update(self.finder.stacks_from_file(change))
+            else:
+                changed_stacks.add(change)
+
+        stacks = self.get_stacks(options)
+        with self.profiler.phase("layering"), self.metrics.timer("cloudcity_layering_seconds"):
+            layers = Layers(stacks)
+            if "global" in changed_stacks and "global" in stacks:
+                changed_stacks.remove("global")
+                changed_stacks.update(layers.dependents.get("global", ()))
+            layers.add_impacted_to_layers(changed_stacks)
+
+        return layers
 
+    def get_stacks(self, options):
+        """
+        Resolve all the stacks in our options and determine their dependencies
+
+        All the checks on the configuration are done together and every problem
+        is reported before we complain.
+        """
         resolver = StackResolver()
         resolver.register_defaults()
+        validator = Validator(options, resolver)
 
-        stacks = {name:resolver.resolve(name, options[name]) for name in options}
-        self.investigate_required_keys(stacks)
+        with self.profiler.phase("mandatory_options"):
+            validator.check_mandatory_options()
 
-        layers = Layers(stacks)
-        layers.add_to_layers(target)
+        with self.profiler.phase("stack_resolution"):
+            validator.resolve_stacks()
+        self.metrics.inc("cloudcity_stacks_resolved", len(validator.stacks))
 
-        return layers
+        with self.profiler.phase("investigate_required_keys"):
+            validator.check_references()
+        self.metrics.inc("cloudcity_requirement_checks", validator.checked)
+
+        with self.profiler.phase("cycles"):
+            validator.check_cycles()
+
+        validator.raise_problems()
+        return validator.stacks
 
     def investigate_required_keys(self, stacks):
-        """Make sure all the formatted keys format to keys that will be available"""
-        not_found = []
-        dependencies = defaultdict(set)
-
-        for name, stack in stacks.items():
-            for needing, requiring in stack.find_required_keys():
-                for required in requiring:
-                    stack_name, required_key = required.split(".", 1)
-                    if not stacks[stack_name].check_option_availablity(required_key):
-                        not_found.append([name, needing, required])
-                    else:
-                        dependencies[name].add(stack_name)
-
-        if not_found:
-            for name, needing, required in not_found:
-                log.error("The '%s' key in the '%s' stack requires the %s key", needing, name, required)
-            raise BadOptionFormat("Missing required keys", missing=len(not_found))
-
-        for name, required in dependencies.items():
-            stacks[name].add_dependencies(list(required))
+        """
+        Make sure all the formatted keys format to keys that will be available and record dependencies
+
+        get_stacks does this along with all the other checks. This is for
+        stacks resolved some other way, and complains with InvalidConfiguration.
+        """
+        validator = Validator(stacks, None)
+        validator.stacks = dict(stacks)
+        validator.check_references()
+        validator.raise_problems()
+
+    def check_mandatory_options(self, layers, mandatory_options=None):
+        """
+        Complain if the stacks in these layers don't have global.mandatory_options
+
+        For stacks that didn't come through get_stacks, i.e. from a plan.
+        mandatory_options is used instead of global.mandatory_options if given.
+        """
+        options = self.stack_options(layers)
+        if mandatory_options:
+            options.update({"global": {"mandatory_options": mandatory_options}})
+
+        with self.profiler.phase("mandatory_options"):
+            validator = Validator(options, None)
+            validator.check_mandatory_options()
+            validator.raise_problems()
+
+    def stack_options(self, layers):
+        """Return a MergedOptions of the options of all the stacks in these layers for rendering against"""
+        return MergedOptions.using(dict((name, stack.as_dict()) for layer in layers.layered for name, stack in layer))
+
+    def render_stacks(self, layers, processes=None, names=None, outputs=None, resolver=None):
+        """
+        Render the templated options of the stacks in these layers onto stack.rendered
+
+        If names is specified then only those stacks are rendered, against the
+        options of all the stacks.
+
+        If outputs is an OutputCache then references to stacks that aren't
+        config stacks are resolved from their outputs.
+
+        If resolver is a ReferenceResolver made from stack_options for these
+        layers, then it's used instead of making our own, along with it's
+        outputs. Share one between calls to only resolve each reference once.
+        """
+        stacks = dict(stack for layer in layers.layered for stack in layer)
+        if resolver is not None:
+            options = resolver.all_options
+        else:
+            options = self.stack_options(layers)
+
+        if names is None:
+            names = stacks
+
+        with self.profiler.phase("render"):
+            rendered = Renderer(options, processes, outputs, resolver).render(sorted(names))
+        for name in names:
+            stacks[name].rendered = rendered[name]
+
+    def needs_outputs(self, layers):
+        """
+        Return the names of the stacks in these layers that need the outputs of other stacks in these layers
+
+        That is stacks that depend on a stack that isn't a config stack, or
+        on a stack that itself needs outputs.
+        """
+        stacks = dict(stack for layer in layers.layered for stack in layer)
+        needing = set()
+        for layer in layers.layered:
+            for name, stack in layer:
+                for dependency in stack.dependencies:
+                    if dependency in needing or (dependency in stacks and stacks[dependency].options.get("type", "config") != "config"):
+                        needing.add(name)
+                        break
+        return needing
+
+    def use_clients(self, layers):
+        """Give all the stacks in these layers our client pool and metrics"""
+        for layer in layers.layered:
+            for _, stack in layer:
+                stack.client_pool = self.client_pool
+                stack.metrics = self.metrics
+
+    def check_existence(self, layers, names=None):
+        """
+        Find whether each stack in these layers already exists onto stack.existing
+
+        If names is specified then only those stacks are checked.
+
+        Stacks are grouped by their type and each type is asked about all of
+        it's stacks in one call to exists_many. The types are asked at the
+        same time so this takes as long as the slowest type.
+        """
+        by_type = defaultdict(list)
+        for layer in layers.layered:
+            for name, stack in layer:
+                if names is None or name in names:
+                    by_type[stack.__class__].append(stack)
+
+        batches = [(kls, stacks) for kls, stacks in sorted(by_type.items(), key=lambda item: item[0].__name__)]
+        with self.profiler.phase("existence"):
+            if len(batches) < 2:
+                found = [kls.exists_many(stacks) for kls, stacks in batches]
+            else:
+                pool = ThreadPool(len(batches))
+                try:
+                    found = pool.map(lambda batch: batch[0].exists_many(batch[1]), batches)
+                finally:
+                    pool.close()
+                    pool.join()
+
+        existence = {}
+        for answer in found:
+            existence.update(answer)
+
+        for kls, stacks in batches:
+            for stack in stacks:
+                if stack.name not in existence:
+                    raise CloudCityError("Stack type didn't say whether a stack exists", stack_type=kls.__name__, stack=stack.name)
+                stack.existing = existence[stack.name]
+
+        return existence
+
+    def prepare_stacks(self, layers, names=None, processes=None, outputs=None, resolver=None):
+        """
+        Do everything for deploying the stacks in these layers that doesn't need their dependencies deployed
+
+        We render them, find whether they exist, call prepare_deployment on
+        each of them and upload their artifacts. If names is specified then
+        only those stacks are prepared.
+
+        If we have outputs then references to stacks that aren't config stacks
+        are resolved from their outputs, and the stacks that needs_outputs
+        are left unrendered so they can be rendered once the stacks they need
+        are deployed.
+
+        resolver is passed onto render_stacks, and it's outputs are used as our outputs.
+        """
+        if resolver is not None:
+            outputs = resolver.outputs
+
+        rendering = names
+        if outputs is not None:
+            later = self.needs_outputs(layers)
+            rendering = [name for layer in layers.layered for name, _ in layer if (names is None or name in names) and name not in later]
+        self.render_stacks(layers, processes, rendering, outputs, resolver)
+        self.check_existence(layers, names)
+        for layer in layers.layered:
+            for name, stack in layer:
+                if names is None or name in names:
+                    stack.prepare_deployment()
+        self.upload_artifacts(layers, names)
+
+    def upload_artifacts(self, layers, names=None):
+        """
+        Upload the artifacts of the stacks in these layers and set stack.uploaded
+
+        If names is specified then only the artifacts of those stacks are uploaded.
+        """
+        stacks = [stack for layer in layers.layered for name, stack in layer if names is None or name in names]
+        locations = [location for stack in stacks for location in stack.artifacts()]
+        if not locations:
+            return
+
+        if self.uploader is None:
+            raise CloudCityError("Stacks have artifacts but nothing to upload them to", stacks=sorted(stack.name for stack in stacks if stack.artifacts()))
+
+        if self.dry_run:
+            for location in sorted(set(locations)):
+                log.info("Would upload %s", location)
+            return
 
+        with self.profiler.phase("upload"):
+            keys = self.uploader.upload(locations)
+        for stack in stacks:
+            stack.uploaded = dict((location, keys[location]) for location in stack.artifacts())
@@ -0,0 +1,83 @@
+from cloudcity.errors import CloudCityError
+
+from collections import defaultdict
+import threading
+import logging
+
+log = logging.getLogger("clients")
+
+class ClientPool(object):
+    """
+    Hands out backend clients that are shared by every stack and tracker in a run
+
+    Usage::
+
+        pool = ClientPool(lambda region, account: make_client(region, account))
+        client = pool.client("ap-southeast-2", "123456789")
+
+    There is one client for each (region, account) and it is made by factory
+    the first time it's asked for. Asking for the same client from many
+    threads at once only makes it once.
+
+    The clients themselves need to be safe to use from many threads.
+
+    cloudcity makes it's pool with the factory from --client-factory.
+    """
+    def __init__(self, factory=None):
+        self.factory = factory
+
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.creating = {}
+
+        self.created = 0
+        self.reused = defaultdict(int)
+
+    def client(self, region, account):
+        """Return the client for this region and account"""
+        key = (region, account)
+        with self.lock:
+            if key in self.clients:
+                self.reused[key] += 1
+                return self.clients[key]
+
+            if key not in self.creating:
+                self.creating[key] = threading.Lock()
+            creating = self.creating[key]
+
+        with creating:
+            with self.lock:
+                if key in self.clients:
+                    self.reused[key] += 1
+                    return self.clients[key]
+
+            if self.factory is None:
+                raise CloudCityError("Nothing knows how to make backend clients", region=region, account=account)
+
+            log.info("Making a client for region=%s account=%s", region, account)
+            client = self.factory(region, account)
+
+            with self.lock:
+                self.clients[key] = client
+                self.created += 1
+                del self.creating[key]
+
+        return client
+
+    def metrics(self):
+        """Return how many clients we made and how many times they were reused"""
+        return {
+              "clients": len(self.clients)
+            , "created": self.created
+            , "reused": sum(self.reused.values())
+            , "reused_by_client": dict(("{0}/{1}".format(*key), count) for key, count in self.reused.items())
+            }
+
+    def close(self):
+        """Close all our clients that can be closed and forget about them"""
+        with self.lock:
+            clients, self.clients = self.clients, {}
+
+        for key, client in sorted(clients.items()):
+            if hasattr(client, "close"):
+                client.close()
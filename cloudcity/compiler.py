@@ -0,0 +1,79 @@
+from cloudcity.errors import CloudCityError, InvalidConfigFile, FailedConfigPickup
+from cloudcity.configurations import ConfigurationFinder, msgpack
+
+import logging
+import os
+
+log = logging.getLogger("compiler")
+
+class ConfigCompiler(object):
+    """
+    Turns folders of text config files into msgpack files that are much quicker to read
+
+    Usage::
+
+        ConfigCompiler("/path/to/output").compile(["/path/to/configs"])
+
+    Each config file is written to the same relative path under the output
+    folder with ``.msgpack`` added to the end of the name. So the compiled
+    files sort in the same order as the originals and are merged the same way.
+
+    When compiling more than one folder, each folder goes into its own numbered
+    folder under the output so they keep their order.
+    """
+    extension = "msgpack"
+
+    def __init__(self, output, finder_kls=ConfigurationFinder):
+        self.output = output
+        self.finder_kls = finder_kls
+
+    def compile(self, folders):
+        """Compile the configs in these folders and return the files we made"""
+        if msgpack is None:
+            raise CloudCityError("Compiling configs needs msgpack, try pip install 'cloudcity[msgpack]'")
+
+        finder = self.finder_kls(folders)
+        reader = finder.config_reader
+
+        made = []
+        errors = {}
+        for index, folder in enumerate(folders):
+            for config_file, name in finder.sorted_files_with_names(folder):
+                if not reader.is_config(config_file) or reader.matched_extension(config_file) == self.extension:
+                    continue
+
+                if len(folders) > 1:
+                    name = os.path.join("{0:02d}".format(index), name)
+                location = os.path.join(self.output, "{0}.{1}".format(name, self.extension))
+
+                try:
+                    self.write(location, reader.as_dict(config_file) or {})
+                except InvalidConfigFile as err:
+                    errors[config_file] = err
+                    continue
+                made.append(location)
+
+        if errors:
+            raise FailedConfigPickup(errors=errors)
+
+        log.info("Compiled %s config files into %s", len(made), self.output)
+        return made
+
+    def write(self, location, dct):
+        """
+        Write this dictionary as msgpack to the specified location
+
+        We complain about values msgpack can't hold, i.e. dates, rather than
+        changing them into something that reads back differently.
+        """
+        try:
+            packed = msgpack.packb(dct, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError) as error:
+            raise InvalidConfigFile("Config has values that can't be compiled into msgpack", error_type=error.__class__.__name__, error=error)
+
+        parent = os.path.dirname(location)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        with open(location, "wb") as fle:
+            fle.write(packed)
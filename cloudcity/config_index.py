@@ -0,0 +1,156 @@
+from cloudcity.configurations import ConfigurationFinder
+from cloudcity.errors import InvalidConfigFile
+from cloudcity.keys import key_path
+
+import logging
+import string
+import json
+import os
+
+log = logging.getLogger("config_index")
+
+def references_in(value, found=None):
+    """Return the set of stacks referenced by format strings anywhere in this value"""
+    if found is None:
+        found = set()
+
+    if isinstance(value, dict):
+        for val in value.values():
+            references_in(val, found)
+    elif isinstance(value, list):
+        for val in value:
+            references_in(val, found)
+    elif isinstance(value, basestring):
+        try:
+            for _, field_name, _, _ in string.Formatter().parse(value):
+                if field_name:
+                    found.add(key_path(field_name).root)
+        except ValueError:
+            # Not a valid format string, the formatter will complain about it later
+            pass
+
+    return found
+
+class ConfigIndex(object):
+    """
+    A persistent index of which files define each top level key in our configuration
+
+    Usage::
+
+        index = ConfigIndex("/path/to/index.json")
+        index.update(["/path/to/configs"])
+        stacks, files = index.closure("my_stack")
+
+    For each config file we store the mtime and size of the file, the top level
+    keys it defines and the stacks referenced by each of those keys.
+
+    update only reads files that are new or have changed since the index was
+    last saved, and closure uses the index to find every stack the target
+    transitively references, along with the files that define them.
+
+    Files we fail to read are marked as invalid and are always part of the
+    closure, so the finder reads them and reports what is wrong with them.
+
+    If location is None the index is only kept in memory, so every file is
+    read to make it.
+    """
+    version = 1
+
+    def __init__(self, location, finder_kls=ConfigurationFinder):
+        self.location = location
+        self.finder_kls = finder_kls
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """Load the index from disk if it's there"""
+        if self.location is None or not os.path.exists(self.location):
+            return
+
+        try:
+            with open(self.location) as fle:
+                dct = json.load(fle)
+        except (IOError, ValueError) as error:
+            log.warning("Ignoring unreadable config index at %s (%s)", self.location, error)
+            return
+
+        if dct.get("version") == self.version:
+            self.files = dct["files"]
+
+    def save(self):
+        """Save the index to disk"""
+        if self.location is None:
+            return
+
+        with open(self.location, "w") as fle:
+            json.dump({"version": self.version, "files": self.files}, fle, sort_keys=True, separators=(',', ':'))
+
+    def update(self, folders):
+        """Make sure the index knows about all the config files in these folders as they are now"""
+        finder = self.finder_kls(folders)
+        reader = finder.config_reader
+
+        changed = False
+        present = set()
+        for config_file in finder.sorted_files():
+            if not reader.is_config(config_file):
+                continue
+
+            present.add(config_file)
+            stat = os.stat(config_file)
+            known = self.files.get(config_file)
+            if known and known["mtime"] == stat.st_mtime and known["size"] == stat.st_size:
+                continue
+
+            log.info("Indexing %s", config_file)
+            try:
+                dct = reader.as_dict(config_file) or {}
+            except InvalidConfigFile as error:
+                # We don't know what it defines, so it's always read and complained about properly
+                log.warning("Config file %s can't be indexed (%s)", config_file, error)
+                self.files[config_file] = {"mtime": stat.st_mtime, "size": stat.st_size, "keys": {}, "invalid": True}
+            else:
+                self.files[config_file] = {"mtime": stat.st_mtime, "size": stat.st_size, "keys": self.keys_for(dct)}
+            changed = True
+
+        for config_file in list(self.files):
+            if config_file not in present:
+                del self.files[config_file]
+                changed = True
+
+        if changed:
+            self.save()
+
+    def keys_for(self, dct):
+        """Return {key: [referenced stacks, ...]} for the top level keys in this dictionary"""
+        keys = {}
+        for key, val in dct.items():
+            references = references_in(val)
+            if key == "global" and isinstance(val, dict):
+                for option in val.get("mandatory_options", None) or []:
+                    references.add(key_path(option).root)
+            references.discard(key)
+            keys[key] = sorted(references)
+        return keys
+
+    def closure(self, target):
+        """Return (stacks, files) for everything needed to resolve target"""
+        defined_in = {}
+        for config_file, info in self.files.items():
+            for key, references in info["keys"].items():
+                defined_in.setdefault(key, []).append((config_file, references))
+
+        stacks = set()
+        files = set(config_file for config_file, info in self.files.items() if info.get("invalid"))
+        queue = [target, "global"]
+        while queue:
+            name = queue.pop()
+            if name in stacks:
+                continue
+
+            stacks.add(name)
+            for config_file, references in defined_in.get(name, []):
+                files.add(config_file)
+                queue.extend(references)
+
+        return stacks, files
@@ -1,18 +1,34 @@
-from cloudcity.errors import FailedConfigPickup, InvalidConfigFile, BadConfigResolver, BadOptionFormat
+from cloudcity.errors import FailedConfigPickup, InvalidConfigFile, BadConfigResolver, BadOptionFormat, OptionReferenceCycle
+from cloudcity.keys import key_path
 from option_merge import MergedOptions
 
+from contextlib import contextmanager
 from collections import defaultdict
+import threading
 import logging
 import string
+import mmap
 import json
 import yaml
+import time
 import os
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 log = logging.getLogger("configurations")
 
 class MergedOptionStringFormatter(string.Formatter):
-    """Resolve format options into the all_options dictionary"""
-    def __init__(self, all_options, config_only=False):
+    """
+    Resolve format options into the all_options dictionary
+
+    If a ReferenceResolver is provided then values are found through it, which
+    means they are remembered and any templates in those values are resolved too.
+    """
+    def __init__(self, all_options, config_only=False, resolver=None):
+        self.resolver = resolver
         self.all_options = all_options
         self.config_only = config_only
         self.found_requirements = []
@@ -20,25 +36,122 @@ class MergedOptionStringFormatter(string.Formatter):
 
     def get_field(self, value, args, kwargs):
         """Also take the spec into account"""
-        if '.' not in value:
+        path = key_path(value)
+        if path.rest is None:
             raise BadOptionFormat("Shouldn't format a whole stack into the string")
 
-        val = self.all_options.get(value)
-        if isinstance(val, dict) or isinstance(val, MergedOptions):
-            raise BadOptionFormat("Shouldn't format in a dictionary", key=value)
+        if self.resolver is not None:
+            val = self.resolver.value(path)
+        else:
+            val = self.all_options.get(value)
+            if isinstance(val, dict) or isinstance(val, MergedOptions):
+                raise BadOptionFormat("Shouldn't format in a dictionary", key=value)
 
         # Record what was found
-        self.found_requirements.append(value)
+        self.found_requirements.append(path)
+
+        if self.resolver is not None:
+            root_type = self.resolver.root_type(path)
+        else:
+            root_type = self.all_options.get(path.type_key, "config")
 
-        root = value.split(".")[0]
-        root_type = self.all_options.get("{0}.type".format(root), "config")
-        if root_type != "config":
+        if root_type != "config" and (self.resolver is None or self.resolver.outputs is None):
             raise BadOptionFormat("Can only resolve options from 'config' stacks", invalid_stack_type=root_type, option=value)
 
         return val, ()
 
+class ReferenceResolver(object):
+    """
+    Resolve and remember references like "stack.option" for a whole run
+
+    Usage::
+
+        resolver = ReferenceResolver(all_options)
+        MergedOptionStringFormatter(all_options, resolver=resolver).format("{stack.option}")
+
+    Each reference is looked up in all_options once, as is the type of each
+    stack that is referenced.
+
+    Values that are themselves templates are formatted before being used, so
+    each reference is resolved once and after everything it refers to.
+    References that end up referring back to themselves are complained about.
+
+    If outputs is an OutputCache, references to stacks that aren't 'config'
+    stacks are resolved from the outputs of those stacks. These aren't
+    remembered here so that the cache can expire and invalidate them, and
+    neither are values that were formatted from them, directly or through
+    other references. Use
+    option rather than value for the options of the stack being rendered, so
+    they come from the options whatever type of stack it is.
+
+    A resolver can be shared by threads, i.e. for a whole run while later
+    layers are prepared in the background.
+    """
+    def __init__(self, all_options, outputs=None):
+        self.outputs = outputs
+        self.all_options = all_options
+        self.values = {}
+        self.root_types = {}
+        self.lock = threading.RLock()
+        self.resolving = []
+        self.from_outputs = set()
+
+    def root_type(self, path):
+        """Return the type of the stack this KeyPath is in"""
+        if path.root not in self.root_types:
+            self.root_types[path.root] = self.all_options.get(path.type_key, "config")
+        return self.root_types[path.root]
+
+    def value(self, path):
+        """Return the resolved value for a reference to this KeyPath"""
+        if self.outputs is not None and self.root_type(path) != "config":
+            # Everything we're in the middle of resolving depends on these outputs
+            self.from_outputs.update(self.resolving)
+            return self.outputs.get(path)
+        return self.option(path)
+
+    def option(self, path):
+        """Return the resolved value of the option at this KeyPath, i.e. when rendering the stack it's in"""
+        with self.lock:
+            return self.resolve_option(path)
+
+    def resolve_option(self, path):
+        """Do the work for option, holding our lock"""
+        key = path.key
+        if key in self.values:
+            return self.values[key]
+
+        if key in self.resolving:
+            chain = self.resolving[self.resolving.index(key):] + [key]
+            raise OptionReferenceCycle(chain=chain)
+
+        val = self.all_options.get(key)
+        if isinstance(val, dict) or isinstance(val, MergedOptions):
+            raise BadOptionFormat("Shouldn't format in a dictionary", key=key)
+
+        uses_outputs = False
+        if isinstance(val, basestring) and "{" in val:
+            self.resolving.append(key)
+            try:
+                val = MergedOptionStringFormatter(self.all_options, resolver=self).format(val)
+            finally:
+                self.resolving.pop()
+                uses_outputs = key in self.from_outputs
+                self.from_outputs.discard(key)
+
+        if not uses_outputs:
+            self.values[key] = val
+        return val
+
 class ConfigReader(object):
-    """Knows how to read config files"""
+    """
+    Knows how to read config files
+
+    Yaml files at least mmap_threshold bytes big are memory mapped and the
+    parser reads straight from the mapping rather than through a buffered file.
+    Set mmap_threshold to None to never memory map.
+    """
+    mmap_threshold = 16 * 1024 * 1024
 
     def __init__(self):
         self.resolvers = {}
@@ -47,6 +160,8 @@ class ConfigReader(object):
     def setup_default_resolvers(self):
         self.register("json", self.read_json)
         self.register("yaml", self.read_yaml)
+        if msgpack is not None:
+            self.register("msgpack", self.read_msgpack)
 
     def register(self, extension, resolver):
         """Register a resolver for a particular extension"""
@@ -71,12 +186,28 @@ class ConfigReader(object):
 
         return self.resolvers[extension](config_file)
 
+    @contextmanager
+    def opened(self, config_file):
+        """Yield a file like object for config_file, memory mapped if it's big enough"""
+        with open(config_file, "rb") as fle:
+            size = os.fstat(fle.fileno()).st_size
+            if self.mmap_threshold is None or size == 0 or size < self.mmap_threshold:
+                yield fle
+            else:
+                mapped = mmap.mmap(fle.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    yield mapped
+                finally:
+                    mapped.close()
+
     def read_json(self, config_file):
         """Turn json config_file into a dictionary"""
         try:
             if os.stat(config_file).st_size == 0:
                 return {}
-            return json.load(open(config_file))
+            # json needs the whole document as one string, so memory mapping doesn't help here
+            with open(config_file) as fle:
+                return json.load(fle)
         except ValueError as error:
             raise InvalidConfigFile("Failed to read json", error_type=error.__class__.__name__, error=error)
 
@@ -85,15 +216,68 @@ class ConfigReader(object):
         try:
             if os.stat(config_file).st_size == 0:
                 return {}
-            return yaml.load(open(config_file))
+            with self.opened(config_file) as fle:
+                return yaml.load(fle)
         except yaml.parser.ParserError as error:
             raise InvalidConfigFile("Failed to read yaml", error_type=error.__class__.__name__, error=error.problem)
 
+    def read_msgpack(self, config_file):
+        """Turn msgpack config_file into a dictionary"""
+        try:
+            with open(config_file, "rb") as fle:
+                contents = fle.read()
+            if not contents:
+                return {}
+            # Yaml configs can have keys that aren't strings, like integers, and msgpack>=1.0 refuses those by default
+            return msgpack.unpackb(contents, raw=False, strict_map_key=False)
+        except ValueError as error:
+            raise InvalidConfigFile("Failed to read msgpack", error_type=error.__class__.__name__, error=error)
+
+def merge_into(target, values):
+    """
+    Deep merge values into the target dictionary, with values taking precedence
+
+    Nested dictionaries in target are copied before being changed so we never
+    modify anything that may be shared with another part of the config.
+    """
+    for key, val in values.items():
+        existing = target.get(key)
+        if isinstance(val, dict) and isinstance(existing, dict):
+            existing = target[key] = dict(existing)
+            merge_into(existing, val)
+        else:
+            target[key] = val
+
 class ConfigurationFinder(object):
-    """Knows how to find files on disk and convert them into a MergedOptions object"""
-    def __init__(self, folders, config_reader_kls=ConfigReader):
+    """
+    Knows how to find files on disk and convert them into a MergedOptions object
+
+    When streaming is True, each file is merged into one dictionary per stack
+    as soon as it is read, rather than holding onto every file's dictionary
+    until the end.
+
+    When wanted is a list of stack names, any other top level keys (other than
+    global) are skipped as the files are read.
+
+    When only_files is a list of files, any other files are not read at all.
+
+    When metrics is a Metrics object we count the files we read and how long
+    each one took.
+    """
+    def __init__(self, folders, config_reader_kls=ConfigReader, streaming=False, wanted=None, only_files=None, metrics=None):
         self.folders = folders
+        self.metrics = metrics
+        self.streaming = streaming
         self.config_reader = config_reader_kls()
+
+        self.only_files = only_files
+        if self.only_files is not None:
+            self.only_files = set(self.only_files)
+
+        self.wanted = wanted
+        if self.wanted is not None:
+            self.wanted = set(self.wanted) | set(["global"])
+
         self.reset()
 
     @property
@@ -104,57 +288,92 @@ class ConfigurationFinder(object):
         return self._found
 
     def reset(self):
-        """Reset seen and _found"""
+        """Reset seen, sources and _found"""
         self.seen = {}
+        self.sources = defaultdict(list)
         self._found = defaultdict(list)
 
     def add(self, name, values):
         """Add a dictionary for some stack"""
-        self._found[name].append(values)
+        found = self._found[name]
+        if not self.streaming:
+            found.append(values)
+        elif not found:
+            found.append(dict(values) if isinstance(values, dict) else values)
+        elif isinstance(values, dict) and isinstance(found[0], dict):
+            merge_into(found[0], values)
+        else:
+            found[0] = values
 
     def pick_up_configs(self):
         """Find all the configurations in our specified folders and store them in memory"""
         errors = {}
         for config_file in self.sorted_files():
+            if self.only_files is not None and config_file not in self.only_files:
+                continue
+
             if self.config_reader.is_config(config_file):
                 dct = None
+                start = time.time()
                 try:
                     dct = self.config_reader.as_dict(config_file)
                 except InvalidConfigFile as err:
                     errors[config_file] = err
 
+                if self.metrics is not None:
+                    extension = self.config_reader.matched_extension(config_file)
+                    self.metrics.inc("cloudcity_config_files_parsed", format=extension)
+                    self.metrics.observe("cloudcity_config_parse_seconds", time.time() - start, format=extension)
+
                 if dct:
                     for key, val in dct.items():
-                        self.add(key, val)
+                        self.sources[key].append(config_file)
+                        if self.wanted is None or key in self.wanted:
+                            self.add(key, val)
 
         if errors:
             raise FailedConfigPickup(errors=errors)
 
     def sorted_files(self, directory=None):
         """Find all the configuration files"""
+        for path, _ in self.sorted_files_with_names(directory):
+            yield path
+
+    def sorted_files_with_names(self, directory=None, name=None):
+        """Yield (path, name) for all the configuration files, where name is relative to the folder the file was found in"""
         if directory is None:
             for folder in self.folders:
-                for fle in self.sorted_files(folder):
-                    yield fle
+                for found in self.sorted_files_with_names(folder):
+                    yield found
 
         else:
-            for path in sorted(os.listdir(directory)):
-                path = os.path.abspath(os.path.realpath(os.path.join(directory, path)))
+            for filename in sorted(os.listdir(directory)):
+                path = os.path.abspath(os.path.realpath(os.path.join(directory, filename)))
                 if path in self.seen:
                     continue
 
                 self.seen[path] = True
+                relative = filename if name is None else os.path.join(name, filename)
                 if os.path.isfile(path):
-                    yield path
+                    yield path, relative
                 else:
-                    for fle in self.sorted_files(path):
-                        yield fle
+                    for found in self.sorted_files_with_names(path, relative):
+                        yield found
+
+    def stacks_from_file(self, config_file):
+        """Return the top level keys defined by this config_file"""
+        config_file = os.path.abspath(os.path.realpath(config_file))
+        return sorted(key for key, files in self.sources.items() if config_file in files)
 
     def make_options(self):
         """Get all the found files into a MergedOptions object and default global"""
         options = MergedOptions()
         for key, values_list in self.found.items():
-            options[key] = MergedOptions.using(*values_list)
+            if self.streaming:
+                # Already merged and not shared with anything, so avoid the copy MergedOptions.using would make
+                options[key] = MergedOptions(options=list(values_list))
+            else:
+                options[key] = MergedOptions.using(*values_list)
 
         if 'global' not in options:
             options["global"] = MergedOptions()
@@ -187,21 +406,33 @@ class ConfigurationResolver(object):
             current_values = options[key]
 
             if current_values.get("no_resolve", False):
-                new_values.update(current_values)
+                self.add(new_values, current_values)
             else:
                 for part in resolve_order:
                     if not part:
-                        new_values.update(current_values)
+                        self.add(new_values, current_values)
                     else:
                         val = current_values.get(part)
                         if val:
-                            new_values.update(val)
+                            self.add(new_values, val)
 
             new_options[key] = new_values
 
         new_options["global"]["resolve_order"] = resolve_order
         return new_options
 
+    def add(self, new_values, values):
+        """
+        Add values to the front of new_values
+
+        When the finder is streaming, the options it made aren't shared with
+        anything, so we use them as they are rather than keeping a copy
+        """
+        if self.finder.streaming:
+            new_values.options.insert(0, values)
+        else:
+            new_values.update(values)
+
     def determine_resolve_order(self, options, resolve_order):
         """Figure out our resolve order and set it on the options"""
         template = MergedOptionStringFormatter(options, config_only=True)
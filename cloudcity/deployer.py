@@ -0,0 +1,373 @@
+from cloudcity.resolution.tracker import Tracker
+from cloudcity.errors import FailedDeployment, CloudCityError
+from cloudcity.resources import ResourceLimits
+from cloudcity.durations import Durations
+from cloudcity.metrics import Metrics
+from cloudcity.journal import Journal
+
+import logging
+import time
+
+log = logging.getLogger("deployer")
+
+def readable_duration(seconds):
+    """Return seconds as something like 1h2m3s"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{0}h{1}m{2}s".format(hours, minutes, seconds)
+    if minutes:
+        return "{0}m{1}s".format(minutes, seconds)
+    return "{0}s".format(seconds)
+
+class DeployReport(object):
+    """
+    What happened to each stack in a deploy
+
+    deployed
+        Stacks that we deployed
+
+    unchanged
+        Stacks the journal says were already deployed with the same options
+
+    failed
+        {stack: state} for stacks whose deployment didn't finish
+
+    cancelled
+        Stacks we stopped deploying because something else failed
+
+    skipped
+        Stacks we never started because something failed
+    """
+    def __init__(self):
+        self.failed = {}
+        self.skipped = []
+        self.deployed = []
+        self.unchanged = []
+        self.cancelled = []
+
+    @property
+    def done(self):
+        """The stacks that are in place for their dependents to be deployed"""
+        return set(self.deployed) | set(self.unchanged)
+
+    @property
+    def succeeded(self):
+        return not self.failed and not self.cancelled and not self.skipped
+
+    def summary(self):
+        """Return lines describing what happened"""
+        lines = []
+        for desc, names in (
+              ("Deployed", self.deployed)
+            , ("Unchanged", self.unchanged)
+            , ("Failed", ["{0} ({1})".format(name, state) for name, state in sorted(self.failed.items())])
+            , ("Cancelled", self.cancelled)
+            , ("Skipped", self.skipped)
+            ):
+            if names:
+                lines.append("{0}: {1}".format(desc, ", ".join(names)))
+        return lines
+
+class Deployer(object):
+    """
+    Deploys the stacks in some layers, starting each stack once it's dependencies are deployed
+
+    Usage::
+
+        Deployer(journal=Journal("deploy.journal"), resume=True, max_parallel=4).deploy(layers)
+
+    Up to max_parallel stacks are deployed at the same time. Dependencies that
+    aren't in the layers are assumed to already be deployed.
+
+    strategy says which stacks to start when we have room:
+
+    critical-path
+        Of the stacks whose dependencies are deployed, start the one with the
+        longest chain of dependent deploys after it, using how long durations
+        says each stack takes
+
+    dag
+        Start the stacks whose dependencies are deployed in layer order
+
+    layered
+        Only start stacks from a layer once every stack in the layers before
+        it has settled
+
+    How long each stack took is recorded in durations and used to log an
+    estimate of how long the rest of the deploy will take.
+
+    A stack is only started if resources says there is room for another stack
+    on each of it's resource_keys, so stacks in the same account or region
+    don't throttle each other while stacks elsewhere keep going.
+
+    If we have a progress view then it's given the progress_update of each
+    deploying stack's tracker each time we check on it, and asked to draw after
+    each check.
+
+    How long each stack took to deploy, how long it waited to start after it's
+    dependencies were deployed and the state it ended in are recorded in metrics.
+
+    If we have a preparation then stacks are only started once it says they
+    are prepared, so later layers can be prepared while earlier layers deploy.
+
+    If we have a journal then each stack is recorded as started before we
+    deploy it and as finished once it's deployment tracker says it's finished.
+
+    With resume, stacks the journal says already finished with the same
+    deploy_fingerprint are skipped.
+
+    failure_policy says what to do when a stack fails to deploy:
+
+    fail-fast
+        Don't start any more stacks and cancel the stacks being deployed
+
+    continue-independent
+        Skip the stacks that depend on the failed stack and keep deploying
+        everything else
+
+    Once everything has settled we log a summary and complain with
+    FailedDeployment if anything failed. The DeployReport of the last deploy
+    is kept on deployer.report.
+
+    If we have an output cache then the outputs of each stack are invalidated
+    after it is deployed. If we have render then stacks that weren't rendered
+    while being prepared are rendered with it once their dependencies are
+    deployed, so references to the outputs of those dependencies are resolved
+    from what they output now.
+
+    With dry_run we only log what we would deploy. No stacks are started and
+    nothing is written to the journal or durations.
+
+    sleep is used to wait poll_interval seconds between checking on trackers
+    and clock is a function returning the current time in seconds.
+    """
+    FAIL_FAST = "fail-fast"
+    CONTINUE_INDEPENDENT = "continue-independent"
+    failure_policies = (FAIL_FAST, CONTINUE_INDEPENDENT)
+
+    LAYERED = "layered"
+    DAG = "dag"
+    CRITICAL_PATH = "critical-path"
+    strategies = (CRITICAL_PATH, DAG, LAYERED)
+
+    def __init__(self, journal=None, resume=False, dry_run=False, outputs=None, render=None, max_parallel=1, failure_policy=FAIL_FAST, strategy=CRITICAL_PATH, durations=None, resources=None, preparation=None, progress=None, metrics=None, poll_interval=5, sleep=time.sleep, clock=time.time):
+        if failure_policy not in self.failure_policies:
+            raise CloudCityError("Unknown failure policy", got=failure_policy, available=list(self.failure_policies))
+        if strategy not in self.strategies:
+            raise CloudCityError("Unknown scheduling strategy", got=strategy, available=list(self.strategies))
+        if max_parallel < 1:
+            raise CloudCityError("Need to deploy at least one stack at a time", max_parallel=max_parallel)
+
+        if durations is None:
+            durations = Durations()
+        if resources is None:
+            resources = ResourceLimits()
+        if metrics is None:
+            metrics = Metrics()
+
+        self.clock = clock
+        self.sleep = sleep
+        self.resume = resume
+        self.journal = journal
+        self.dry_run = dry_run
+        self.render = render
+        self.outputs = outputs
+        self.max_parallel = max_parallel
+        self.poll_interval = poll_interval
+        self.strategy = strategy
+        self.failure_policy = failure_policy
+        self.durations = durations
+        self.resources = resources
+        self.metrics = metrics
+        self.progress = progress
+        self.preparation = preparation
+
+    def deploy(self, layers):
+        """Deploy all the stacks in these layers and return a DeployReport"""
+        completed = {}
+        if self.resume and self.journal is not None:
+            completed = self.journal.completed()
+
+        if self.dry_run:
+            return self.pretend(layers, completed)
+
+        report = self.report = DeployReport()
+        stacks = dict((name, stack) for layer in layers.layered for name, stack in layer)
+        waiting = [name for layer in layers.layered for name, _ in layer]
+        layer_of = dict((name, index) for index, layer in enumerate(layers.layered) for name, _ in layer)
+        in_flight = {}
+        stopping = False
+        keys = {}
+        ready_at = {}
+
+        paths = self.durations.critical_paths(stacks)
+        if paths:
+            log.info("Expecting the deploy to take about %s", readable_duration(max(paths.values())))
+
+        try:
+            while waiting or in_flight:
+                progressed = False
+
+                if not stopping:
+                    for name in self.ready(waiting, stacks, report, in_flight, paths, keys, ready_at, layer_of):
+                        waiting.remove(name)
+                        progressed = True
+                        fingerprint = stacks[name].deploy_fingerprint()
+                        if completed.get(name) == fingerprint:
+                            log.info("Skipping %s, it was already deployed with the same options", name)
+                            report.unchanged.append(name)
+                        else:
+                            tracker = self.start_stack(name, stacks[name], fingerprint)
+                            in_flight[name] = (fingerprint, tracker, self.clock())
+                            self.metrics.observe("cloudcity_stack_wait_seconds", in_flight[name][2] - ready_at[name], stack=name)
+                            if self.progress is not None:
+                                self.progress.started(name)
+                            self.resources.take(keys[name])
+
+                for name, (fingerprint, tracker, started) in sorted(in_flight.items()):
+                    if name not in in_flight:
+                        continue
+                    if self.progress is not None:
+                        self.progress.update(name, tracker.progress_update())
+                    if not tracker.done_yet():
+                        continue
+
+                    progressed = True
+                    del in_flight[name]
+                    self.resources.release(keys[name])
+                    state = tracker.current_state()
+                    took = self.clock() - started
+                    self.metrics.inc("cloudcity_stack_deploys", stack=name, state=state)
+                    self.metrics.observe("cloudcity_stack_deploy_seconds", took, stack=name)
+                    if self.progress is not None:
+                        self.progress.finished(name, state)
+                    if state == Tracker.FINISHED:
+                        self.durations.record(name, took)
+                        self.finish_stack(name, fingerprint)
+                        report.deployed.append(name)
+                        if waiting or in_flight:
+                            log.info("About %s left", readable_duration(self.remaining(waiting, in_flight, paths)))
+                        continue
+
+                    log.error("Failed to deploy %s (%s)", name, state)
+                    report.failed[name] = state
+                    if self.failure_policy == self.FAIL_FAST:
+                        stopping = True
+                        report.skipped.extend(waiting)
+                        del waiting[:]
+                        self.cancel(in_flight, stacks, report, keys)
+                    else:
+                        blocked = layers.impacted_by([name])
+                        for dependent in [n for n in waiting if n in blocked]:
+                            log.warning("Skipping %s, it depends on %s which failed", dependent, name)
+                            waiting.remove(dependent)
+                            report.skipped.append(dependent)
+
+                if self.progress is not None:
+                    self.progress.render_if_due()
+
+                if not progressed:
+                    if in_flight:
+                        self.sleep(self.poll_interval)
+                    elif self.preparation is not None and self.preparation.pending:
+                        self.preparation.wait(self.poll_interval)
+                    else:
+                        raise CloudCityError("Stacks are waiting on dependencies that will never be deployed", waiting=waiting)
+        finally:
+            self.durations.save()
+
+        for line in report.summary():
+            log.info(line)
+
+        if not report.succeeded:
+            raise FailedDeployment(failed=sorted(report.failed), cancelled=report.cancelled, skipped=report.skipped)
+        return report
+
+    def pretend(self, layers, completed):
+        """Log what deploy would do, in layer order, without deploying anything and return a DeployReport"""
+        report = self.report = DeployReport()
+        for layer in layers.layered:
+            for name, stack in layer:
+                if completed.get(name) == stack.deploy_fingerprint():
+                    log.info("Would skip %s, it was already deployed with the same options", name)
+                    report.unchanged.append(name)
+                else:
+                    log.info("Would deploy %s", name)
+
+        log.info("Dry run, so nothing was deployed")
+        return report
+
+    def ready(self, waiting, stacks, report, in_flight, paths, keys, ready_at, layer_of):
+        """
+        Yield the waiting stacks that can be started now, in the order our strategy wants them
+
+        With the critical-path strategy, stacks with equally long critical
+        paths go in the order they were layered.
+
+        The resource keys of each stack are found into keys once it's prepared
+        and when each stack's dependencies were deployed is recorded in ready_at.
+        """
+        while len(in_flight) < self.max_parallel:
+            done = report.done
+            candidates = []
+            current_layer = None
+            if self.strategy == self.LAYERED and waiting:
+                current_layer = min(layer_of[name] for name in list(waiting) + list(in_flight))
+            for name in waiting:
+                if self.strategy == self.LAYERED and layer_of[name] != current_layer:
+                    continue
+                if not all(dep in done or dep not in stacks for dep in stacks[name].dependencies):
+                    continue
+                if name not in ready_at:
+                    ready_at[name] = self.clock()
+                if self.preparation is not None and not self.preparation.is_prepared(name):
+                    continue
+                if name not in keys:
+                    # Render first so the keys come from the rendered options rather than the templates
+                    if self.render is not None and stacks[name].rendered is None:
+                        self.render(name)
+                    keys[name] = stacks[name].resource_keys()
+                if self.resources.has_room(keys[name]):
+                    candidates.append(name)
+
+            if not candidates:
+                return
+            if self.strategy == self.CRITICAL_PATH:
+                yield min(candidates, key=lambda name: -paths[name])
+            else:
+                yield candidates[0]
+
+    def remaining(self, waiting, in_flight, paths):
+        """Return how many seconds we expect the rest of the deploy to take"""
+        now = self.clock()
+        remaining = [paths[name] for name in waiting]
+        remaining.extend(paths[name] - (now - started) for name, (_, _, started) in in_flight.items())
+        return max([0] + remaining)
+
+    def cancel(self, in_flight, stacks, report, keys):
+        """Cancel the in flight stacks that know how to be cancelled and leave the rest to finish"""
+        for name in sorted(in_flight):
+            if stacks[name].cancel_deployment():
+                log.warning("Cancelled deploying %s", name)
+                del in_flight[name]
+                self.resources.release(keys[name])
+                report.cancelled.append(name)
+
+    def start_stack(self, stack_name, stack_obj, fingerprint):
+        """Start deploying one stack and return it's tracker"""
+        log.info("Deploying %s", stack_name)
+        if self.journal is not None:
+            self.journal.record(Journal.STARTED, stack_name, fingerprint)
+
+        stack_obj.start_deployment()
+        return stack_obj.deployment_tracker()
+
+    def finish_stack(self, stack_name, fingerprint):
+        """Record that a stack finished deploying"""
+        log.info("Finished deploying %s", stack_name)
+        if self.journal is not None:
+            self.journal.record(Journal.FINISHED, stack_name, fingerprint)
+
+        if self.outputs is not None:
+            self.outputs.invalidate(stack_name)
@@ -0,0 +1,92 @@
+import logging
+import json
+import os
+
+log = logging.getLogger("durations")
+
+class Durations(object):
+    """
+    A persistent record of how long each stack takes to deploy
+
+    Usage::
+
+        durations = Durations("/path/to/durations.json")
+        durations.record("app", 340)
+        durations.save()
+
+        # In a later run
+        durations.estimate("app")
+        # 340
+
+    We keep a moving average of the last few deploys of each stack, weighting
+    the newest deploy by ``weight``. Stacks we haven't seen are estimated to
+    take as long as the average of the stacks we have seen, or ``default``
+    seconds if we haven't seen any.
+    """
+    version = 1
+
+    def __init__(self, location=None, weight=0.5, default=60):
+        self.weight = weight
+        self.default = default
+        self.location = location
+        self.stacks = {}
+        self.load()
+
+    def load(self):
+        """Load the durations from disk if they are there"""
+        if self.location is None or not os.path.exists(self.location):
+            return
+
+        try:
+            with open(self.location) as fle:
+                dct = json.load(fle)
+        except (IOError, ValueError) as error:
+            log.warning("Ignoring unreadable deploy durations at %s (%s)", self.location, error)
+            return
+
+        if dct.get("version") == self.version:
+            self.stacks = dct["stacks"]
+
+    def save(self):
+        """Save the durations to disk"""
+        if self.location is None:
+            return
+
+        with open(self.location, "w") as fle:
+            json.dump({"version": self.version, "stacks": self.stacks}, fle, sort_keys=True, separators=(',', ':'))
+
+    def record(self, stack, duration):
+        """Record how many seconds it took to deploy this stack"""
+        if stack in self.stacks:
+            duration = self.weight * duration + (1 - self.weight) * self.stacks[stack]
+        self.stacks[stack] = duration
+
+    def estimate(self, stack):
+        """Return how many seconds we expect this stack to take to deploy"""
+        if stack in self.stacks:
+            return self.stacks[stack]
+        if self.stacks:
+            return sum(self.stacks.values()) / float(len(self.stacks))
+        return self.default
+
+    def critical_paths(self, stacks):
+        """
+        Return {name: seconds} for the longest chain of deploys that starts with each stack
+
+        stacks is {name: stack} and only dependencies between these stacks count.
+        """
+        dependents = dict((name, []) for name in stacks)
+        for name, stack in stacks.items():
+            for dependency in stack.dependencies:
+                if dependency in dependents:
+                    dependents[dependency].append(name)
+
+        paths = {}
+        def path(name):
+            if name not in paths:
+                paths[name] = self.estimate(name) + max([path(dependent) for dependent in dependents[name]] or [0])
+            return paths[name]
+
+        for name in stacks:
+            path(name)
+        return paths
@@ -38,6 +38,9 @@ class MissingMandatoryOptions(CloudCityError):
 class StackDepCycle(BadStack):
     desc = "Stack dependency cycle"
 
+class InvalidConfiguration(BadConfig):
+    desc = "Configuration is invalid"
+
 class FailedConfigPickup(BadConfig):
     desc = "Failed to pickup configs"
 
@@ -50,6 +53,9 @@ class BadConfigResolver(BadConfig):
 class BadOptionFormat(BadConfig):
     desc = "Bad option format string"
 
+class OptionReferenceCycle(BadOptionFormat):
+    desc = "Option reference cycle"
+
 class UnknownStackType(BadConfig):
     desc = "Resolving an unknown stack type"
 
@@ -59,3 +65,11 @@ class BadStackKls(BadConfig):
 class BadImport(BadConfig):
     desc = "Something wrong with an import string"
 
+class BadPlan(CloudCityError):
+    desc = "Bad plan"
+
+class BadJournal(CloudCityError):
+    desc = "Bad journal"
+
+class FailedDeployment(CloudCityError):
+    desc = "Stack failed to deploy"
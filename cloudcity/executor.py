@@ -1,10 +1,28 @@
+from cloudcity.profiling import Profiler, NoProfiler
 from cloudcity.bootstrap import BootStrapper
+from cloudcity.compiler import ConfigCompiler
+from cloudcity.resources import ResourceLimits
+from cloudcity.logs import QueueHandler, QueueListener, JsonFormatter
+from cloudcity.uploads import Uploader, FolderStore, Manifest
+from cloudcity.preparation import Preparation
+from cloudcity.progress import ProgressView, ProgressHandler
+from cloudcity.resolution.outputs import OutputCache, StackOutputs
+from cloudcity.configurations import ReferenceResolver
+from cloudcity.resolution.resolver import StackResolver
+from cloudcity.simulation import Simulation, Latency
+from cloudcity.clients import ClientPool
+from cloudcity.metrics import Metrics
+from cloudcity.durations import Durations
+from cloudcity.deployer import Deployer
+from cloudcity.journal import Journal
+from cloudcity.plan import Plan
 from cloudcity.errors import CloudCityError
 
 from rainbow_logging_handler import RainbowLoggingHandler
 from option_merge import MergedOptions
 import argparse
 import logging
+import Queue
 import sys
 import os
 import re
@@ -48,15 +66,74 @@ def key_value_pair(value):
 
     return value
 
-def setup_logging():
+def positive_int(value):
+    """Argparse type for a whole number of at least one"""
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError("Expecting a positive number")
+    return int(value)
+
+def resource_limit(value):
+    """Argparse type for a <resource glob>,<limit> pair"""
+    if ',' not in value:
+        raise ValueError("Expecting a <resource>,<limit> pair, found no comma")
+
+    glob, limit = value.rsplit(",", 1)
+    if not glob:
+        raise ValueError("The resource may not be empty")
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValueError("The limit must be a positive number")
+
+    return glob, int(limit)
+
+def latency(value):
+    """Argparse type for a latency distribution"""
+    try:
+        return Latency.parse(value)
+    except CloudCityError as error:
+        raise ValueError(str(error))
+
+def client_factory(value):
+    """Argparse type for a <module>:<callable> import string"""
+    try:
+        return StackResolver().import_obj(value)
+    except CloudCityError as error:
+        raise ValueError(str(error))
+
+def setup_logging(queued=False, json_output=False, progress=None):
+    """
+    Log to stderr, in colour or as lines of json
+
+    If queued then logging only puts records onto a queue and a single thread
+    formats and writes them. We return the QueueListener doing that, which
+    needs to be stopped before we exit so nothing is lost.
+
+    If we have a ProgressView drawing on stderr then records are written
+    through a ProgressHandler so they aren't drawn over.
+    """
     log = logging.getLogger("")
-    handler = RainbowLoggingHandler(sys.stderr)
-    handler._column_color['%(asctime)s'] = ('cyan', None, False)
-    handler._column_color['%(levelname)-7s'] = ('green', None, False)
-    handler._column_color['%(message)s'][logging.INFO] = ('blue', None, False)
-    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)-15s %(message)s"))
+    if json_output:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler = RainbowLoggingHandler(sys.stderr)
+        handler._column_color['%(asctime)s'] = ('cyan', None, False)
+        handler._column_color['%(levelname)-7s'] = ('green', None, False)
+        handler._column_color['%(message)s'][logging.INFO] = ('blue', None, False)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)-15s %(message)s"))
+
+    if progress is not None:
+        handler = ProgressHandler(progress, handler)
+
+    listener = None
+    if queued:
+        queue = Queue.Queue()
+        listener = QueueListener(queue, handler)
+        listener.start()
+        handler = QueueHandler(queue)
+
     log.addHandler(handler)
     log.setLevel(logging.INFO)
+    return listener
 
 def get_parser():
     parser = argparse.ArgumentParser(description="Cloudcity executor")
@@ -64,7 +141,6 @@ def get_parser():
     parser.add_argument("--configs"
         , help = "Folder where we can find all the configuration"
         , type = readable_folder
-        , required = True
         , action = 'append'
         )
 
@@ -77,7 +153,11 @@ def get_parser():
 
     parser.add_argument("--execute"
         , help = "The stack to execute"
-        , required = True
+        )
+
+    parser.add_argument("--changed"
+        , help = "A stack name or config file that changed. Prints the stacks that need redeploying, in deploy order, instead of deploying"
+        , action = 'append'
         )
 
     parser.add_argument("--dry-run"
@@ -100,37 +180,393 @@ def get_parser():
         , dest = "mandatory_options"
         )
 
+    parser.add_argument("--stream-configs"
+        , help = "Merge each config file as soon as it's read instead of holding onto every file until the end. Only the stacks --execute needs are kept, which means reading the config files twice unless there is a --config-index"
+        , action = "store_true"
+        )
+
+    parser.add_argument("--config-index"
+        , help = "File to keep an index of which config files define each stack in. Used to only read the files needed for --execute"
+        )
+
+    parser.add_argument("--plan-out"
+        , help = "Write the computed plan to this file"
+        )
+
+    parser.add_argument("--render-processes"
+        , help = "How many processes to use for rendering templated options. Defaults to the number of cpus"
+        , type = int
+        )
+
+    parser.add_argument("--profile"
+        , help = "Folder to write cProfile and memory stats for each phase into"
+        )
+
+    parser.add_argument("--plan-in"
+        , help = "Deploy a plan written by --plan-out instead of finding and resolving configuration. The plan isn't checked against the current configuration, so plan again if that has changed"
+        )
+
+    parser.add_argument("--journal"
+        , help = "File to record the start and finish of each stack's deployment in"
+        )
+
+    parser.add_argument("--resume"
+        , help = "Skip stacks that the --journal says already finished deploying with the same options"
+        , action = "store_true"
+        )
+
+    parser.add_argument("--max-parallel"
+        , help = "How many stacks to deploy at the same time"
+        , type = int
+        , default = 1
+        )
+
+    parser.add_argument("--on-failure"
+        , help = "Whether to stop everything when a stack fails or keep deploying the stacks that don't depend on it"
+        , choices = Deployer.failure_policies
+        , default = Deployer.FAIL_FAST
+        )
+
+    parser.add_argument("--strategy"
+        , help = "How to choose which stacks to start when there is room for more"
+        , choices = Deployer.strategies
+        , default = Deployer.CRITICAL_PATH
+        )
+
+    parser.add_argument("--durations"
+        , help = "File to remember how long each stack takes to deploy in. Used to start the slowest chains of stacks first and estimate how long is left"
+        )
+
+    parser.add_argument("--resource-limit"
+        , help = "How many stacks may deploy against matching resources at once. i.e. --resource-limit 'account=123456789,2' or --resource-limit 'region=*,4'"
+        , type = resource_limit
+        , dest = "resource_limits"
+        , action = "append"
+        )
+
+    parser.add_argument("--default-resource-limit"
+        , help = "How many stacks may deploy against each resource that doesn't match a --resource-limit. Unlimited by default"
+        , type = positive_int
+        )
+
+    parser.add_argument("--client-factory"
+        , help = "Function that makes a backend client for a region and account, shared by every stack that asks for one. i.e. --client-factory 'my_plugin.clients:make_client'"
+        , type = client_factory
+        )
+
+    parser.add_argument("--artifact-store"
+        , help = "Folder to upload the templates and artifacts of our stacks to"
+        )
+
+    parser.add_argument("--upload-manifest"
+        , help = "File to remember which artifacts are already in the --artifact-store in"
+        )
+
+    parser.add_argument("--log-queue"
+        , help = "Write logs from a single background thread so deploying doesn't wait on writing them"
+        , action = "store_true"
+        )
+
+    parser.add_argument("--log-format"
+        , help = "Log in colour for people or as lines of json for machines"
+        , choices = ["text", "json"]
+        , default = "text"
+        )
+
+    parser.add_argument("--progress"
+        , help = "Show what each deploying stack is up to, redrawn at most every --progress-interval seconds"
+        , action = "store_true"
+        )
+
+    parser.add_argument("--progress-interval"
+        , help = "How many seconds to wait between drawing progress"
+        , type = float
+        , default = 1
+        )
+
+    parser.add_argument("--progress-log"
+        , help = "File to write every progress event from every stack into when using --progress"
+        )
+
+    parser.add_argument("--metrics-out"
+        , help = "File to write counters and histograms about the run into, in the OpenMetrics text format"
+        )
+
+    parser.add_argument("--pipeline"
+        , help = "Render and check the existence of each layer of stacks in the background while the layers before it deploy"
+        , action = "store_true"
+        )
+
+    return parser
+
+def get_compile_parser():
+    parser = argparse.ArgumentParser(description="Compile cloudcity configuration into msgpack")
+
+    parser.add_argument("--configs"
+        , help = "Folder where we can find all the configuration"
+        , type = readable_folder
+        , required = True
+        , action = 'append'
+        )
+
+    parser.add_argument("--output"
+        , help = "Folder to put the compiled configuration in"
+        , required = True
+        )
+
+    return parser
+
+def get_simulate_parser():
+    parser = argparse.ArgumentParser(description="Simulate deploying a plan or a made up graph of stacks and report how long each scheduling strategy takes")
+
+    parser.add_argument("--plan-in"
+        , help = "Simulate the stacks in a plan written by --plan-out"
+        )
+
+    parser.add_argument("--durations"
+        , help = "File written by --durations to take the time of each stack in the plan from"
+        )
+
+    parser.add_argument("--synthetic"
+        , help = "Simulate this many made up stacks instead of a plan"
+        , type = int
+        )
+
+    parser.add_argument("--latency"
+        , help = "How long stacks take to deploy, i.e. fixed:60, uniform:30:90 or lognormal:4:0.5"
+        , type = latency
+        , default = "lognormal:4:0.5"
+        )
+
+    parser.add_argument("--failure-rate"
+        , help = "How often a stack fails to deploy, between 0 and 1"
+        , type = float
+        , default = 0
+        )
+
+    parser.add_argument("--quota"
+        , help = "How many deploys the fake backend allows against matching resources before throttling. i.e. --quota 'account=*,3'"
+        , type = resource_limit
+        , dest = "quotas"
+        , action = "append"
+        )
+
+    parser.add_argument("--resource-limit"
+        , help = "Same as for cloudcity"
+        , type = resource_limit
+        , dest = "resource_limits"
+        , action = "append"
+        )
+
+    parser.add_argument("--max-parallel"
+        , help = "How many stacks to deploy at the same time"
+        , type = int
+        , default = 10
+        )
+
+    parser.add_argument("--strategy"
+        , help = "Strategy to simulate. Defaults to all of them"
+        , choices = Deployer.strategies
+        , dest = "strategies"
+        , action = "append"
+        )
+
+    parser.add_argument("--seed"
+        , help = "Seed for everything random"
+        , type = int
+        , default = 0
+        )
+
     return parser
 
-def deploy(layers):
+def deploy(layers, args, preparation=None, metrics=None, outputs=None, render=None, progress=None):
     """Deploy a particular stack and all it's dependencies"""
+    journal = None
+    if args.journal is not None:
+        journal = Journal(args.journal)
+    durations = Durations(args.durations)
+    resources = ResourceLimits(args.resource_limits, args.default_resource_limit)
+
+    deployer = Deployer(
+          journal = journal
+        , resume = args.resume
+        , dry_run = args.dry_run
+        , outputs = outputs
+        , render = render
+        , max_parallel = args.max_parallel
+        , failure_policy = args.on_failure
+        , strategy = args.strategy
+        , durations = durations
+        , resources = resources
+        , preparation = preparation
+        , progress = progress
+        , metrics = metrics
+        )
+
+    deployer.deploy(layers)
+
+def show_impacted(layers):
+    """Print the stacks in these layers, one per line, in the order they should be deployed"""
     for layer in layers.layered:
         for stack_name, stack_obj in layer:
-            log.info("Deploying %s", stack_name)
+            print stack_name
+
+def find_layers(bootstrap, args):
+    """
+    Find and resolve the configuration and return the layers we want to deploy
+
+    Returns None if we only wanted to show the stacks impacted by --changed
+    """
+    glbls = MergedOptions.using({"global": {"no_resolve": True}})
+
+    forced = MergedOptions.using(
+          MergedOptions.KeyValuePairs(args.options or [])
+        , MergedOptions.Attributes(args, ("environment", "resolve_order", "dry_run", "mandatory_options"), lift="global", ignoreable_values=(None, ))
+        )
+
+    if forced:
+        log.info("Setting some options: %s", ' | '.join("[{}:{}]".format(key, val) for key, val in forced.as_flat()))
+        glbls.options.extend(forced.options)
+
+    log.info("Looking in %s for configuration", args.configs)
+    wanted = only_files = None
+    if (args.config_index or args.stream_configs) and not args.changed:
+        # Without a --config-index we make one in memory, so streaming only keeps what the target needs
+        wanted, only_files = bootstrap.scope_with_index(args.configs, args.config_index, args.execute)
+
+    resolved = bootstrap.find_configurations(args.configs, glbls, streaming=args.stream_configs, wanted=wanted, only_files=only_files)
+
+    # global.dry_run can also be set with --option, and the Deployer only looks at args.dry_run
+    args.dry_run = bool(args.dry_run or resolved["global"].get("dry_run", False))
+
+    if args.changed:
+        show_impacted(bootstrap.get_impacted_layers(resolved, args.changed))
+        return
+
+    layers = bootstrap.get_layers(resolved, args.execute)
+    if args.plan_out:
+        Plan.from_layers(args.execute, layers).write(args.plan_out)
+    return layers
 
 def main(argv=None):
     parser = get_parser()
     args = parser.parse_args(argv)
-    setup_logging()
+    if not args.plan_in:
+        if not args.configs:
+            parser.error("Need --configs unless using --plan-in")
+        if not args.execute and not args.changed:
+            parser.error("Need either --execute or --changed")
+    if args.resume and not args.journal:
+        parser.error("Need --journal to --resume")
+    if args.progress_log and not args.progress:
+        parser.error("Need --progress to use --progress-log")
+
+    progress = None
+    if args.progress:
+        progress = ProgressView(events_location=args.progress_log, interval=args.progress_interval)
+    listener = setup_logging(queued=args.log_queue, json_output=args.log_format == "json", progress=progress)
+
+    profiler = NoProfiler()
+    if args.profile:
+        profiler = Profiler(args.profile)
+
+    uploader = None
+    if args.artifact_store:
+        uploader = Uploader(FolderStore(args.artifact_store), Manifest(args.upload_manifest))
 
+    metrics = Metrics()
+    client_pool = ClientPool(args.client_factory)
+    bootstrap = BootStrapper(profiler, client_pool=client_pool, uploader=uploader, metrics=metrics, dry_run=args.dry_run)
     try:
-        bootstrap = BootStrapper()
-        glbls = MergedOptions.using({"global": {"no_resolve": True}})
+        if args.plan_in:
+            with profiler.phase("read_plan"):
+                layers = Plan.read(args.plan_in).layers()
+            bootstrap.check_mandatory_options(layers, args.mandatory_options)
+        else:
+            layers = find_layers(bootstrap, args)
+        # find_layers may have turned on dry_run from global.dry_run
+        bootstrap.dry_run = args.dry_run
 
-        forced = MergedOptions.using(
-              MergedOptions.KeyValuePairs(args.options or [])
-            , MergedOptions.Attributes(args, ("environment", "resolve_order", "dry_run", "mandatory_options"), lift="global", ignoreable_values=(None, ))
-            )
+        if layers is not None:
+            preparation = None
+            bootstrap.use_clients(layers)
+            outputs = OutputCache(StackOutputs(dict(stack for layer in layers.layered for stack in layer)))
 
-        if forced:
-            log.info("Setting some options: %s", ' | '.join("[{}:{}]".format(key, val) for key, val in forced.as_flat()))
-            glbls.options.extend(forced.options)
+            # The profiler can only follow one thread and would make a phase for every stack rendered while deploying
+            # So the work in the background and during the deploy isn't profiled
+            unprofiled = BootStrapper(client_pool=bootstrap.client_pool, uploader=uploader, metrics=metrics, dry_run=args.dry_run)
+            # One resolver for the run, so each reference is resolved once however many times we render
+            # Values that come from outputs aren't remembered, so they still follow the OutputCache
+            resolver = ReferenceResolver(bootstrap.stack_options(layers), outputs)
+            render = lambda name: unprofiled.render_stacks(layers, 1, [name], resolver=resolver)
 
-        log.info("Looking in %s for configuration", args.configs)
-        resolved = bootstrap.find_configurations(args.configs, glbls)
+            if args.pipeline:
+                preparation = Preparation(layers, lambda names: unprofiled.prepare_stacks(layers, names, args.render_processes, resolver=resolver))
+                preparation.start()
+            else:
+                bootstrap.prepare_stacks(layers, processes=args.render_processes, resolver=resolver)
+            with profiler.phase("deploy"):
+                deploy(layers, args, preparation, metrics, outputs, render, progress)
+    except CloudCityError as error:
+        print ""
+        print "!" * 80
+        print "Something went wrong! -- {0}".format(error.__class__.__name__)
+        print "\t{0}".format(error)
+        sys.exit(1)
+    finally:
+        bootstrap.client_pool.close()
+        if progress is not None:
+            progress.close()
+        if args.profile:
+            print profiler.summary()
+        try:
+            if args.metrics_out:
+                # Failing to write the metrics shouldn't hide what went wrong in the deploy
+                try:
+                    metrics.write(args.metrics_out)
+                except (IOError, OSError) as error:
+                    log.error("Failed to write metrics to %s (%s)", args.metrics_out, error)
+        finally:
+            if listener is not None:
+                listener.stop()
+
+def compile_configs_main(argv=None):
+    parser = get_compile_parser()
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    try:
+        ConfigCompiler(args.output).compile(args.configs)
+    except CloudCityError as error:
+        print ""
+        print "!" * 80
+        print "Something went wrong! -- {0}".format(error.__class__.__name__)
+        print "\t{0}".format(error)
+        sys.exit(1)
+
+def simulate_main(argv=None):
+    parser = get_simulate_parser()
+    args = parser.parse_args(argv)
+    if bool(args.plan_in) == bool(args.synthetic):
+        parser.error("Need one of --plan-in or --synthetic")
+    setup_logging()
+    logging.getLogger("").setLevel(logging.WARNING)
+    # The report already counts the skipped stacks, so the warning for each one would just bury the table
+    logging.getLogger("deployer").setLevel(logging.ERROR)
+
+    try:
+        options = dict(latency=args.latency, failure_rate=args.failure_rate, quotas=args.quotas, seed=args.seed)
+        if args.plan_in:
+            durations = Durations(args.durations) if args.durations else None
+            simulation = Simulation.from_plan(Plan.read(args.plan_in), durations, **options)
+        else:
+            simulation = Simulation.synthetic(args.synthetic, **options)
 
-        layers = bootstrap.get_layers(resolved, args.execute)
-        deploy(layers)
+        print "{0:<15} {1:>12} {2:>9} {3:>7} {4:>8} {5:>10}".format("Strategy", "Makespan", "Deployed", "Failed", "Skipped", "Throttles")
+        for strategy in args.strategies or Deployer.strategies:
+            resources = ResourceLimits(args.resource_limits)
+            result = simulation.run(strategy, args.max_parallel, resources=resources)
+            print "{strategy:<15} {makespan:>12.1f} {deployed:>9} {failed:>7} {skipped:>8} {throttles:>10}".format(**result)
     except CloudCityError as error:
         print ""
         print "!" * 80
@@ -0,0 +1,77 @@
+from cloudcity.errors import BadJournal
+
+import logging
+import json
+import time
+import os
+
+log = logging.getLogger("journal")
+
+class Journal(object):
+    """
+    An append only record of which stacks have been deployed
+
+    Usage::
+
+        journal = Journal("deploy.journal")
+        journal.record(Journal.STARTED, "app", fingerprint)
+        journal.record(Journal.FINISHED, "app", fingerprint)
+
+        # In a later run
+        journal.completed()
+        # {"app": fingerprint}
+
+    Each entry is a line of json that is flushed to disk before record returns,
+    so the journal survives the deploy dying. A half written last line, from
+    dying while writing it, is ignored.
+    """
+    STARTED = "started"
+    FINISHED = "finished"
+
+    def __init__(self, location, clock=time.time):
+        self.clock = clock
+        self.location = location
+
+    def record(self, event, stack, fingerprint):
+        """Append an event for this stack to the journal"""
+        entry = {"event": event, "stack": stack, "fingerprint": fingerprint, "time": self.clock()}
+        with open(self.location, "a") as fle:
+            fle.write(json.dumps(entry, sort_keys=True))
+            fle.write("\n")
+            fle.flush()
+            os.fsync(fle.fileno())
+
+    def entries(self):
+        """Yield the entries in the journal"""
+        if not os.path.exists(self.location):
+            return
+
+        try:
+            with open(self.location) as fle:
+                lines = fle.readlines()
+        except IOError as error:
+            raise BadJournal("Couldn't read the journal", location=self.location, error=error)
+
+        for number, line in enumerate(lines):
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                if number == len(lines) - 1:
+                    log.warning("Ignoring incomplete last entry in the journal at %s", self.location)
+                else:
+                    raise BadJournal("Couldn't read an entry in the journal", location=self.location, line=number + 1, error=error)
+
+    def completed(self):
+        """
+        Return {stack: fingerprint} for the stacks that finished deploying
+
+        Stacks that were started again after finishing are only completed
+        if they finished again.
+        """
+        completed = {}
+        for entry in self.entries():
+            if entry["event"] == self.FINISHED:
+                completed[entry["stack"]] = entry["fingerprint"]
+            elif entry["event"] == self.STARTED:
+                completed.pop(entry["stack"], None)
+        return completed
@@ -0,0 +1,65 @@
+class KeyPath(object):
+    """
+    A dot separated key that has already been split
+
+    key
+        The original string
+
+    parts
+        Tuple of each part of the key
+
+    root
+        The first part of the key, usually the name of a stack
+
+    rest
+        Everything after the root as a dot separated string, or None if there is only a root
+
+    type_key
+        The key for the type of the root stack
+    """
+    __slots__ = ("key", "parts", "root", "rest", "type_key")
+
+    def __init__(self, key):
+        self.key = key
+        self.parts = tuple(key.split("."))
+        self.root = self.parts[0]
+        self.rest = key[len(self.root) + 1:] if len(self.parts) > 1 else None
+        self.type_key = "{0}.type".format(self.root)
+
+    def __str__(self):
+        return self.key
+
+    def __repr__(self):
+        return "<KeyPath {0}>".format(self.key)
+
+    def __eq__(self, other):
+        if isinstance(other, KeyPath):
+            return self.key == other.key
+        return self.key == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+# KeyPaths we have made so far, keyed by the string they were made from
+# It's emptied when it gets to max_cached so it can't grow forever over a long process
+cache = {}
+max_cached = 100000
+
+def key_path(key):
+    """
+    Return the one KeyPath for this key
+
+    So we only split each distinct key once however many times we look at it,
+    at least until there are more than max_cached keys and we start again.
+    """
+    path = cache.get(key)
+    if path is None:
+        if len(cache) >= max_cached:
+            cache.clear()
+        if type(key) is str:
+            key = intern(key)
+        path = cache[key] = KeyPath(key)
+    return path
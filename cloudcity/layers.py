@@ -1,4 +1,6 @@
-from cloudcity.errors import StackDepCycle
+from cloudcity.errors import StackDepCycle, CloudCityError
+
+from collections import defaultdict
 
 class Layers(object):
     """
@@ -17,11 +19,18 @@ class Layers(object):
     and only add a stack to a layer that occurs after all it's dependencies.
 
     Cyclic dependencies will be complained about.
+
+    We can also layer only the stacks affected by a change::
+
+        layers.add_impacted_to_layers(["stack1"])
+
+    Which only adds stack1 and everything that transitively depends on it.
     """
     def __init__(self, stacks):
         self.stacks = stacks
         self.accounted = {}
         self._layered = []
+        self._dependents = None
 
     def reset(self):
         """Make a clean slate (initialize layered and accounted on the instance)"""
@@ -39,6 +48,84 @@ class Layers(object):
             result.append(nxt)
         return result
 
+    @property
+    def dependents(self):
+        """Reverse of the dependencies: {name: set([stacks that depend directly on name]), ...}"""
+        if self._dependents is None:
+            dependents = defaultdict(set)
+            for name, stack in self.stacks.items():
+                for dependency in stack.dependencies:
+                    dependents[dependency].add(name)
+            self._dependents = dependents
+        return self._dependents
+
+    def impacted_by(self, changed):
+        """Return the set of changed stacks and every stack that transitively depends on them"""
+        missing = [name for name in changed if name not in self.stacks]
+        if missing:
+            raise CloudCityError("Missing stack", available=sorted(self.stacks), wanted=sorted(missing))
+
+        impacted = set(changed)
+        queue = list(changed)
+        while queue:
+            for dependent in self.dependents.get(queue.pop(), ()):
+                if dependent not in impacted:
+                    impacted.add(dependent)
+                    queue.append(dependent)
+        return impacted
+
+    def add_impacted_to_layers(self, changed):
+        """
+        Add only the changed stacks and everything that depends on them to layered
+
+        Dependencies outside of that set are assumed to be deployed already
+        and don't affect which layer a stack ends up in.
+        """
+        impacted = self.impacted_by(changed)
+
+        levels = {}
+        for name in sorted(impacted):
+            self.impacted_level(name, impacted, levels)
+
+        layered = self._layered
+        for name in sorted(impacted):
+            if name in self.accounted:
+                continue
+            self.accounted[name] = True
+
+            layer = levels[name]
+            while len(layered) <= layer:
+                layered.append([])
+            layered[layer].append(name)
+
+    def impacted_level(self, name, impacted, levels, chain=None):
+        """Record in levels which layer name belongs in, only considering dependencies in impacted"""
+        if name in levels:
+            return levels[name]
+
+        if chain is None:
+            chain = []
+        chain = chain + [name]
+
+        level = 0
+        for dependency in sorted(self.stacks[name].dependencies):
+            if dependency not in impacted:
+                continue
+            if dependency in chain:
+                raise StackDepCycle(chain=chain + [dependency])
+            level = max(level, self.impacted_level(dependency, impacted, levels, chain) + 1)
+
+        levels[name] = level
+        return level
+
+    def use_layered(self, layered):
+        """Use layering that has already been determined, i.e. [[name, ...], [name, ...], ...]"""
+        self.reset()
+        for layer in layered:
+            self._layered.append(list(layer))
+            for name in layer:
+                self.accounted[name] = True
+
     def add_all_to_layers(self):
         """Add all the stacks to layered"""
         for stack in sorted(self.stacks):
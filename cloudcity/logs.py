@@ -0,0 +1,99 @@
+import threading
+import copy
+import logging
+import Queue
+import json
+
+class QueueHandler(logging.Handler):
+    """
+    A logging handler that only puts records onto a queue
+
+    Usage::
+
+        queue = Queue.Queue()
+        logging.getLogger("").addHandler(QueueHandler(queue))
+        listener = QueueListener(queue, logging.StreamHandler())
+        listener.start()
+        ...
+        listener.stop()
+
+    The message is formatted with it's args and any exception is turned into
+    text before the record is queued, so the record doesn't hold onto objects
+    that may change before the listener gets to it.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        # Other handlers on the logger get the same record, so flatten a copy
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+class QueueListener(object):
+    """
+    Takes records off a queue in a single thread and gives them to some handlers
+
+    So formatting and writing records happens in one place and the threads
+    doing the logging don't wait on each other or on the output.
+    """
+    sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.thread = None
+        self.handlers = handlers
+
+    def start(self):
+        """Start taking records off the queue in a background thread"""
+        self.thread = threading.Thread(target=self.run, name="logging")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self.sentinel:
+                break
+            self.handle(record)
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        """Handle everything already on the queue and then stop"""
+        if self.thread is not None:
+            self.queue.put(self.sentinel)
+            self.thread.join()
+            self.thread = None
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one line of json for machines to read"""
+    def format(self, record):
+        dct = {
+              "time": record.created
+            , "level": record.levelname
+            , "name": record.name
+            , "thread": record.threadName
+            , "message": record.getMessage()
+            }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            dct["exception"] = record.exc_text
+
+        return json.dumps(dct, sort_keys=True, default=repr)
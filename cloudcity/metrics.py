@@ -0,0 +1,134 @@
+from cloudcity.errors import CloudCityError
+
+from contextlib import contextmanager
+from collections import defaultdict
+import threading
+import time
+import os
+
+def escape(value):
+    """Escape a label value for the OpenMetrics text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels, extra=()):
+    """Return {name="value",...} for these (name, value) labels"""
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    return "{{{0}}}".format(",".join('{0}="{1}"'.format(name, escape(value)) for name, value in labels))
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+class Metrics(object):
+    """
+    Counters and histograms about a run, written out in the OpenMetrics text format
+
+    Usage::
+
+        metrics = Metrics()
+        metrics.inc("cloudcity_config_files_parsed", format="yaml")
+        with metrics.timer("cloudcity_config_parse_seconds", format="yaml"):
+            ...
+        metrics.write("/var/lib/node_exporter/cloudcity.prom")
+
+    Only the metrics in ``descriptions`` can be used, so every metric has a
+    type and some help. Everything is safe to call from many threads.
+    """
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    descriptions = {
+          "cloudcity_config_files_parsed": ("counter", "Config files that were read")
+        , "cloudcity_config_parse_seconds": ("histogram", "Seconds spent reading each config file")
+        , "cloudcity_stacks_resolved": ("counter", "Stacks resolved from the configuration")
+        , "cloudcity_requirement_checks": ("counter", "References between stacks that were checked")
+        , "cloudcity_layering_seconds": ("histogram", "Seconds spent putting stacks into layers")
+        , "cloudcity_stack_deploy_seconds": ("histogram", "Seconds from starting a stack's deployment until it settled")
+        , "cloudcity_stack_wait_seconds": ("histogram", "Seconds a stack waited to start after it's dependencies were deployed")
+        , "cloudcity_stack_deploys": ("counter", "Stacks that settled, by the state they ended in")
+        , "cloudcity_retries": ("counter", "Calls to the backend that stack types retried")
+        , "cloudcity_throttles": ("counter", "Calls to the backend that were throttled")
+        }
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def check(self, name, kind):
+        if name not in self.descriptions or self.descriptions[name][0] != kind:
+            raise CloudCityError("Unknown metric", name=name, kind=kind)
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        self.check(name, "counter")
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        self.check(name, "histogram")
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            histogram = self.histograms[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how many seconds the body of this context manager takes"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start, **labels)
+
+    def render(self):
+        """Return all the metrics in the OpenMetrics text format"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict((key, dict(val, buckets=list(val["buckets"]))) for key, val in self.histograms.items())
+
+        lines = []
+        for name, (kind, desc) in sorted(self.descriptions.items()):
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            lines.append("# HELP {0} {1}".format(name, desc))
+            if kind == "counter":
+                for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+                    lines.append("{0}_total{1} {2}".format(name, format_labels(labels), format_value(value)))
+            else:
+                for (_, labels), histogram in sorted(item for item in histograms.items() if item[0][0] == name):
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels, [("le", format_value(bound))]), count))
+                    lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels, [("le", "+Inf")]), histogram["count"]))
+                    lines.append("{0}_count{1} {2}".format(name, format_labels(labels), histogram["count"]))
+                    lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), format_value(histogram["sum"])))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, location):
+        """Write the metrics to location, replacing it in one go so readers never see half a file"""
+        tmp = "{0}.tmp".format(location)
+        with open(tmp, "w") as fle:
+            fle.write(self.render())
+        os.rename(tmp, location)
+
+class NoMetrics(Metrics):
+    """
+    Used when nothing wants our metrics, i.e. for stacks used outside of a run
+
+    Nothing is recorded, but we still complain about metrics that don't exist.
+    """
+    def inc(self, name, amount=1, **labels):
+        self.check(name, "counter")
+
+    def observe(self, name, value, **labels):
+        self.check(name, "histogram")
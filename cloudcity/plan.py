@@ -0,0 +1,98 @@
+from cloudcity.resolution.resolver import StackResolver
+from cloudcity.errors import BadPlan
+from cloudcity.layers import Layers
+
+from option_merge import MergedOptions
+import logging
+import gzip
+import json
+
+log = logging.getLogger("plan")
+
+class Plan(object):
+    """
+    A serializable record of what a deploy will do.
+
+    Usage::
+
+        Plan.from_layers(target, layers).write("plan.json.gz")
+
+        # And later, without finding or resolving any configuration
+        layers = Plan.read("plan.json.gz").layers()
+
+    The file is gzipped json holding the version of the format, the target,
+    the layering, the dependencies and resolved options of each stack and
+    a fingerprint of those options.
+
+    The fingerprint is checked against the options in the same file, so it
+    only catches a plan that was changed after it was written. It doesn't
+    know whether the configuration has changed since, so a stale plan is
+    deployed as it was planned.
+    """
+    version = 1
+
+    def __init__(self, target, layered, stacks):
+        self.target = target
+        self.layered = layered
+        self.stacks = stacks
+
+    @classmethod
+    def from_layers(kls, target, layers):
+        """Make a plan from already layered stacks"""
+        layered = []
+        stacks = {}
+        for layer in layers.layered:
+            layered.append([])
+            for name, stack in layer:
+                layered[-1].append(name)
+                stacks[name] = {
+                      "type": stack.options.get("type", "config")
+                    , "options": stack.as_dict()
+                    , "dependencies": sorted(set(stack.dependencies))
+                    , "fingerprint": stack.fingerprint()
+                    }
+        return kls(target, layered, stacks)
+
+    def as_dict(self):
+        return {"version": self.version, "target": self.target, "layered": self.layered, "stacks": self.stacks}
+
+    def write(self, location):
+        """Write this plan to the specified location"""
+        log.info("Writing plan to %s", location)
+        with gzip.open(location, "wb") as fle:
+            json.dump(self.as_dict(), fle, sort_keys=True, separators=(',', ':'), default=str)
+
+    @classmethod
+    def read(kls, location):
+        """Read a plan from the specified location"""
+        log.info("Reading plan from %s", location)
+        try:
+            with gzip.open(location, "rb") as fle:
+                dct = json.load(fle)
+        except (IOError, ValueError) as error:
+            raise BadPlan("Failed to read plan", location=location, error_type=error.__class__.__name__, error=error)
+
+        if dct.get("version") != kls.version:
+            raise BadPlan("Unsupported plan version", location=location, got=dct.get("version"), wanted=kls.version)
+
+        return kls(dct["target"], dct["layered"], dct["stacks"])
+
+    def layers(self, resolver=None):
+        """Return a Layers object with the stacks from this plan"""
+        if resolver is None:
+            resolver = StackResolver()
+            resolver.register_defaults()
+
+        stacks = {}
+        for name, info in self.stacks.items():
+            stack = resolver.resolve(name, MergedOptions.using(info["options"]))
+            stack.add_dependencies(info["dependencies"])
+
+            fingerprint = stack.fingerprint()
+            if fingerprint != info["fingerprint"]:
+                raise BadPlan("Stack options don't match their fingerprint", stack=name, expected=info["fingerprint"], got=fingerprint)
+            stacks[name] = stack
+
+        layers = Layers(stacks)
+        layers.use_layered(self.layered)
+        return layers
@@ -0,0 +1,80 @@
+from cloudcity.errors import CloudCityError
+
+import threading
+import logging
+
+log = logging.getLogger("preparation")
+
+class Preparation(object):
+    """
+    Prepares the stacks in some layers in a background thread, one layer at a time
+
+    Usage::
+
+        preparation = Preparation(layers, lambda names: ...)
+        preparation.start()
+
+        if preparation.is_prepared("app"):
+            ...
+
+    prepare_layer is called with the names of the stacks in each layer, in
+    layer order, so later layers are prepared while earlier layers deploy.
+
+    If preparing a layer raises an exception, the exception is raised by the
+    next call to is_prepared for a stack that isn't prepared yet.
+    """
+    def __init__(self, layers, prepare_layer):
+        self.layers = layers
+        self.prepare_layer = prepare_layer
+
+        self.error = None
+        self.finished = False
+        self.prepared = set()
+        self.condition = threading.Condition()
+
+    def start(self):
+        """Start preparing in a background thread"""
+        thread = threading.Thread(target=self.run, name="preparation")
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        """Prepare each layer in turn"""
+        try:
+            for layer in self.layers.layered:
+                names = [name for name, _ in layer]
+                self.prepare_layer(names)
+                with self.condition:
+                    self.prepared.update(names)
+                    self.condition.notify_all()
+        except Exception as error:
+            log.exception("Failed to prepare stacks")
+            with self.condition:
+                self.error = error
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    @property
+    def pending(self):
+        """Say whether we are still preparing stacks"""
+        with self.condition:
+            return not self.finished
+
+    def is_prepared(self, name):
+        """Say whether this stack is ready to be deployed"""
+        with self.condition:
+            if name in self.prepared:
+                return True
+            if isinstance(self.error, CloudCityError):
+                raise self.error
+            if self.error is not None:
+                raise CloudCityError("Failed to prepare stacks", error_type=self.error.__class__.__name__, error=self.error)
+            return False
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for more stacks to be prepared"""
+        with self.condition:
+            if not self.finished:
+                self.condition.wait(timeout)
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+import resource
+import cProfile
+import logging
+import time
+import os
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+log = logging.getLogger("profiling")
+
+class NoProfiler(object):
+    """Used when we aren't profiling"""
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def summary(self):
+        return ""
+
+class Profiler(object):
+    """
+    Profile each phase of a run into a directory
+
+    Usage::
+
+        profiler = Profiler("/tmp/profile")
+        with profiler.phase("find_configurations"):
+            ...
+        print profiler.summary()
+
+    For each phase we dump cProfile stats into ``<index>-<phase>.prof``.
+
+    If tracemalloc is available we record the peak traced memory and write the
+    top allocations into ``<index>-<phase>.allocations.txt``. Otherwise we
+    record the peak resident memory of the process when the phase finished.
+
+    Phases may be nested, in which case the outer phase's cProfile is paused
+    while the inner phase runs. The peak memory of an outer phase includes the
+    peaks of the phases inside it.
+    """
+    def __init__(self, directory, top=25):
+        self.top = top
+        self.phases = []
+        self.peaks = []
+        self.active = []
+        self.directory = directory
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        """Profile everything inside this context manager as the named phase"""
+        record = {"name": name, "depth": len(self.active)}
+        basename = os.path.join(self.directory, "{0:02d}-{1}".format(len(self.phases), name))
+        self.phases.append(record)
+
+        if self.active:
+            self.active[-1].disable()
+
+        if tracemalloc:
+            # Remember the peak of the phase we're inside before starting a new peak for this one
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self.peaks.append(0)
+
+        profile = cProfile.Profile()
+        self.active.append(profile)
+
+        start = time.time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            record["duration"] = time.time() - start
+            self.active.pop()
+
+            profile.dump_stats("{0}.prof".format(basename))
+            self.record_memory(record, basename, self.peaks.pop())
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], record["peak_memory"])
+
+            if self.active:
+                self.active[-1].enable()
+
+    def record_memory(self, record, basename, peak=0):
+        """Record peak memory for this phase and write out the top allocations if we can"""
+        if tracemalloc:
+            record["peak_memory"] = max(peak, tracemalloc.get_traced_memory()[1])
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+            with open("{0}.allocations.txt".format(basename), "w") as fle:
+                for statistic in statistics:
+                    fle.write("{0}\n".format(statistic))
+        else:
+            # ru_maxrss is in kilobytes on linux
+            record["peak_memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def summary(self):
+        """Return a table of how long each phase took and how much memory it used"""
+        lines = ["{0:<40} {1:>10} {2:>14}".format("Phase", "Seconds", "Peak memory")]
+        for record in self.phases:
+            name = "{0}{1}".format("  " * record["depth"], record["name"])
+            peak = "{0:.1f} MB".format(record["peak_memory"] / 1024.0 / 1024.0)
+            lines.append("{0:<40} {1:>10.3f} {2:>14}".format(name, record["duration"], peak))
+        lines.append("Profiles written to {0}".format(self.directory))
+        return "\n".join(lines)
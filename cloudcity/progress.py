@@ -0,0 +1,161 @@
+import threading
+import logging
+import time
+import sys
+
+class ProgressView(object):
+    """
+    Shows what the stacks being deployed are up to without printing every event
+
+    Usage::
+
+        progress = ProgressView(events_location="events.log")
+        progress.started("app")
+        progress.update("app", tracker.progress_update())
+        progress.render_if_due()
+        progress.finished("app", tracker.current_state())
+        progress.close()
+
+    We only remember the latest event and how many events there have been for
+    each stack, and draw at most once every interval seconds. On a tty we
+    redraw the same lines in place, otherwise we write a summary line each
+    time. Every event is written to events_location if we have one.
+
+    At most max_lines stacks are drawn, the ones with the newest events first.
+
+    Anything else writing to the same stream needs to go through clear, i.e.
+    by logging through a ProgressHandler, or it will be drawn over.
+    """
+    def __init__(self, stream=None, events_location=None, interval=1, max_lines=20, clock=time.time):
+        if stream is None:
+            stream = sys.stderr
+
+        self.lock = threading.RLock()
+        self.clock = clock
+        self.stream = stream
+        self.interval = interval
+        self.max_lines = max_lines
+        self.tty = hasattr(stream, "isatty") and stream.isatty()
+
+        self.events = None
+        if events_location is not None:
+            self.events = open(events_location, "a")
+
+        self.stacks = {}
+        self.finished_count = 0
+        self.drawn_lines = 0
+        self.last_render = None
+        self.dirty = False
+
+    def started(self, stack):
+        """Start showing this stack"""
+        with self.lock:
+            self.stacks[stack] = {"latest": "started", "count": 0, "at": self.clock()}
+            self.dirty = True
+
+    def update(self, stack, events):
+        """Remember the latest of these events for this stack"""
+        if not events:
+            return
+
+        now = self.clock()
+        if self.events is not None:
+            for event in events:
+                self.events.write("{0:.3f} {1} {2}\n".format(now, stack, event))
+
+        with self.lock:
+            info = self.stacks.setdefault(stack, {"latest": None, "count": 0, "at": now})
+            info["latest"] = events[-1]
+            info["count"] += len(events)
+            info["at"] = now
+            self.dirty = True
+
+    def finished(self, stack, state):
+        """Stop showing this stack"""
+        if self.events is not None:
+            self.events.write("{0:.3f} {1} {2}\n".format(self.clock(), stack, state))
+        with self.lock:
+            self.stacks.pop(stack, None)
+            self.finished_count += 1
+            self.dirty = True
+
+    def render_if_due(self):
+        """Draw if something changed and we haven't drawn in the last interval seconds"""
+        now = self.clock()
+        if not self.dirty or (self.last_render is not None and now - self.last_render < self.interval):
+            return False
+
+        self.render()
+        self.last_render = now
+        return True
+
+    def lines(self):
+        """Return the lines describing what's happening"""
+        with self.lock:
+            newest = sorted(self.stacks.items(), key=lambda item: (-item[1]["at"], item[0]))
+            lines = ["{0} deploying, {1} finished".format(len(self.stacks), self.finished_count)]
+            for stack, info in newest[:self.max_lines]:
+                lines.append("  {0}: {1} ({2} events)".format(stack, info["latest"], info["count"]))
+            if len(newest) > self.max_lines:
+                lines.append("  ... and {0} more".format(len(newest) - self.max_lines))
+            return lines
+
+    def render(self):
+        """Draw what's happening now"""
+        with self.lock:
+            self.dirty = False
+            lines = self.lines()
+            if self.tty:
+                # Move back to where we drew last time and clear everything below it
+                if self.drawn_lines:
+                    self.stream.write("\033[{0}F".format(self.drawn_lines))
+                self.stream.write("\033[J")
+                self.stream.write("\n".join(lines))
+                self.stream.write("\n")
+                self.drawn_lines = len(lines)
+            else:
+                self.stream.write("Progress: {0}\n".format("; ".join(line.strip() for line in lines)))
+            self.stream.flush()
+
+    def clear(self):
+        """Erase what we drew on a tty so something else can write there, and return whether there was anything"""
+        with self.lock:
+            if not self.tty or not self.drawn_lines:
+                return False
+
+            self.stream.write("\033[{0}F\033[J".format(self.drawn_lines))
+            self.stream.flush()
+            self.drawn_lines = 0
+            return True
+
+    def close(self):
+        """Draw anything we haven't drawn yet and close the events file"""
+        if self.dirty:
+            self.render()
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+
+class ProgressHandler(logging.Handler):
+    """
+    Gives records to another handler that writes to the same stream as a ProgressView
+
+    Usage::
+
+        logging.getLogger("").addHandler(ProgressHandler(progress, handler))
+
+    The progress is erased before each record is written and drawn again
+    under it, so log lines aren't drawn over and the progress stays at the
+    bottom.
+    """
+    def __init__(self, progress, handler):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.progress = progress
+
+    def emit(self, record):
+        with self.progress.lock:
+            cleared = self.progress.clear()
+            self.handler.handle(record)
+            if cleared:
+                self.progress.render()
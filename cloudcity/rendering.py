@@ -0,0 +1,109 @@
+from cloudcity.configurations import ReferenceResolver
+from cloudcity.keys import key_path
+
+from option_merge import MergedOptions
+import multiprocessing
+import logging
+
+log = logging.getLogger("rendering")
+
+# The snapshot each worker process renders against and the resolver for it
+# Set once per process by the pool initializer so it isn't sent with every stack
+worker_snapshot = None
+worker_resolver = None
+
+def use_snapshot(snapshot):
+    """Pool initializer for setting the snapshot in a worker process"""
+    global worker_snapshot, worker_resolver
+    worker_snapshot = MergedOptions.using(snapshot)
+    worker_resolver = ReferenceResolver(worker_snapshot)
+
+def render_stack(name, options=None, resolver=None):
+    """
+    Return (name, rendered) where rendered is a plain dictionary of the options
+    on this stack with all the string values formatted against the options
+
+    Values are resolved through the resolver so references shared between
+    stacks are only resolved once.
+    """
+    if options is None:
+        options = worker_snapshot
+        resolver = worker_resolver
+
+    if resolver is None:
+        resolver = ReferenceResolver(options)
+
+    stack_options = options[name]
+
+    rendered = {}
+    for key in stack_options.all_keys():
+        val = stack_options[key]
+        if isinstance(val, basestring):
+            val = resolver.option(key_path("{0}.{1}".format(name, key)))
+
+        parts = key_path(key).parts
+        at = rendered
+        for part in parts[:-1]:
+            at = at.setdefault(part, {})
+        at[parts[-1]] = val
+
+    return name, rendered
+
+def render_in_worker(name):
+    """Render using the snapshot from use_snapshot"""
+    return render_stack(name)
+
+class Renderer(object):
+    """
+    Render the templated values of many stacks
+
+    Usage::
+
+        rendered = Renderer(options).render(["stack1", "stack2"])
+        # {"stack1": {...}, "stack2": {...}}
+
+    Rendering is pure cpu bound python, so when there is more than one stack
+    we render each stack in a pool of processes against a frozen snapshot of the options.
+
+    Resolved references are remembered for the whole render in a single
+    process, and for the life of each worker when using a pool.
+
+    If outputs is an OutputCache then references to stacks that aren't config
+    stacks are resolved from their outputs. The cache can't be shared with
+    other processes, so we render in this process when we have one.
+
+    If resolver is a ReferenceResolver for these options then we use it, so
+    references are remembered between renders, i.e. for a whole run. It's
+    outputs are used as our outputs, and we render in this process with it.
+    """
+    def __init__(self, options, processes=None, outputs=None, resolver=None):
+        if resolver is not None:
+            outputs = resolver.outputs
+
+        self.outputs = outputs
+        self.options = options
+        self.resolver = resolver
+        self.processes = processes
+
+    def snapshot(self):
+        """Freeze the options into plain dictionaries that can be sent to other processes"""
+        return dict(self.options.items())
+
+    def render(self, names):
+        """Return {name: rendered} for all the stacks in names"""
+        names = list(names)
+        if self.processes == 1 or len(names) < 2 or self.outputs is not None or self.resolver is not None:
+            resolver = self.resolver
+            if resolver is None:
+                resolver = ReferenceResolver(self.options, self.outputs)
+            return dict(render_stack(name, self.options, resolver) for name in names)
+
+        processes = self.processes or min(len(names), multiprocessing.cpu_count())
+        log.info("Rendering %s stacks with %s processes", len(names), processes)
+
+        pool = multiprocessing.Pool(processes, initializer=use_snapshot, initargs=(self.snapshot(), ))
+        try:
+            return dict(pool.map(render_in_worker, names, chunksize=1))
+        finally:
+            pool.close()
+            pool.join()
@@ -1,14 +1,51 @@
 from cloudcity.configurations import MergedOptionStringFormatter
+from cloudcity.errors import CloudCityError
+from cloudcity.metrics import NoMetrics
 
 from fnmatch import fnmatch
+import hashlib
+import json
+
+def fingerprint_of(dct):
+    """Return a hash of a dictionary that only changes when it's contents change"""
+    dumped = json.dumps(dct, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(dumped).hexdigest()
 
 class BaseStack(object):
     """
     A Base stack with empty dependencies and NotImplemented methods
 
     __getitem__ and __setitem__ delegate to the options on the stack
+
+    rendered is set to a plain dictionary of the options with templated
+    values formatted before the stack is deployed.
+
+    existing is set to whether the stack already exists before the stack is
+    deployed.
+
+    client_pool is set to the ClientPool shared by all the stacks in the run.
+    Use self.client(region, account) to get a backend client and pass it onto
+    any trackers rather than making new ones.
+
+    metrics is set to the Metrics for the run. Stack types should record when
+    they retry or are throttled by the backend, i.e.
+    self.metrics.inc("cloudcity_throttles", stack=self.name). Outside of a run
+    it's a NoMetrics that doesn't record anything.
+
+    uploaded is set to {location: key} for the files from artifacts() once
+    they are in the object store, before the stack is deployed.
+
+    resource_options names the options that say which quotas this stack
+    competes for when it deploys, i.e. ["account", "region"]. The deployer
+    limits how many stacks deploy against each of these at once.
     """
 
+    rendered = None
+    existing = None
+    metrics = NoMetrics()
+    uploaded = None
+    client_pool = None
+    resource_options = []
     default_dependencies = []
     default_generated_options = []
 
@@ -27,6 +64,29 @@ class BaseStack(object):
     def __setitem__(self, key, val):
         self.options[key] = val
 
+    def as_dict(self):
+        """Return the options on this stack as a plain dictionary"""
+        return dict(self.options.items())
+
+    def fingerprint(self):
+        """Return a hash of the options on this stack, for telling when they have changed"""
+        return fingerprint_of(self.as_dict())
+
+    def deploy_fingerprint(self):
+        """Return a hash of what this stack is deployed with, which is the rendered options if we have them"""
+        if self.rendered is None:
+            return self.fingerprint()
+        return fingerprint_of(self.rendered)
+
+    def resource_keys(self):
+        """Return ["<option>=<value>", ...] for the resource_options this stack has"""
+        options = self.rendered if self.rendered is not None else self.options
+        keys = []
+        for option in self.resource_options:
+            if option in options:
+                keys.append("{0}={1}".format(option, options[option]))
+        return keys
+
     def determine_extra_dependencies(self):
         """Used to find the dependency stacks this stack depends on"""
         raise NotImplemented()
@@ -35,14 +95,54 @@ class BaseStack(object):
         """Say whether this stack exists in the wild"""
         raise NotImplemented()
 
+    @classmethod
+    def exists_many(kls, stacks):
+        """
+        Return {name: exists} for many stacks of this type
+
+        Stack types that can ask about many stacks in one call should override
+        this, otherwise we ask each stack in turn.
+        """
+        return dict((stack.name, stack.exists()) for stack in stacks)
+
+    def prepare_deployment(self):
+        """
+        Do the work for deploying this stack that doesn't need it's dependencies deployed, i.e. packaging artifacts
+
+        This may be called in a background thread while other stacks deploy.
+        """
+        return
+
+    def artifacts(self):
+        """Return the locations of files, i.e. templates, to upload before this stack is deployed"""
+        return []
+
     def start_deployment(self):
         """Start deploying this stack"""
         raise NotImplemented()
 
+    def cancel_deployment(self):
+        """
+        Stop deploying this stack and return whether we did
+
+        Stacks that can't be stopped part way through are left to finish.
+        """
+        return False
+
     def deployment_tracker(self):
         """Return an object for tracking the deployment of this stack"""
         raise NotImplemented()
 
+    def outputs(self):
+        """Return a dictionary of the outputs from the deployed stack"""
+        raise NotImplemented()
+
+    def client(self, region, account):
+        """Return the shared backend client for this region and account"""
+        if self.client_pool is None:
+            raise CloudCityError("Stack doesn't have a client pool", stack=self.name)
+        return self.client_pool.client(region, account)
+
     def add_dependencies(self, dependencies):
         """Add some known dependencies"""
         self.dependencies.extend(dependencies)
@@ -63,11 +163,12 @@ class BaseStack(object):
         return False
 
     def find_required_keys(self):
-        """Yield (key, dependant_keys) where dependent_keys are the keys from other stacks that are necessary"""
+        """Yield (key, dependant_keys) where dependent_keys are KeyPaths to the keys from other stacks that are necessary"""
+        template = MergedOptionStringFormatter(self.options)
         for key in self.options.all_keys():
-            template = MergedOptionStringFormatter(self.options)
             val = self.options[key]
             if isinstance(val, basestring):
+                template.found_requirements = []
                 template.format(val)
                 if template.found_requirements:
                     yield (key, template.found_requirements)
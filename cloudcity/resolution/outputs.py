@@ -0,0 +1,97 @@
+from cloudcity.errors import BadOptionFormat
+
+import threading
+import logging
+import time
+
+log = logging.getLogger("outputs")
+
+class StackOutputs(object):
+    """An output provider that asks the stacks themselves for their outputs"""
+    def __init__(self, stacks):
+        self.stacks = stacks
+
+    def fetch_outputs(self, stack_name):
+        return self.stacks[stack_name].outputs()
+
+class OutputCache(object):
+    """
+    Remembers the outputs of deployed stacks so we don't fetch them for every reference
+
+    Usage::
+
+        cache = OutputCache(StackOutputs(stacks), ttl=300)
+        cache.get(key_path("network.vpc_id"))
+
+        # After network is redeployed
+        cache.invalidate("network")
+
+    The provider is any object with a ``fetch_outputs(stack_name)`` method
+    that returns a dictionary of outputs for that stack.
+
+    Outputs are kept for ttl seconds. If many threads want the outputs of the
+    same stack at the same time, only one of them fetches while the others wait
+    for what it finds.
+
+    clock is a function returning the current time in seconds.
+    """
+    def __init__(self, provider, ttl=300, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.provider = provider
+
+        self.entries = {}
+        self.in_flight = set()
+        self.generations = {}
+        self.condition = threading.Condition()
+
+        self.hits = 0
+        self.fetches = 0
+
+    def outputs(self, stack_name):
+        """Return the outputs for this stack, fetching them if we don't have them yet"""
+        with self.condition:
+            while True:
+                entry = self.entries.get(stack_name)
+                if entry is not None and self.clock() - entry[0] < self.ttl:
+                    self.hits += 1
+                    return entry[1]
+
+                if stack_name not in self.in_flight:
+                    break
+                self.condition.wait()
+
+            self.fetches += 1
+            self.in_flight.add(stack_name)
+            generation = self.generations.get(stack_name, 0)
+
+        try:
+            fetched_at = self.clock()
+            outputs = self.provider.fetch_outputs(stack_name)
+        except:
+            with self.condition:
+                self.in_flight.discard(stack_name)
+                self.condition.notify_all()
+            raise
+
+        with self.condition:
+            # Don't keep what we found if the stack was redeployed while we were fetching
+            if self.generations.get(stack_name, 0) == generation:
+                self.entries[stack_name] = (fetched_at, outputs)
+            self.in_flight.discard(stack_name)
+            self.condition.notify_all()
+
+        return outputs
+
+    def get(self, path):
+        """Return the output for this KeyPath"""
+        outputs = self.outputs(path.root)
+        if path.rest not in outputs:
+            raise BadOptionFormat("Stack doesn't have that output", stack=path.root, output=path.rest, available=sorted(outputs))
+        return outputs[path.rest]
+
+    def invalidate(self, stack_name):
+        """Forget the outputs for this stack, i.e. because it has been redeployed"""
+        with self.condition:
+            self.entries.pop(stack_name, None)
+            self.generations[stack_name] = self.generations.get(stack_name, 0) + 1
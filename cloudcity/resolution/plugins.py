@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import json
+import sys
+import os
+
+log = logging.getLogger("plugins")
+
+class PluginCache(object):
+    """
+    Finds stack types that are registered as entry points by installed packages
+
+    Usage::
+
+        PluginCache().stack_types()
+        # {"alias": "some.module:StackKls", ...}
+
+    Packages register stack types with an entry point in the
+    ``cloudcity.stack_types`` group, where the name is the alias of the stack type::
+
+        entry_points = {"cloudcity.stack_types": ["cfn = my_plugin.stacks:CfnStack"]}
+
+    Looking through entry points means importing pkg_resources and reading the
+    metadata of every installed package, so we cache what we find on disk.
+    The cache is keyed by a hash of the names and modified times of the package
+    metadata on sys.path so that it's thrown away when packages are installed,
+    upgraded or removed.
+
+    Nothing is imported here, we only find the import strings.
+    """
+    version = 1
+    group = "cloudcity.stack_types"
+    metadata_extensions = (".egg-info", ".dist-info", ".egg-link", ".egg", ".pth")
+
+    def __init__(self, location=None):
+        self.location = location
+        if self.location is None:
+            cache_dir = os.environ.get("CLOUDCITY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cloudcity"))
+            self.location = os.path.join(cache_dir, "stack_types.json")
+
+    def stack_types(self):
+        """Return {alias: import_line} for all the stack types that are installed"""
+        fingerprint = self.fingerprint()
+        cached = self.load()
+        if cached and cached.get("version") == self.version and cached.get("fingerprint") == fingerprint:
+            return cached["stack_types"]
+
+        stack_types = self.discover()
+        self.save(fingerprint, stack_types)
+        return stack_types
+
+    def fingerprint(self):
+        """Return a hash of the package metadata that is on sys.path"""
+        hashed = hashlib.sha1()
+        for entry in sys.path:
+            if not entry or not os.path.isdir(entry):
+                continue
+
+            try:
+                names = sorted(os.listdir(entry))
+            except OSError:
+                continue
+
+            hashed.update(entry)
+            for name in names:
+                if name.endswith(self.metadata_extensions):
+                    try:
+                        mtime = os.stat(os.path.join(entry, name)).st_mtime
+                    except OSError:
+                        continue
+                    hashed.update("{0}:{1}".format(name, mtime))
+
+        return hashed.hexdigest()
+
+    def discover(self):
+        """Find all the stack types from entry points"""
+        import pkg_resources
+
+        stack_types = {}
+        for entry_point in pkg_resources.iter_entry_points(self.group):
+            stack_types[entry_point.name] = "{0}:{1}".format(entry_point.module_name, ".".join(entry_point.attrs))
+        return stack_types
+
+    def load(self):
+        """Return what is in the cache, or None if we can't read it"""
+        if not os.path.exists(self.location):
+            return None
+
+        try:
+            with open(self.location) as fle:
+                return json.load(fle)
+        except (IOError, ValueError) as error:
+            log.warning("Ignoring unreadable stack type cache at %s (%s)", self.location, error)
+
+    def save(self, fingerprint, stack_types):
+        """Save what we found to the cache"""
+        try:
+            parent = os.path.dirname(self.location)
+            if not os.path.exists(parent):
+                os.makedirs(parent)
+
+            with open(self.location, "w") as fle:
+                json.dump({"version": self.version, "fingerprint": fingerprint, "stack_types": stack_types}, fle)
+        except (IOError, OSError) as error:
+            log.warning("Couldn't write stack type cache to %s (%s)", self.location, error)
@@ -1,8 +1,12 @@
 from cloudcity.errors import UnknownStackType, BadStackKls, BadImport
+from cloudcity.resolution.plugins import PluginCache
 
 from option_merge import MergedOptions
+import logging
 import re
 
+log = logging.getLogger("resolver")
+
 def valid_python_name(name):
     """Make sure it's a valid python variable"""
     return re.match("[_a-zA-Z][_a-zA-Z0-9]*", name)
@@ -17,8 +21,16 @@ def do_import(path, obj):
     return getattr(imported, obj)
 
 class StackResolver(object):
-    def __init__(self):
+    """
+    Knows how to turn options into stack objects
+
+    Stack types may be registered as a class, or lazily as an import string
+    that is only imported when a stack of that type is resolved.
+    """
+    def __init__(self, plugin_cache_kls=PluginCache):
+        self.lazy = {}
         self.registered = MergedOptions()
+        self.plugin_cache_kls = plugin_cache_kls
 
     def register(self, stack_kls, extra_aliases=None):
         """Register a stack type"""
@@ -31,6 +43,23 @@ class StackResolver(object):
 
     def register_import(self, import_line, extra_aliases=None):
         """Register a kls from an import string"""
+        self.register(self.import_obj(import_line), extra_aliases)
+
+    def import_obj(self, import_line):
+        """Return the object from an import string, complaining with BadImport if it can't be imported"""
+        path, obj = self.split_import(import_line)
+        try:
+            return do_import(path, obj)
+        except Exception as error:
+            raise BadImport("Failed to import", import_line=import_line, error_type=error.__class__.__name__, error=error)
+
+    def register_lazy(self, alias, import_line):
+        """Register an import string for this alias that is imported the first time we resolve this alias"""
+        self.split_import(import_line)
+        self.lazy[alias] = import_line
+
+    def split_import(self, import_line):
+        """Return (path, obj) from an import string, complaining if it's not valid"""
         if ":" not in import_line:
             raise BadImport("Expecting '<path>:<obj>'", got=import_line)
 
@@ -40,16 +69,30 @@ class StackResolver(object):
         if not valid_python_name(obj):
             raise BadImport("obj portion of import is not a valid python name", obj=obj)
 
-        obj = do_import(path, obj)
-        self.register(obj, extra_aliases)
+        return path, obj
 
     def register_defaults(self):
-        self.register_import("cloudcity.resolution.types.config:ConfigStack")
+        """Register our own stack types and any that are installed as plugins"""
+        self.register_lazy("config", "cloudcity.resolution.types.config:ConfigStack")
+        for alias, import_line in sorted(self.plugin_cache_kls().stack_types().items()):
+            try:
+                self.register_lazy(alias, import_line)
+            except BadImport as error:
+                log.error("Ignoring stack type plugin %s: %s", alias, error)
+
+    def available(self):
+        """Return the aliases we know about"""
+        return sorted(set(self.registered.keys()) | set(self.lazy))
 
     def resolve(self, name, options):
         the_type = options.get("type", "config")
+        if the_type not in self.registered and the_type in self.lazy:
+            # Only forget the import string once it has worked, so every stack of this type gets the same complaint
+            self.register_import(self.lazy[the_type], extra_aliases=[the_type])
+            del self.lazy[the_type]
+
         if the_type not in self.registered:
-            raise UnknownStackType(name=name, only_have=self.registered.keys(), wanted=the_type)
+            raise UnknownStackType(name=name, only_have=self.available(), wanted=the_type)
 
         return self.registered[the_type](name, options)
 
@@ -12,6 +12,11 @@ class ConfigStack(BaseStack):
         """Say whether this stack exists in the wild"""
         return True
 
+    @classmethod
+    def exists_many(kls, stacks):
+        """Config stacks always exist"""
+        return dict((stack.name, True) for stack in stacks)
+
     def start_deployment(self):
         """Start deploying this stack"""
         return
@@ -20,3 +25,6 @@ class ConfigStack(BaseStack):
         """Return an object for tracking the deployment of this stack"""
         return NoWaiting()
 
+    def outputs(self):
+        """Config stacks output their options"""
+        return self.as_dict()
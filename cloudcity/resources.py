@@ -0,0 +1,60 @@
+from cloudcity.errors import CloudCityError
+
+from collections import defaultdict
+from fnmatch import fnmatch
+
+class ResourceLimits(object):
+    """
+    Counts the stacks being deployed against each resource key and says when there is room for more
+
+    Usage::
+
+        limits = ResourceLimits([("account=123456789", 2), ("region=*", 4)], default=8)
+        if limits.has_room(stack.resource_keys()):
+            limits.take(stack.resource_keys())
+            ...
+            limits.release(stack.resource_keys())
+
+    Resource keys are strings like ``region=ap-southeast-2`` that stacks get
+    from their resolved options. Each key is limited by the first glob in
+    limits that matches it, or by default if none match. A default of None
+    means keys that don't match anything are unlimited.
+
+    Every limit needs to be at least one, otherwise stacks using those keys
+    could never start.
+    """
+    def __init__(self, limits=None, default=None):
+        for glob, limit in [("default", default)] + list(limits or []):
+            if limit is not None and limit < 1:
+                raise CloudCityError("Resource limits need to allow at least one stack at a time", resource=glob, limit=limit)
+
+        self.limits = list(limits or [])
+        self.default = default
+        self.in_use = defaultdict(int)
+
+    def limit_for(self, key):
+        """Return how many stacks may use this key at once, or None for no limit"""
+        for glob, limit in self.limits:
+            if fnmatch(key, glob):
+                return limit
+        return self.default
+
+    def has_room(self, keys):
+        """Say whether a stack using these keys can start now"""
+        for key in keys:
+            limit = self.limit_for(key)
+            if limit is not None and self.in_use.get(key, 0) >= limit:
+                return False
+        return True
+
+    def take(self, keys):
+        """Record that a stack using these keys has started"""
+        for key in keys:
+            self.in_use[key] += 1
+
+    def release(self, keys):
+        """Record that a stack using these keys has stopped"""
+        for key in keys:
+            self.in_use[key] -= 1
+            if self.in_use[key] <= 0:
+                del self.in_use[key]
@@ -0,0 +1,286 @@
+from cloudcity.resolution.tracker import Tracker
+from cloudcity.resolution.base import BaseStack
+from cloudcity.resources import ResourceLimits
+from cloudcity.errors import CloudCityError, FailedDeployment
+from cloudcity.durations import Durations
+from cloudcity.deployer import Deployer
+from cloudcity.metrics import Metrics
+from cloudcity.layers import Layers
+
+from option_merge import MergedOptions
+import hashlib
+import logging
+import random
+import math
+
+log = logging.getLogger("simulation")
+
+def seeded(*parts):
+    """Return a random.Random seeded from these parts, the same way every run"""
+    seed = ":".join(str(part) for part in parts)
+    return random.Random(int(hashlib.md5(seed).hexdigest(), 16))
+
+class VirtualClock(object):
+    """A clock that only moves when something sleeps"""
+    def __init__(self, start=0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class Latency(object):
+    """
+    A distribution of how many seconds a stack takes to deploy
+
+    Usage::
+
+        Latency.parse("fixed:60")
+        Latency.parse("uniform:30:90")
+        Latency.parse("lognormal:4:0.5")
+    """
+    kinds = {"fixed": 1, "uniform": 2, "lognormal": 2}
+
+    def __init__(self, kind, *args):
+        if kind not in self.kinds:
+            raise CloudCityError("Unknown latency distribution", got=kind, available=sorted(self.kinds))
+        if len(args) != self.kinds[kind]:
+            raise CloudCityError("Wrong number of arguments for latency distribution", kind=kind, got=len(args), wanted=self.kinds[kind])
+        self.kind = kind
+        self.args = [float(arg) for arg in args]
+
+    @classmethod
+    def parse(kls, spec):
+        """Make a Latency from <kind>:<arg>:..."""
+        parts = spec.split(":")
+        try:
+            return kls(parts[0], *parts[1:])
+        except ValueError:
+            raise CloudCityError("Latency arguments must be numbers", got=spec)
+
+    def sample(self, rng):
+        """Return a number of seconds from this distribution"""
+        if self.kind == "fixed":
+            return self.args[0]
+        elif self.kind == "uniform":
+            return rng.uniform(*self.args)
+        else:
+            return rng.lognormvariate(*self.args)
+
+    def mean(self):
+        """Return the average number of seconds from this distribution"""
+        if self.kind == "fixed":
+            return self.args[0]
+        elif self.kind == "uniform":
+            return sum(self.args) / 2
+        else:
+            mu, sigma = self.args
+            return math.exp(mu + sigma ** 2 / 2)
+
+class SimulatedBackend(object):
+    """
+    A fake cloud that throttles deploys against resources that are over their quota
+
+    Each deploy started while one of it's resource keys is at it's quota is
+    counted as throttled and is retried after throttle_penalty seconds.
+    """
+    def __init__(self, quotas=None, throttle_penalty=30):
+        self.quotas = ResourceLimits(quotas)
+        self.throttles = 0
+        self.throttle_penalty = throttle_penalty
+
+    def start(self, keys):
+        """Start a deploy against these keys and return whether it was throttled"""
+        throttled = not self.quotas.has_room(keys)
+        if throttled:
+            self.throttles += 1
+        self.quotas.take(keys)
+        return throttled
+
+    def finish(self, keys):
+        self.quotas.release(keys)
+
+class SimulatedTracker(Tracker):
+    """Finishes in the state it was given once the virtual clock reaches ends_at"""
+    def __init__(self, clock, backend, keys, ends_at, state):
+        self.keys = keys
+        self.clock = clock
+        self.state = state
+        self.ends_at = ends_at
+        self.backend = backend
+        self.released = False
+
+    def done_yet(self):
+        if self.clock.time() < self.ends_at:
+            return False
+        if not self.released:
+            self.released = True
+            self.backend.finish(self.keys)
+        return True
+
+    def current_state(self):
+        return self.state
+
+    def progress_update(self):
+        return []
+
+class SimulatedStack(BaseStack):
+    """A stack that deploys against a Simulation's virtual clock and backend"""
+    resource_options = ["account", "region"]
+
+    def __init__(self, name, options, simulation, clock, backend):
+        super(SimulatedStack, self).__init__(name, options)
+        self.clock = clock
+        self.backend = backend
+        self.attempts = 0
+        self.tracker = None
+        self.simulation = simulation
+
+    def exists(self):
+        return False
+
+    def start_deployment(self):
+        self.attempts += 1
+        rng = seeded(self.simulation.seed, self.name, self.attempts)
+        took = self.simulation.latency_for(self.name).sample(rng)
+        state = Tracker.FINISHED
+        if rng.random() < self.simulation.failure_rate:
+            state = "failed"
+
+        keys = self.resource_keys()
+        if self.backend.start(keys):
+            self.metrics.inc("cloudcity_throttles", stack=self.name)
+            self.metrics.inc("cloudcity_retries", stack=self.name)
+            took += self.backend.throttle_penalty
+        self.tracker = SimulatedTracker(self.clock, self.backend, keys, self.clock.time() + took, state)
+
+    def deployment_tracker(self):
+        return self.tracker
+
+class Simulation(object):
+    """
+    Replays a dependency graph through the Deployer against a virtual clock
+
+    Usage::
+
+        simulation = Simulation.synthetic(200, seed=1)
+        simulation.run(Deployer.LAYERED, max_parallel=10)
+        # {"strategy": "layered", "makespan": 3120.5, ...}
+
+    graph is {name: [dependency, ...]} and options is {name: {option: value}}
+    for giving stacks an account and region. layered is the layering to use,
+    otherwise the stacks are layered from their dependencies.
+
+    Each stack takes a time from latencies[name] or latency to deploy and fails
+    failure_rate of the time. Deploys against a resource that is over it's
+    quota are throttled.
+
+    Everything random is seeded from seed and the stack name, so a stack takes
+    the same time whatever order it is started in and runs are reproducible.
+    The Deployer is told the average time of each stack for critical paths.
+
+    What the Deployer and the stacks record is put into the metrics given to
+    run, which includes the throttles and retries from the fake backend.
+    """
+    def __init__(self, graph, layered=None, options=None, latency=None, latencies=None, failure_rate=0, quotas=None, throttle_penalty=30, seed=0):
+        self.seed = seed
+        self.graph = graph
+        self.quotas = quotas
+        self.layered = layered
+        self.options = options or {}
+        self.latency = latency or Latency("fixed", 60)
+        self.latencies = latencies or {}
+        self.failure_rate = failure_rate
+        self.throttle_penalty = throttle_penalty
+
+    @classmethod
+    def synthetic(kls, count, max_dependencies=3, accounts=2, regions=2, seed=0, **kwargs):
+        """Make a simulation of count stacks that each depend on up to max_dependencies earlier stacks"""
+        rng = seeded(seed, "graph")
+        names = ["stack{0:04d}".format(index) for index in range(count)]
+        graph = {}
+        options = {}
+        for index, name in enumerate(names):
+            graph[name] = sorted(rng.sample(names[:index], min(index, rng.randint(0, max_dependencies))))
+            options[name] = {"account": "account{0}".format(rng.randrange(accounts)), "region": "region{0}".format(rng.randrange(regions))}
+        return kls(graph, options=options, seed=seed, **kwargs)
+
+    @classmethod
+    def from_plan(kls, plan, durations=None, **kwargs):
+        """
+        Make a simulation of the stacks in a Plan
+
+        If durations is a Durations then stacks it knows about take the time
+        it has recorded for them.
+        """
+        graph = dict((name, info["dependencies"]) for name, info in plan.stacks.items())
+        options = dict((name, info["options"]) for name, info in plan.stacks.items())
+
+        latencies = {}
+        if durations is not None:
+            for name in graph:
+                if name in durations.stacks:
+                    latencies[name] = Latency("fixed", durations.stacks[name])
+
+        return kls(graph, layered=plan.layered, options=options, latencies=latencies, **kwargs)
+
+    def latency_for(self, name):
+        return self.latencies.get(name, self.latency)
+
+    def layers(self, clock, backend):
+        """Return Layers of SimulatedStacks for our graph"""
+        stacks = {}
+        for name, dependencies in self.graph.items():
+            stacks[name] = SimulatedStack(name, MergedOptions.using(self.options.get(name, {})), self, clock, backend)
+            stacks[name].add_dependencies(dependencies)
+
+        layers = Layers(stacks)
+        if self.layered is not None:
+            layers.use_layered(self.layered)
+        else:
+            layers.add_all_to_layers()
+        return layers
+
+    def run(self, strategy, max_parallel, resources=None, failure_policy=Deployer.CONTINUE_INDEPENDENT, poll_interval=1, metrics=None):
+        """Deploy everything with this strategy and return what happened"""
+        clock = VirtualClock()
+        if metrics is None:
+            metrics = Metrics(clock=clock.time)
+
+        backend = SimulatedBackend(self.quotas, self.throttle_penalty)
+        layers = self.layers(clock, backend)
+        for stack in layers.stacks.values():
+            stack.metrics = metrics
+
+        durations = Durations()
+        for name in self.graph:
+            durations.record(name, self.latency_for(name).mean())
+
+        deployer = Deployer(
+              max_parallel = max_parallel
+            , failure_policy = failure_policy
+            , strategy = strategy
+            , durations = durations
+            , resources = resources
+            , metrics = metrics
+            , poll_interval = poll_interval
+            , sleep = clock.sleep
+            , clock = clock.time
+            )
+
+        try:
+            deployer.deploy(layers)
+        except FailedDeployment:
+            pass
+
+        report = deployer.report
+        return {
+              "strategy": strategy
+            , "makespan": clock.time()
+            , "deployed": len(report.deployed)
+            , "failed": len(report.failed)
+            , "skipped": len(report.skipped) + len(report.cancelled)
+            , "throttles": backend.throttles
+            }
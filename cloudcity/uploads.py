@@ -0,0 +1,229 @@
+from cloudcity.errors import CloudCityError
+
+from multiprocessing.pool import ThreadPool
+import hashlib
+import logging
+import shutil
+import json
+import uuid
+import os
+
+log = logging.getLogger("uploads")
+
+def content_hash(location, chunk_size=1024 * 1024):
+    """Return the sha256 of the file at location without reading it all at once"""
+    digest = hashlib.sha256()
+    with open(location, "rb") as fle:
+        for chunk in iter(lambda: fle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_part(location, offset, length):
+    """Return length bytes from offset in the file at location"""
+    with open(location, "rb") as fle:
+        fle.seek(offset)
+        return fle.read(length)
+
+class FolderStore(object):
+    """
+    An object store that keeps objects in a folder
+
+    Any object store used by the Uploader has these methods and they need to
+    be safe to call from many threads at once.
+
+    ``has(key)``
+        Say whether the store already has this key
+
+    ``put(key, body)``
+        Store body under key
+
+    ``start_multipart(key)``
+        Return an id for uploading key in parts
+
+    ``put_part(key, upload_id, number, body)``
+        Store one part of a multipart upload. Parts are numbered from 1
+
+    ``complete_multipart(key, upload_id, count)``
+        Join the count parts of the upload together into key
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, body):
+        tmp = "{0}.{1}.tmp".format(self.path(key), uuid.uuid4().hex)
+        with open(tmp, "wb") as fle:
+            fle.write(body)
+        os.rename(tmp, self.path(key))
+
+    def start_multipart(self, key):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.directory, ".multipart", upload_id))
+        return upload_id
+
+    def put_part(self, key, upload_id, number, body):
+        with open(os.path.join(self.directory, ".multipart", upload_id, str(number)), "wb") as fle:
+            fle.write(body)
+
+    def complete_multipart(self, key, upload_id, count):
+        folder = os.path.join(self.directory, ".multipart", upload_id)
+        tmp = "{0}.{1}.tmp".format(self.path(key), upload_id)
+        with open(tmp, "wb") as fle:
+            for number in range(1, count + 1):
+                with open(os.path.join(folder, str(number)), "rb") as part:
+                    shutil.copyfileobj(part, fle)
+        os.rename(tmp, self.path(key))
+        shutil.rmtree(folder)
+
+class Manifest(object):
+    """
+    A persistent record of the keys we know are already in the object store
+
+    Usage::
+
+        manifest = Manifest("/path/to/manifest.json")
+        manifest.add("<sha256>")
+        manifest.save()
+
+        # In a later run
+        "<sha256>" in manifest
+        # True
+
+    Keys are content hashes so an entry never goes stale unless something
+    deletes objects from the store behind our back.
+    """
+    version = 1
+
+    def __init__(self, location=None):
+        self.location = location
+        self.keys = set()
+        self.load()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def load(self):
+        """Load the manifest from disk if it's there"""
+        if self.location is None or not os.path.exists(self.location):
+            return
+
+        try:
+            with open(self.location) as fle:
+                dct = json.load(fle)
+        except (IOError, ValueError) as error:
+            log.warning("Ignoring unreadable upload manifest at %s (%s)", self.location, error)
+            return
+
+        if dct.get("version") == self.version:
+            self.keys = set(dct["keys"])
+
+    def save(self):
+        """Save the manifest to disk"""
+        if self.location is None:
+            return
+
+        # Write next to the manifest and rename so an interrupted save can't leave half a manifest behind
+        tmp = "{0}.tmp".format(self.location)
+        with open(tmp, "w") as fle:
+            json.dump({"version": self.version, "keys": sorted(self.keys)}, fle, separators=(',', ':'))
+        os.rename(tmp, self.location)
+
+class Uploader(object):
+    """
+    Uploads files to an object store under the hash of their contents
+
+    Usage::
+
+        uploader = Uploader(FolderStore("/path/to/store"), Manifest("/path/to/manifest.json"))
+        uploader.upload(["/path/to/template.json", "/path/to/artifact.zip"])
+        # {"/path/to/template.json": "<sha256>", "/path/to/artifact.zip": "<sha256>"}
+
+    Files with the same contents are only uploaded once in a run, and keys in
+    the manifest or that the store already has aren't uploaded at all.
+
+    Files bigger than part_size are uploaded in parts, and all the files and
+    parts are uploaded in parallel using up to ``threads`` threads.
+    """
+    def __init__(self, store, manifest=None, part_size=8 * 1024 * 1024, threads=8):
+        if manifest is None:
+            manifest = Manifest()
+
+        self.store = store
+        self.threads = threads
+        self.manifest = manifest
+        self.part_size = part_size
+
+    def upload(self, locations):
+        """Upload these files and return {location: key}"""
+        keys = {}
+        unique = {}
+        for location in locations:
+            if not os.path.isfile(location):
+                raise CloudCityError("Can't find file to upload", location=location)
+            key = keys[location] = content_hash(location)
+            unique.setdefault(key, location)
+
+        missing = [(key, location) for key, location in sorted(unique.items()) if key not in self.manifest]
+        missing = self.in_parallel(lambda item: None if self.store.has(item[0]) else item, missing)
+        missing = [item for item in missing if item is not None]
+
+        if missing:
+            log.info("Uploading %s of %s files", len(missing), len(locations))
+            self.put_all(missing)
+
+        for key in unique:
+            self.manifest.add(key)
+        self.manifest.save()
+        return keys
+
+    def put_all(self, objects):
+        """Upload these (key, location) in parallel, using multipart uploads for big files"""
+        tasks = []
+        multiparts = []
+        for key, location in objects:
+            size = os.path.getsize(location)
+            if size <= self.part_size:
+                tasks.append((key, location, None, None, 0, size))
+                continue
+
+            upload_id = self.store.start_multipart(key)
+            count = 0
+            for count, offset in enumerate(range(0, size, self.part_size), 1):
+                tasks.append((key, location, upload_id, count, offset, self.part_size))
+            multiparts.append((key, upload_id, count))
+
+        self.in_parallel(self.put, tasks)
+
+        for key, upload_id, count in multiparts:
+            self.store.complete_multipart(key, upload_id, count)
+
+    def put(self, task):
+        """Upload one file or one part of a file"""
+        key, location, upload_id, number, offset, length = task
+        body = read_part(location, offset, length)
+        if upload_id is None:
+            self.store.put(key, body)
+        else:
+            self.store.put_part(key, upload_id, number, body)
+
+    def in_parallel(self, func, items):
+        """Return [func(item) for item in items] using our pool of threads"""
+        if self.threads == 1 or len(items) < 2:
+            return [func(item) for item in items]
+
+        pool = ThreadPool(min(self.threads, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
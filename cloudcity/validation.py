@@ -0,0 +1,124 @@
+from cloudcity.errors import CloudCityError, MissingMandatoryOptions, BadOptionFormat, StackDepCycle, InvalidConfiguration
+
+from collections import defaultdict
+import logging
+
+log = logging.getLogger("validation")
+
+def normalised_cycle(cycle):
+    """
+    Return a tuple that is the same for a cycle like [a, b, c, a] whichever stack it starts from
+
+    It's rotated to start from the smallest name rather than sorted, so a->b->c->a
+    and a->c->b->a are still different cycles
+    """
+    nodes = cycle[:-1]
+    start = nodes.index(min(nodes))
+    return tuple(nodes[start:] + nodes[:start])
+
+class Validator(object):
+    """
+    Checks our configuration and collects every problem it finds, rather than
+    stopping at the first one.
+
+    Usage::
+
+        validator = Validator(options, stack_resolver)
+        validator.check_mandatory_options()
+        validator.resolve_stacks()
+        validator.check_references()
+        validator.check_cycles()
+
+        # Raises InvalidConfiguration if any of those found problems
+        validator.raise_problems()
+
+        stacks = validator.stacks
+
+    Each check adds to validator.problems and carries on, so a broken
+    configuration can be fixed after one run.
+
+    check_references also records the dependencies of each stack from the
+    references it finds.
+    """
+    def __init__(self, options, stack_resolver):
+        self.options = options
+        self.stack_resolver = stack_resolver
+
+        self.stacks = {}
+        self.checked = 0
+        self.problems = []
+
+    def check_mandatory_options(self):
+        """Make sure we have all the mandatory options"""
+        not_present = []
+        for option in self.options.get("global", {}).get("mandatory_options", []):
+            if not self.options.get(option):
+                not_present.append(option)
+
+        if not_present:
+            self.problems.append(MissingMandatoryOptions(missing=not_present))
+
+    def resolve_stacks(self):
+        """Resolve each stack in our options into a stack object"""
+        for name in self.options:
+            try:
+                self.stacks[name] = self.stack_resolver.resolve(name, self.options[name])
+            except CloudCityError as error:
+                self.problems.append(error)
+
+    def check_references(self):
+        """Make sure all the formatted keys format to keys that will be available and record dependencies"""
+        dependencies = defaultdict(set)
+
+        for name, stack in sorted(self.stacks.items()):
+            try:
+                for needing, requiring in stack.find_required_keys():
+                    for required in requiring:
+                        self.checked += 1
+                        if required.root not in self.options:
+                            self.problems.append(BadOptionFormat("Reference to a stack that doesn't exist", stack=name, key=needing, requires=required))
+                        elif required.root not in self.stacks:
+                            # That stack already has a problem of it's own
+                            continue
+                        elif not self.stacks[required.root].check_option_availablity(required.rest):
+                            self.problems.append(BadOptionFormat("Missing required key", stack=name, key=needing, requires=required))
+                        else:
+                            dependencies[name].add(required.root)
+            except CloudCityError as error:
+                self.problems.append(error)
+
+        for name, required in dependencies.items():
+            self.stacks[name].add_dependencies(sorted(required))
+
+    def check_cycles(self):
+        """Find every cycle in the dependencies between our stacks"""
+        visited = set()
+        seen_cycles = set()
+
+        def visit(name, chain):
+            if name in chain:
+                cycle = chain[chain.index(name):] + [name]
+                normalised = normalised_cycle(cycle)
+                if normalised not in seen_cycles:
+                    seen_cycles.add(normalised)
+                    self.problems.append(StackDepCycle(chain=cycle))
+                return
+
+            if name in visited:
+                return
+
+            chain = chain + [name]
+            for dependency in sorted(self.stacks[name].dependencies):
+                if dependency in self.stacks:
+                    visit(dependency, chain)
+            visited.add(name)
+
+        for name in sorted(self.stacks):
+            visit(name, [])
+
+    def raise_problems(self):
+        """Log all the problems we found and raise InvalidConfiguration if there were any"""
+        if self.problems:
+            for problem in self.problems:
+                log.error("%s: %s", problem.__class__.__name__, problem)
+            raise InvalidConfiguration(problems=len(self.problems))
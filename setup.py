@@ -18,11 +18,16 @@ setup(
         , "nose"
         , "mock"
         ]
+      , "msgpack":
+        [ "msgpack>=0.6.1"
+        ]
       }
 
     , entry_points =
       { 'console_scripts' :
         [ 'cloudcity = cloudcity.executor:main'
+        , 'cloudcity-compile-configs = cloudcity.executor:compile_configs_main'
+        , 'cloudcity-simulate = cloudcity.executor:simulate_main'
         ]
       }
 
@@ -0,0 +1,9 @@
+import tempfile
+import atexit
+import shutil
+import os
+
+# Keep the stack type plugin cache out of the home folder of whoever runs the tests
+cache_dir = tempfile.mkdtemp()
+os.environ["CLOUDCITY_CACHE_DIR"] = cache_dir
+atexit.register(shutil.rmtree, cache_dir, True)
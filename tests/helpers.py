@@ -1,8 +1,15 @@
+from cloudcity.configurations import msgpack
+
 from contextlib import contextmanager
 import tempfile
+import nose
 import shutil
 import os
 
+def skip_without_msgpack():
+    if msgpack is None:
+        raise nose.SkipTest("msgpack isn't installed")
+
 @contextmanager
 def a_temp_file(body=None):
     filename = None
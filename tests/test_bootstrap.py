@@ -0,0 +1,110 @@
+# coding: spec
+
+from cloudcity.resolution.types.config import ConfigStack
+from cloudcity.resolution.base import BaseStack
+from cloudcity.bootstrap import BootStrapper
+from cloudcity.errors import CloudCityError, InvalidConfiguration
+from cloudcity.layers import Layers
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import threading
+
+class BatchedStack(BaseStack):
+    """Records each call to exists_many and waits for another type to be asked at the same time"""
+    calls = []
+    others_asked = None
+
+    def exists(self):
+        raise AssertionError("Should ask about all the stacks together")
+
+    @classmethod
+    def exists_many(kls, stacks):
+        kls.calls.append(sorted(stack.name for stack in stacks))
+        if kls.others_asked is not None:
+            assert kls.others_asked.wait(5), "Stack types weren't asked at the same time"
+        return dict((stack.name, stack.name != "new") for stack in stacks)
+
+class SlowConfigStack(ConfigStack):
+    asked = None
+
+    @classmethod
+    def exists_many(kls, stacks):
+        if kls.asked is not None:
+            kls.asked.set()
+        return super(SlowConfigStack, kls).exists_many(stacks)
+
+describe TestCase, "Checking existence":
+    before_each:
+        BatchedStack.calls = []
+        BatchedStack.others_asked = None
+        SlowConfigStack.asked = None
+
+    def make_layers(self, *stacks):
+        layers = Layers(dict((stack.name, stack) for stack in stacks))
+        layers.add_all_to_layers()
+        return layers
+
+    it "asks each stack type about all of it's stacks in one call":
+        stacks = [BatchedStack(name, MergedOptions.using({})) for name in ("one", "two", "new")]
+        config = ConfigStack("config", MergedOptions.using({}))
+
+        existence = BootStrapper().check_existence(self.make_layers(config, *stacks))
+        self.assertEqual(existence, {"one": True, "two": True, "new": False, "config": True})
+        self.assertEqual(BatchedStack.calls, [["new", "one", "two"]])
+        self.assertEqual([stack.existing for stack in stacks], [True, True, False])
+
+    it "only asks about the named stacks":
+        stacks = [BatchedStack(name, MergedOptions.using({})) for name in ("one", "two", "new")]
+        existence = BootStrapper().check_existence(self.make_layers(*stacks), ["one", "new"])
+        self.assertEqual(existence, {"one": True, "new": False})
+        self.assertEqual([stack.existing for stack in stacks], [True, None, False])
+
+    it "asks the different stack types at the same time":
+        BatchedStack.others_asked = SlowConfigStack.asked = threading.Event()
+        stacks = [BatchedStack("one", MergedOptions.using({})), SlowConfigStack("config", MergedOptions.using({}))]
+        self.assertEqual(BootStrapper().check_existence(self.make_layers(*stacks)), {"one": True, "config": True})
+
+    it "falls back to asking each stack":
+        class Single(BaseStack):
+            def exists(self):
+                return self.name == "one"
+        existence = BootStrapper().check_existence(self.make_layers(Single("one", MergedOptions.using({})), Single("two", MergedOptions.using({}))))
+        self.assertEqual(existence, {"one": True, "two": False})
+
+    it "complains if a stack type forgets about a stack":
+        class Forgetful(BaseStack):
+            @classmethod
+            def exists_many(kls, stacks):
+                return {}
+        with self.assertRaisesRegexp(CloudCityError, "Stack type didn't say whether a stack exists"):
+            BootStrapper().check_existence(self.make_layers(Forgetful("one", MergedOptions.using({}))))
+
+describe TestCase, "Finding impacted layers":
+    before_each:
+        self.options = MergedOptions.using({
+              "global": {"vpc": "vpc-1"}
+            , "network": {"vpc_id": "{global.vpc}"}
+            , "app": {"network": "{network.vpc_id}"}
+            , "other": {"thing": "stuff"}
+            })
+
+    it "redeploys the stacks that reference global when it changes":
+        layers = BootStrapper().get_impacted_layers(self.options, ["global"])
+        self.assertEqual([[name for name, _ in layer] for layer in layers.layered], [["network"], ["app"]])
+
+    it "complains about changed stacks that don't exist":
+        with self.assertRaisesRegexp(CloudCityError, "Missing stack"):
+            BootStrapper().get_impacted_layers(self.options, ["app", "nope"])
+
+describe TestCase, "Investigating required keys":
+    it "checks the references between stacks it didn't resolve":
+        options = MergedOptions.using({"network": {"vpc_id": "vpc-1"}, "app": {"network": "{network.vpc_id}"}})
+        stacks = dict((name, ConfigStack(name, options[name])) for name in ("network", "app"))
+        BootStrapper().investigate_required_keys(stacks)
+        self.assertEqual(stacks["app"].dependencies, ["network"])
+
+        stacks["web"] = ConfigStack("web", MergedOptions.using({"url": "{app.missing}"}))
+        with self.assertRaisesRegexp(InvalidConfiguration, "problems=1"):
+            BootStrapper().investigate_required_keys(stacks)
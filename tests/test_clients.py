@@ -0,0 +1,106 @@
+# coding: spec
+
+from cloudcity.resolution.base import BaseStack
+from cloudcity.errors import CloudCityError
+from cloudcity.clients import ClientPool
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp, noy_sup_tearDown
+from option_merge import MergedOptions
+from unittest import TestCase
+import SocketServer
+import threading
+import socket
+
+class StubServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """A local server that counts connections and answers each line with the region and account it was told"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.connections = 0
+        SocketServer.TCPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+
+class StubHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        for line in iter(self.rfile.readline, ""):
+            self.wfile.write(line)
+
+class StubClient(object):
+    """Holds a connection to the StubServer and is safe to share between threads"""
+    def __init__(self, address, region, account):
+        self.name = "{0}/{1}".format(region, account)
+        self.lock = threading.Lock()
+        self.sock = socket.create_connection(address)
+        self.rfile = self.sock.makefile()
+        self.closed = False
+
+    def call(self):
+        with self.lock:
+            self.sock.sendall("{0}\n".format(self.name))
+            return self.rfile.readline().strip()
+
+    def close(self):
+        self.closed = True
+        self.rfile.close()
+        self.sock.close()
+
+describe TestCase, "ClientPool":
+    before_each:
+        self.server = StubServer()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.pool = ClientPool(lambda region, account: StubClient(self.server.server_address, region, account))
+
+    after_each:
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    it "makes one client for each region and account":
+        first = self.pool.client("ap-southeast-2", "123")
+        self.assertIs(self.pool.client("ap-southeast-2", "123"), first)
+        other = self.pool.client("us-east-1", "123")
+        self.assertIsNot(other, first)
+
+        self.assertEqual(first.call(), "ap-southeast-2/123")
+        self.assertEqual(other.call(), "us-east-1/123")
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.pool.metrics(), {"clients": 2, "created": 2, "reused": 1, "reused_by_client": {"ap-southeast-2/123": 1}})
+
+    it "only makes one client when many threads ask at once":
+        answers = []
+        def use_client():
+            answers.append(self.pool.client("ap-southeast-2", "123").call())
+        threads = [threading.Thread(target=use_client) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(answers, ["ap-southeast-2/123"] * 10)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.pool.metrics()["reused"], 9)
+
+    it "closes it's clients":
+        client = self.pool.client("ap-southeast-2", "123")
+        self.pool.close()
+        self.assertEqual(client.closed, True)
+        self.assertIsNot(self.pool.client("ap-southeast-2", "123"), client)
+
+    it "complains when it can't make clients":
+        with self.assertRaisesRegexp(CloudCityError, "Nothing knows how to make backend clients"):
+            ClientPool().client("ap-southeast-2", "123")
+
+describe TestCase, "Stack clients":
+    it "gets clients from the shared pool":
+        pool = ClientPool(lambda region, account: object())
+        one = BaseStack("one", MergedOptions.using({}))
+        two = BaseStack("two", MergedOptions.using({}))
+        one.client_pool = two.client_pool = pool
+        self.assertIs(one.client("ap-southeast-2", "123"), two.client("ap-southeast-2", "123"))
+
+    it "complains without a pool":
+        with self.assertRaisesRegexp(CloudCityError, "Stack doesn't have a client pool"):
+            BaseStack("one", MergedOptions.using({})).client("ap-southeast-2", "123")
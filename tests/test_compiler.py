@@ -0,0 +1,61 @@
+# coding: spec
+
+from cloudcity.configurations import ConfigurationFinder, msgpack
+from cloudcity.errors import FailedConfigPickup
+from cloudcity.compiler import ConfigCompiler
+
+from tests.helpers import setup_directory, skip_without_msgpack
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+import json
+import os
+
+describe TestCase, "ConfigCompiler":
+    before_each:
+        skip_without_msgpack()
+
+        self.hierarchy = {
+              "one":
+              [ ("a.json", json.dumps({"stack": {"a": 1, "b": {"c": 2}}}))
+              , ("b.yaml", "stack:\n  a: 3\nother:\n  d: '{stack.a}'\n")
+              , {"nested": [("c.json", json.dumps({"other": {"e": [1, 2]}})), ("empty.json", "")]}
+              , ("notes.txt", "not a config")
+              ]
+            , "two":
+              [ ("a.json", json.dumps({"stack": {"a": 4}}))
+              ]
+            }
+
+    it "writes each config as msgpack under the same name":
+        with setup_directory(self.hierarchy) as (root, record):
+            output = os.path.join(root, "compiled")
+            made = ConfigCompiler(output).compile([record["one"]["/folder/"]])
+
+            self.assertEqual([os.path.relpath(location, output) for location in made], ["a.json.msgpack", "b.yaml.msgpack", "nested/c.json.msgpack", "nested/empty.json.msgpack"])
+            with open(os.path.join(output, "b.yaml.msgpack"), "rb") as fle:
+                self.assertEqual(msgpack.unpackb(fle.read(), raw=False), {"stack": {"a": 3}, "other": {"d": "{stack.a}"}})
+
+    it "compiles into files that merge the same way as the originals":
+        with setup_directory(self.hierarchy) as (root, record):
+            folders = [record["one"]["/folder/"], record["two"]["/folder/"]]
+            output = os.path.join(root, "compiled")
+            ConfigCompiler(output).compile(folders)
+            self.assertEqual(sorted(os.listdir(output)), ["00", "01"])
+
+            original = ConfigurationFinder(folders).make_options()
+            compiled = ConfigurationFinder([output]).make_options()
+            self.assertEqual(sorted(compiled.as_flat()), sorted(original.as_flat()))
+            self.assertEqual(compiled["stack.a"], 4)
+
+    it "complains about values msgpack can't hold instead of changing them":
+        with setup_directory({"one": [("a.yaml", "stack:\n  when: 2015-01-02\n")]}) as (root, record):
+            output = os.path.join(root, "compiled")
+            with self.assertRaisesRegexp(FailedConfigPickup, "Config has values that can't be compiled into msgpack"):
+                ConfigCompiler(output).compile([record["one"]["/folder/"]])
+            self.assertFalse(os.path.exists(os.path.join(output, "a.yaml.msgpack")))
+
+    it "complains about configs it can't read":
+        with setup_directory({"one": [("a.json", "{"), ("b.json", "{}")]}) as (root, record):
+            with self.assertRaisesRegexp(FailedConfigPickup, "Failed to pickup configs"):
+                ConfigCompiler(os.path.join(root, "compiled")).compile([record["one"]["/folder/"]])
@@ -0,0 +1,115 @@
+# coding: spec
+
+from cloudcity.configurations import ConfigurationFinder
+from cloudcity.config_index import ConfigIndex, references_in
+from cloudcity.errors import FailedConfigPickup
+
+from tests.helpers import setup_directory, a_temp_dir
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+import mock
+import json
+import os
+
+describe TestCase, "Finding references":
+    it "finds the stacks referenced anywhere in a value":
+        value = {"a": "{one.thing}-{two.other.thing}", "b": ["{three.thing}", {"c": "{one.blah:02d}"}], "d": 1, "e": "{{not.this}}"}
+        self.assertEqual(references_in(value), set(["one", "two", "three"]))
+
+    it "ignores invalid format strings":
+        self.assertEqual(references_in(["{", "{one.thing}"]), set(["one"]))
+
+describe TestCase, "ConfigIndex":
+    before_each:
+        self.hierarchy = {
+              "configs":
+              [ ("one.json", json.dumps({"global": {"mandatory_options": ["account.id"]}, "network": {"vpc": "vpc-1"}}))
+              , ("two.json", json.dumps({"app": {"vpc": "{network.vpc}"}, "other": {"x": 1}}))
+              , ("three.json", json.dumps({"web": {"app": "{app.vpc}"}, "unrelated": {"y": "{other.x}"}}))
+              , ("four.json", json.dumps({"account": {"id": 123}}))
+              , ("not_a_config.txt", "blah")
+              ]
+            }
+
+    it "indexes the keys in each file and what they reference":
+        with setup_directory(self.hierarchy) as (root, record):
+            location = os.path.join(root, "index.json")
+            index = ConfigIndex(location)
+            index.update([record["configs"]["/folder/"]])
+
+            files = dict((os.path.basename(name), info["keys"]) for name, info in index.files.items())
+            self.assertEqual(files
+                , { "one.json": {"global": ["account"], "network": []}
+                  , "two.json": {"app": ["network"], "other": []}
+                  , "three.json": {"web": ["app"], "unrelated": ["other"]}
+                  , "four.json": {"account": []}
+                  }
+                )
+
+            self.assertEqual(ConfigIndex(location).files, json.loads(json.dumps(index.files)))
+
+    it "finds the stacks and files needed for a target":
+        with setup_directory(self.hierarchy) as (root, record):
+            index = ConfigIndex(os.path.join(root, "index.json"))
+            index.update([record["configs"]["/folder/"]])
+
+            stacks, files = index.closure("web")
+            self.assertEqual(stacks, set(["web", "app", "network", "global", "account"]))
+            self.assertEqual(sorted(os.path.basename(name) for name in files), ["four.json", "one.json", "three.json", "two.json"])
+
+            stacks, files = index.closure("network")
+            self.assertEqual(stacks, set(["network", "global", "account"]))
+            self.assertEqual(sorted(os.path.basename(name) for name in files), ["four.json", "one.json"])
+
+    it "only reads files that have changed":
+        with setup_directory(self.hierarchy) as (root, record):
+            folder = record["configs"]["/folder/"]
+            location = os.path.join(root, "index.json")
+            ConfigIndex(location).update([folder])
+
+            index = ConfigIndex(location)
+            with mock.patch("cloudcity.configurations.ConfigReader.as_dict") as as_dict:
+                index.update([folder])
+            self.assertEqual(len(as_dict.mock_calls), 0)
+
+            with open(record["configs"]["two.json"], "w") as fle:
+                fle.write(json.dumps({"app": {"vpc": "{network.vpc}", "name": "an_app"}}))
+            os.remove(record["configs"]["four.json"])
+
+            index.update([folder])
+            files = dict((os.path.basename(name), info["keys"]) for name, info in index.files.items())
+            self.assertEqual(sorted(files), ["one.json", "three.json", "two.json"])
+            self.assertEqual(files["two.json"], {"app": ["network"]})
+
+    it "always includes files it can't read so the finder complains about them":
+        self.hierarchy["configs"].append(("broken.json", "{"))
+        with setup_directory(self.hierarchy) as (root, record):
+            folder = record["configs"]["/folder/"]
+            location = os.path.join(root, "index.json")
+            ConfigIndex(location).update([folder])
+
+            index = ConfigIndex(location)
+            self.assertEqual(index.files[record["configs"]["broken.json"]]["keys"], {})
+            self.assertEqual(index.files[record["configs"]["broken.json"]]["invalid"], True)
+
+            wanted, only_files = index.closure("network")
+            self.assertEqual(sorted(os.path.basename(name) for name in only_files), ["broken.json", "four.json", "one.json"])
+
+            with self.assertRaisesRegexp(FailedConfigPickup, "broken.json"):
+                ConfigurationFinder([folder], wanted=wanted, only_files=only_files).pick_up_configs()
+
+    it "can be kept only in memory":
+        with setup_directory(self.hierarchy) as (root, record):
+            folder = record["configs"]["/folder/"]
+            index = ConfigIndex(None)
+            index.update([folder])
+            self.assertEqual(index.closure("web")[0], set(["web", "app", "network", "global", "account"]))
+            self.assertEqual(sorted(os.listdir(root)), ["configs"])
+
+    it "ignores an index it can't read":
+        with a_temp_dir() as directory:
+            location = os.path.join(directory, "index.json")
+            with open(location, "w") as fle:
+                fle.write("{")
+            self.assertEqual(ConfigIndex(location).files, {})
@@ -1,16 +1,17 @@
 # coding: spec
 
-from cloudcity.configurations import MergedOptionStringFormatter, ConfigReader, ConfigurationFinder, ConfigurationResolver
-from cloudcity.errors import BadOptionFormat, BadConfigResolver, InvalidConfigFile, FailedConfigPickup
+from cloudcity.configurations import MergedOptionStringFormatter, ConfigReader, ConfigurationFinder, ConfigurationResolver, ReferenceResolver, msgpack
+from cloudcity.errors import BadOptionFormat, BadConfigResolver, InvalidConfigFile, FailedConfigPickup, OptionReferenceCycle
 from option_merge import MergedOptions
 
-from tests.helpers import a_temp_file, setup_directory, a_temp_dir
+from tests.helpers import a_temp_file, setup_directory, a_temp_dir, skip_without_msgpack
 
 from noseOfYeti.tokeniser.support import noy_sup_setUp
 from unittest import TestCase
 
 from textwrap import dedent
 import json
+import mmap
 import yaml
 import mock
 import re
@@ -59,12 +60,53 @@ describe TestCase, "MergedOptions string formatter":
         result = formatter.format("{other.e}.t")
         self.assertEqual(result, "4.t")
 
+describe TestCase, "ReferenceResolver":
+    before_each:
+        self.all_options = MergedOptions.using(
+              {"network": {"vpc": "vpc-1", "name": "{app.prefix}-net"}}
+            , {"app": {"prefix": "{global.env}-app", "vpc": "{network.vpc}", "dct": {"a": 1}}}
+            , {"global": {"env": "dev"}}
+            , {"other": {"type": "not_a_config", "thing": 1}}
+            )
+        self.resolver = ReferenceResolver(self.all_options)
+
+    it "resolves templates inside referenced values":
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=self.resolver)
+        self.assertEqual(formatter.format("{network.name}/{app.vpc}"), "dev-app-net/vpc-1")
+        self.assertEqual(formatter.found_requirements, ["network.name", "app.vpc"])
+        self.assertEqual(self.resolver.values, {"network.name": "dev-app-net", "app.prefix": "dev-app", "global.env": "dev", "app.vpc": "vpc-1", "network.vpc": "vpc-1"})
+
+    it "only looks up each reference and stack type once":
+        get = mock.Mock(name="get", side_effect=self.all_options.get)
+        with mock.patch.object(self.all_options, "get", get):
+            for _ in range(3):
+                MergedOptionStringFormatter(self.all_options, resolver=self.resolver).format("{app.prefix} {global.env} {app.vpc}")
+
+        looked_up = sorted(call[1][0] for call in get.mock_calls)
+        self.assertEqual(looked_up, sorted(["app.prefix", "global.env", "app.vpc", "network.vpc", "app.type", "global.type", "network.type"]))
+
+    it "complains about references that refer back to themselves":
+        self.all_options.update({"loop": {"a": "{loop.b}", "b": "x{loop.c}", "c": "{loop.a}"}})
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=self.resolver)
+        with self.assertRaisesRegexp(OptionReferenceCycle, re.escape("chain=['loop.a', 'loop.b', 'loop.c', 'loop.a']")):
+            formatter.format("{loop.a}")
+
+    it "still complains about dictionaries and non config stacks":
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=self.resolver)
+        with self.assertRaisesRegexp(BadOptionFormat, "Shouldn't format in a dictionary"):
+            formatter.format("{app.dct}")
+        with self.assertRaisesRegexp(BadOptionFormat, "Can only resolve options from 'config' stacks"):
+            formatter.format("{other.thing}")
+
 describe TestCase, "ConfigReader":
     before_each:
         self.reader = ConfigReader()
 
     it "setup default resolvers":
-        self.assertEqual(self.reader.resolvers, {"json": self.reader.read_json, "yaml": self.reader.read_yaml})
+        expected = {"json": self.reader.read_json, "yaml": self.reader.read_yaml}
+        if msgpack is not None:
+            expected["msgpack"] = self.reader.read_msgpack
+        self.assertEqual(self.reader.resolvers, expected)
 
     describe "Registering a resolver":
         it "overrides that extension in resolvers":
@@ -168,6 +210,19 @@ describe TestCase, "ConfigReader":
             with a_temp_file(yaml.dump(dct)) as filename:
                 self.assertEqual(self.reader.read_yaml(filename), dct)
 
+        it "memory maps files over the mmap_threshold":
+            dct = {"a": 1, "b": 2, "c": [1, 2, 3]}
+            with a_temp_file(yaml.dump(dct)) as filename:
+                self.reader.mmap_threshold = 1
+                with self.reader.opened(filename) as fle:
+                    self.assertIsInstance(fle, mmap.mmap)
+                self.assertEqual(self.reader.read_yaml(filename), dct)
+
+                self.reader.mmap_threshold = None
+                with self.reader.opened(filename) as fle:
+                    self.assertIsInstance(fle, file)
+                self.assertEqual(self.reader.read_yaml(filename), dct)
+
         it "Doesn't complain if there is no yaml to read":
             with a_temp_file() as filename:
                 self.assertEqual(self.reader.read_yaml(filename), {})
@@ -197,6 +252,29 @@ describe TestCase, "ConfigReader":
                     with self.assertRaisesRegexp(InvalidConfigFile, re.escape('"Invalid config file. Failed to read yaml"\terror={0}\terror_type=ParserError'.format(error))):
                         self.reader.read_yaml(filename)
 
+    describe "Reading msgpack":
+        before_each:
+            skip_without_msgpack()
+
+        it "loads it from the file":
+            dct = {"a": 1, "b": "two", "c": [1, 2, 3], "d": {"e": True}}
+            with a_temp_file(msgpack.packb(dct, use_bin_type=True)) as filename:
+                self.assertEqual(self.reader.read_msgpack(filename), dct)
+
+        it "loads keys that aren't strings":
+            dct = {1: "one", "a": {2: "two"}}
+            with a_temp_file(msgpack.packb(dct, use_bin_type=True)) as filename:
+                self.assertEqual(self.reader.read_msgpack(filename), dct)
+
+        it "Doesn't complain if there is no msgpack to read":
+            with a_temp_file() as filename:
+                self.assertEqual(self.reader.read_msgpack(filename), {})
+
+        it "Complains if the msgpack is invalid":
+            with a_temp_file("\xc1") as filename:
+                with self.assertRaisesRegexp(InvalidConfigFile, re.escape('"Invalid config file. Failed to read msgpack"')):
+                    self.reader.read_msgpack(filename)
+
 describe TestCase,"ConfigurationFinder":
     before_each:
         self.folders = mock.Mock(name="folders")
@@ -328,6 +406,40 @@ describe TestCase,"ConfigurationFinder":
             self.config_reader.as_dict.assert_has_calls([  mock.call(self.cf1),                      mock.call(self.cf3), mock.call(self.cf4)], any_order=False)
             add.assert_has_calls([mock.call("b", {"bb": 22})])
 
+        it "can merge each file into one dictionary per stack as it goes":
+            with setup_directory({"one": [("a.json", '{"a": {"b": {"c": 1, "d": 2}, "e": 3}, "f": {"g": 4}}'), ("b.json", '{"a": {"b": {"c": 5}, "e": {"h": 6}}}')]}) as (root, record):
+                finder = ConfigurationFinder([root], streaming=True)
+                finder.pick_up_configs()
+                self.assertEqual(dict(finder._found), {"a": [{"b": {"c": 5, "d": 2}, "e": {"h": 6}}], "f": [{"g": 4}]})
+
+                options = finder.make_options()
+                self.assertEqual(sorted(options.as_flat()), sorted([("a.b.c", 5), ("a.b.d", 2), ("a.e.h", 6), ("f.g", 4)]))
+
+        it "doesn't change shared dictionaries when streaming":
+            shared = {"b": 1}
+            finder = ConfigurationFinder([], streaming=True)
+            finder.add("one", shared)
+            finder.add("one", {"b": 2})
+            finder.add("two", {"c": shared})
+            finder.add("two", {"c": {"d": 3}})
+            self.assertEqual(shared, {"b": 1})
+            self.assertEqual(dict(finder._found), {"one": [{"b": 2}], "two": [{"c": {"b": 1, "d": 3}}]})
+
+        it "only keeps the wanted stacks and global":
+            with setup_directory({"one": [("a.json", '{"a": {"b": 1}, "c": {"d": 2}, "global": {"e": 3}}')]}) as (root, record):
+                finder = ConfigurationFinder([root], wanted=["a"])
+                finder.pick_up_configs()
+                self.assertEqual(dict(finder._found), {"a": [{"b": 1}], "global": [{"e": 3}]})
+                self.assertEqual(finder.stacks_from_file(record["one"]["a.json"]), ["a", "c", "global"])
+
+        it "remembers which files defined each stack":
+            with setup_directory({"one": [("a.json", '{"a": {}, "b": {}}'), ("b.json", '{"b": {}}')]}) as (root, record):
+                finder = ConfigurationFinder([root])
+                finder.pick_up_configs()
+                self.assertEqual(finder.stacks_from_file(record["one"]["a.json"]), ["a", "b"])
+                self.assertEqual(finder.stacks_from_file(record["one"]["b.json"]), ["b"])
+                self.assertEqual(finder.stacks_from_file(os.path.join(root, "nope.json")), [])
+
     describe "Getting all the files in sorted order":
         before_each:
             self.hierarchy = {
@@ -414,7 +526,7 @@ describe TestCase,"ConfigurationFinder":
 
 describe TestCase, "Configuration Resolver":
     before_each:
-        self.finder = mock.Mock(name="finder")
+        self.finder = mock.Mock(name="finder", streaming=False)
 
     it "takes in a finder and extra options":
         resolver = ConfigurationResolver(self.finder)
@@ -526,6 +638,14 @@ describe TestCase, "Configuration Resolver":
 
             self.assertEqual(sorted(new_options.as_flat()), sorted(expected))
 
+        it "uses what a streaming finder made without copying it":
+            with setup_directory({"one": [("a.json", '{"a": {"things": [1, 2], "dev": {"others": [3]}}}')]}) as (root, record):
+                finder = ConfigurationFinder([root], streaming=True)
+                resolved = ConfigurationResolver(finder).resolved(",dev")
+                found = finder.found["a"][0]
+                self.assertIs(resolved["a"]["things"], found["things"])
+                self.assertIs(resolved["a"]["others"], found["dev"]["others"])
+
         it "does not resolve if the stack has no_resolve set to True":
             options = MergedOptions.using(
                   {"security_groups": {"blah": False, "common": {"blah": True}}}
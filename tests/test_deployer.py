@@ -0,0 +1,337 @@
+# coding: spec
+
+from cloudcity.errors import FailedDeployment, BadJournal, BadStack, CloudCityError
+from cloudcity.resolution.tracker import Tracker
+from cloudcity.resolution.base import BaseStack
+from cloudcity.deployer import Deployer
+from cloudcity.resources import ResourceLimits
+from cloudcity.preparation import Preparation
+from cloudcity.durations import Durations
+from cloudcity.metrics import Metrics
+from cloudcity.progress import ProgressView
+from cloudcity.journal import Journal
+from cloudcity.layers import Layers
+
+from tests.helpers import a_temp_file
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+from StringIO import StringIO
+import threading
+import mock
+
+class FakeTracker(Tracker):
+    """A tracker that moves onto the next state each time it's asked if it's done"""
+    def __init__(self, states):
+        self.states = list(states)
+
+    def done_yet(self):
+        if len(self.states) > 1:
+            self.states.pop(0)
+            return False
+        return True
+
+    def current_state(self):
+        return self.states[0]
+
+    def progress_update(self):
+        return [self.states[0]]
+
+class TimedTracker(Tracker):
+    """A tracker that moves the clock forward by how long the deploy took"""
+    def __init__(self, now, took):
+        self.now = now
+        self.took = took
+
+    def done_yet(self):
+        self.now[0] += self.took
+        return True
+
+    def current_state(self):
+        return Tracker.FINISHED
+
+class FakeStack(BaseStack):
+    """A stack that records when it was deployed and finishes with the state it's told"""
+    def __init__(self, name, options, deployed, states=(Tracker.FINISHED, ), cancellable=False):
+        super(FakeStack, self).__init__(name, options)
+        self.states = states
+        self.deployed = deployed
+        self.cancelled = False
+        self.cancellable = cancellable
+
+    def start_deployment(self):
+        self.deployed.append(self.name)
+
+    def cancel_deployment(self):
+        self.cancelled = self.cancellable
+        return self.cancellable
+
+    def deployment_tracker(self):
+        return FakeTracker(self.states)
+
+class QuotaBackend(object):
+    """A fake backend that throttles when more deploys than it's quotas allow are running against a resource"""
+    def __init__(self, quotas, polls=2):
+        self.polls = polls
+        self.quotas = quotas
+        self.active = {}
+        self.peak = {}
+        self.throttled = []
+
+    def start(self, name, keys):
+        for key in keys:
+            self.active[key] = self.active.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.active[key])
+            if self.active[key] > self.quotas.get(key, 1000):
+                self.throttled.append(name)
+        return QuotaTracker(self, keys)
+
+class QuotaTracker(Tracker):
+    def __init__(self, backend, keys):
+        self.keys = keys
+        self.backend = backend
+        self.polls = backend.polls
+
+    def done_yet(self):
+        self.polls -= 1
+        if self.polls > 0:
+            return False
+        for key in self.keys:
+            self.backend.active[key] -= 1
+        return True
+
+    def current_state(self):
+        return Tracker.FINISHED
+
+class QuotaStack(BaseStack):
+    """A stack that deploys against a QuotaBackend using it's account and region"""
+    resource_options = ["account", "region"]
+
+    def __init__(self, name, options, backend):
+        super(QuotaStack, self).__init__(name, options)
+        self.backend = backend
+
+    def start_deployment(self):
+        self.tracker = self.backend.start(self.name, self.resource_keys())
+
+    def deployment_tracker(self):
+        return self.tracker
+
+describe TestCase, "Journal":
+    it "knows which stacks finished":
+        with a_temp_file() as location:
+            journal = Journal(location, clock=lambda: 10)
+            journal.record(Journal.STARTED, "one", "a")
+            journal.record(Journal.FINISHED, "one", "a")
+            journal.record(Journal.STARTED, "two", "b")
+            journal.record(Journal.FINISHED, "two", "b")
+            journal.record(Journal.STARTED, "two", "c")
+            journal.record(Journal.STARTED, "three", "d")
+            self.assertEqual(Journal(location).completed(), {"one": "a"})
+
+            with open(location) as fle:
+                self.assertEqual(fle.readline(), '{"event": "started", "fingerprint": "a", "stack": "one", "time": 10}\n')
+
+    it "ignores a half written last entry":
+        with a_temp_file('{"event": "finished", "stack": "one", "fingerprint": "a"}\n{"event": "fini') as location:
+            self.assertEqual(Journal(location).completed(), {"one": "a"})
+
+    it "complains about broken entries that aren't at the end":
+        with a_temp_file('{"event": "fini\n{"event": "finished", "stack": "one", "fingerprint": "a"}\n') as location:
+            with self.assertRaisesRegexp(BadJournal, "line=1"):
+                Journal(location).completed()
+
+    it "has nothing completed without a file":
+        self.assertEqual(Journal("/nonexistant/journal").completed(), {})
+
+describe TestCase, "Deployer":
+    before_each:
+        self.deployed = []
+        self.stacks = {
+              "one": FakeStack("one", MergedOptions.using({"a": 1}), self.deployed)
+            , "two": FakeStack("two", MergedOptions.using({"b": 2}), self.deployed)
+            , "three": FakeStack("three", MergedOptions.using({"c": 3}), self.deployed)
+            }
+        self.stacks["two"].dependencies = ["one"]
+        self.stacks["three"].dependencies = ["two"]
+        self.layers = Layers(self.stacks)
+        self.layers.add_to_layers("three")
+
+    it "waits for each stack to finish":
+        sleep = mock.Mock(name="sleep")
+        self.stacks["two"].states = ["in_progress", "in_progress", Tracker.FINISHED]
+        Deployer(poll_interval=2, sleep=sleep).deploy(self.layers)
+        self.assertEqual(self.deployed, ["one", "two", "three"])
+        self.assertEqual(sleep.mock_calls, [mock.call(2)])
+
+    it "complains when a stack doesn't finish":
+        self.stacks["two"].states = ["rolled_back"]
+        with self.assertRaisesRegexp(FailedDeployment, r"failed=\['two'\]\tskipped=\['three'\]"):
+            Deployer().deploy(self.layers)
+        self.assertEqual(self.deployed, ["one", "two"])
+
+    it "deploys independent stacks at the same time":
+        self.stacks["four"] = FakeStack("four", MergedOptions.using({"d": 4}), self.deployed, states=["in_progress", Tracker.FINISHED])
+        self.stacks["one"].states = ["in_progress", "in_progress", Tracker.FINISHED]
+        self.layers.add_to_layers("four")
+        report = Deployer(max_parallel=2, sleep=mock.Mock(name="sleep")).deploy(self.layers)
+        self.assertEqual(self.deployed, ["one", "four", "two", "three"])
+        self.assertEqual(report.deployed, ["four", "one", "two", "three"])
+
+    it "keeps deploying independent stacks with continue-independent":
+        self.stacks["four"] = FakeStack("four", MergedOptions.using({"d": 4}), self.deployed)
+        self.stacks["four"].dependencies = ["one"]
+        self.stacks["two"].states = ["rolled_back"]
+        self.layers.add_to_layers("four")
+        with self.assertRaisesRegexp(FailedDeployment, r"failed=\['two'\]\tskipped=\['three'\]"):
+            Deployer(failure_policy=Deployer.CONTINUE_INDEPENDENT).deploy(self.layers)
+        self.assertEqual(sorted(self.deployed), ["four", "one", "two"])
+
+    it "cancels in flight stacks with fail-fast":
+        self.stacks["four"] = FakeStack("four", MergedOptions.using({"d": 4}), self.deployed, states=["in_progress", Tracker.FINISHED], cancellable=True)
+        self.stacks["one"].states = ["rolled_back"]
+        self.layers.add_to_layers("four")
+        with self.assertRaisesRegexp(FailedDeployment, r"cancelled=\['four'\]\tfailed=\['one'\]\tskipped=\['two', 'three'\]"):
+            Deployer(max_parallel=2).deploy(self.layers)
+        self.assertEqual(self.deployed, ["one", "four"])
+        assert self.stacks["four"].cancelled
+
+    it "starts the stack with the longest critical path first":
+        self.stacks["four"] = FakeStack("four", MergedOptions.using({"d": 4}), self.deployed)
+        self.layers.add_to_layers("four")
+
+        durations = Durations()
+        for name, duration in (("one", 10), ("two", 10), ("three", 10), ("four", 100)):
+            durations.record(name, duration)
+        Deployer(durations=durations).deploy(self.layers)
+        self.assertEqual(self.deployed, ["four", "one", "two", "three"])
+
+        durations = Durations()
+        for name, duration in (("one", 10), ("two", 10), ("three", 10), ("four", 15)):
+            durations.record(name, duration)
+        Deployer(durations=durations).deploy(self.layers)
+        self.assertEqual(self.deployed[4:], ["one", "two", "four", "three"])
+
+    it "records how long each stack took":
+        now = [0]
+        for name, took in (("one", 10), ("two", 20), ("three", 30)):
+            self.stacks[name].deployment_tracker = lambda took=took: TimedTracker(now, took)
+
+        durations = Durations()
+        metrics = Metrics()
+        Deployer(durations=durations, metrics=metrics, clock=lambda: now[0]).deploy(self.layers)
+        self.assertEqual(durations.stacks, {"one": 10, "two": 20, "three": 30})
+
+        rendered = metrics.render()
+        self.assertIn('cloudcity_stack_deploy_seconds_sum{stack="two"} 20', rendered)
+        self.assertIn('cloudcity_stack_deploys_total{stack="three",state="finished"} 1', rendered)
+        self.assertIn('cloudcity_stack_wait_seconds_count{stack="one"} 1', rendered)
+
+    it "keeps within the limits for each resource":
+        backend = QuotaBackend({"account=a": 2, "account=b": 2})
+        stacks = {}
+        for account in ("a", "b"):
+            for index in range(3):
+                name = "{0}{1}".format(account, index)
+                stacks[name] = QuotaStack(name, MergedOptions.using({"account": account, "region": "ap-southeast-2"}), backend)
+        layers = Layers(stacks)
+        layers.add_all_to_layers()
+
+        Deployer(max_parallel=6, sleep=mock.Mock(name="sleep")).deploy(layers)
+        self.assertEqual(sorted(set(backend.throttled)), ["a2", "b2"])
+
+        backend.throttled = []
+        backend.peak = {}
+        resources = ResourceLimits([("account=*", 2)])
+        Deployer(max_parallel=6, resources=resources, sleep=mock.Mock(name="sleep")).deploy(layers)
+        self.assertEqual(backend.throttled, [])
+        self.assertEqual(backend.peak, {"account=a": 2, "account=b": 2, "region=ap-southeast-2": 4})
+        self.assertEqual(dict(resources.in_use), {})
+
+    it "prepares later layers while earlier layers deploy":
+        one_started = threading.Event()
+        prepared = []
+
+        def prepare_layer(names):
+            if names == ["three"]:
+                assert one_started.wait(5), "Waited for everything to be prepared before deploying"
+            prepared.extend(names)
+
+        self.stacks["one"].start_deployment = lambda: (self.deployed.append("one"), one_started.set())
+        self.stacks["two"].start_deployment = lambda: self.deployed.append(("two", list(prepared)))
+
+        preparation = Preparation(self.layers, prepare_layer)
+        preparation.start()
+        Deployer(preparation=preparation, sleep=mock.Mock(name="sleep")).deploy(self.layers)
+        self.assertEqual(self.deployed[0], "one")
+        self.assertIn("two", self.deployed[1][1])
+        self.assertEqual(prepared, ["one", "two", "three"])
+
+    it "complains if preparing fails":
+        def prepare_layer(names):
+            if names == ["two"]:
+                raise BadStack("Bad two")
+
+        preparation = Preparation(self.layers, prepare_layer)
+        preparation.start()
+        with self.assertRaisesRegexp(BadStack, "Bad two"):
+            Deployer(preparation=preparation, sleep=mock.Mock(name="sleep")).deploy(self.layers)
+        self.assertEqual(self.deployed, ["one"])
+
+    it "tells the progress view about each stack":
+        self.stacks["two"].states = ["in_progress", "in_progress", Tracker.FINISHED]
+        stream = StringIO()
+        progress = ProgressView(stream, interval=0)
+        Deployer(progress=progress, sleep=mock.Mock(name="sleep")).deploy(self.layers)
+        self.assertIn("Progress: 1 deploying, 1 finished; two: in_progress (2 events)", stream.getvalue())
+        self.assertEqual(progress.finished_count, 3)
+
+    it "complains about unknown strategies":
+        with self.assertRaisesRegexp(CloudCityError, "Unknown scheduling strategy"):
+            Deployer(strategy="whatever")
+
+    it "complains about unknown failure policies":
+        with self.assertRaisesRegexp(CloudCityError, "Unknown failure policy"):
+            Deployer(failure_policy="whatever")
+
+    it "resumes from the journal and redeploys stacks that changed":
+        with a_temp_file() as location:
+            self.stacks["two"].states = ["rolled_back"]
+            with self.assertRaises(FailedDeployment):
+                Deployer(journal=Journal(location)).deploy(self.layers)
+
+            self.stacks["two"].states = [Tracker.FINISHED]
+            Deployer(journal=Journal(location), resume=True).deploy(self.layers)
+            self.assertEqual(self.deployed, ["one", "two", "two", "three"])
+
+            self.stacks["three"].rendered = {"c": 4}
+            Deployer(journal=Journal(location), resume=True).deploy(self.layers)
+            self.assertEqual(self.deployed, ["one", "two", "two", "three", "three"])
+
+    it "only says what it would deploy on a dry run":
+        durations = Durations()
+        outputs = mock.Mock(name="outputs")
+        with a_temp_file() as location:
+            report = Deployer(journal=Journal(location), dry_run=True, durations=durations, outputs=outputs).deploy(self.layers)
+            self.assertEqual((self.deployed, report.deployed), ([], []))
+            self.assertEqual(Journal(location).completed(), {})
+            self.assertEqual(durations.stacks, {})
+            self.assertEqual(outputs.invalidate.mock_calls, [])
+
+            Deployer(journal=Journal(location), resume=True).deploy(self.layers)
+            self.assertEqual(self.deployed, ["one", "two", "three"])
+
+            report = Deployer(journal=Journal(location), resume=True, dry_run=True).deploy(self.layers)
+            self.assertEqual(report.unchanged, ["one", "two", "three"])
+
+    it "ignores the journal without resume":
+        with a_temp_file() as location:
+            Deployer(journal=Journal(location)).deploy(self.layers)
+            Deployer(journal=Journal(location)).deploy(self.layers)
+        self.assertEqual(self.deployed, ["one", "two", "three"] * 2)
+
+    it "invalidates outputs of deployed stacks":
+        outputs = mock.Mock(name="outputs")
+        Deployer(outputs=outputs).deploy(self.layers)
+        self.assertEqual(outputs.invalidate.mock_calls, [mock.call("one"), mock.call("two"), mock.call("three")])
@@ -0,0 +1,47 @@
+# coding: spec
+
+from cloudcity.durations import Durations
+
+from tests.helpers import a_temp_file
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+import mock
+
+describe TestCase, "Durations":
+    it "keeps a moving average of each stack":
+        durations = Durations(weight=0.5)
+        durations.record("app", 100)
+        durations.record("app", 200)
+        self.assertEqual(durations.estimate("app"), 150)
+
+    it "estimates unknown stacks from the known ones or the default":
+        durations = Durations(default=30)
+        self.assertEqual(durations.estimate("app"), 30)
+        durations.record("one", 100)
+        durations.record("two", 200)
+        self.assertEqual(durations.estimate("app"), 150)
+
+    it "can be saved and loaded":
+        with a_temp_file() as location:
+            durations = Durations(location)
+            durations.record("app", 100)
+            durations.save()
+            self.assertEqual(Durations(location).estimate("app"), 100)
+
+    it "ignores unreadable files":
+        with a_temp_file("{blah") as location:
+            self.assertEqual(Durations(location).stacks, {})
+
+    it "finds the longest chain of deploys starting from each stack":
+        durations = Durations()
+        for name, duration in (("network", 10), ("db", 100), ("app", 20), ("dns", 5)):
+            durations.record(name, duration)
+
+        stacks = {
+              "network": mock.Mock(name="network", dependencies=[])
+            , "db": mock.Mock(name="db", dependencies=["network"])
+            , "app": mock.Mock(name="app", dependencies=["network", "outside"])
+            , "dns": mock.Mock(name="dns", dependencies=["app", "db"])
+            }
+        self.assertEqual(durations.critical_paths(stacks), {"network": 115, "db": 105, "app": 25, "dns": 5})
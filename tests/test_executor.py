@@ -0,0 +1,206 @@
+# coding: spec
+
+from cloudcity.resolution.types.config import ConfigStack
+from cloudcity.resolution.plugins import PluginCache
+from cloudcity.resolution.tracker import NoWaiting
+from cloudcity.resolution.base import BaseStack
+from cloudcity.executor import main, simulate_main, find_layers, get_parser
+from cloudcity.bootstrap import BootStrapper
+from cloudcity.plan import Plan
+
+from tests.helpers import a_temp_dir, setup_directory
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp, noy_sup_tearDown
+from unittest import TestCase
+from StringIO import StringIO
+import logging
+import json
+import mock
+import os
+
+class NetworkStack(BaseStack):
+    """A stack that outputs how many times a network has been deployed"""
+    aliases = ["test_network"]
+    deploys = 0
+
+    def exists(self):
+        return NetworkStack.deploys > 0
+
+    def start_deployment(self):
+        NetworkStack.deploys += 1
+
+    def deployment_tracker(self):
+        return NoWaiting()
+
+    def outputs(self):
+        return {"vpc_id": "vpc-{0}".format(NetworkStack.deploys)}
+
+class FakeClient(object):
+    """A backend client that remembers where it's for"""
+    def __init__(self, region, account):
+        self.region = region
+        self.account = account
+
+def make_client(region, account):
+    return FakeClient(region, account)
+
+class ClientStack(ConfigStack):
+    """Gets a client for it's region and account when it's deployed"""
+    aliases = ["test_client"]
+    clients = {}
+
+    def start_deployment(self):
+        ClientStack.clients[self.name] = self.client(self.rendered["region"], self.rendered["account"])
+
+class AppStack(ConfigStack):
+    """Records what each app was rendered with when it's deployed"""
+    aliases = ["test_app"]
+    deployed = {}
+
+    def start_deployment(self):
+        AppStack.deployed[self.name] = self.rendered
+
+    def outputs(self):
+        return self.rendered
+
+describe TestCase, "Executing":
+    before_each:
+        NetworkStack.deploys = 0
+        AppStack.deployed = {}
+        ClientStack.clients = {}
+        self.stack_types = {
+              "test_network": "tests.test_executor:NetworkStack"
+            , "test_app": "tests.test_executor:AppStack"
+            , "test_client": "tests.test_executor:ClientStack"
+            }
+
+    def execute(self, directory, stacks, *argv):
+        """Write a plan of these stacks, in this order, and deploy it with main"""
+        location = os.path.join(directory, "plan.json.gz")
+        info = {}
+        for name, options, dependencies in stacks:
+            stack = BaseStack(name, options)
+            info[name] = {"type": options.get("type", "config"), "options": options, "dependencies": dependencies, "fingerprint": stack.fingerprint()}
+        Plan(stacks[-1][0], [[name] for name, _, _ in stacks], info).write(location)
+
+        with mock.patch.object(PluginCache, "stack_types", return_value=self.stack_types):
+            with mock.patch("cloudcity.executor.setup_logging", return_value=None):
+                main(["--plan-in", location] + list(argv))
+
+    it "resolves references to other stacks from their outputs once they're deployed":
+        stacks = [
+              ("network", {"type": "test_network"}, [])
+            , ("app", {"type": "test_app", "vpc": "{network.vpc_id}"}, ["network"])
+            , ("web", {"type": "test_app", "app_vpc": "{app.vpc}"}, ["app"])
+            ]
+
+        with a_temp_dir() as directory:
+            self.execute(directory, stacks)
+            self.assertEqual(AppStack.deployed, {"app": {"type": "test_app", "vpc": "vpc-1"}, "web": {"type": "test_app", "app_vpc": "vpc-1"}})
+
+            self.execute(directory, stacks, "--pipeline")
+            self.assertEqual(AppStack.deployed["web"], {"type": "test_app", "app_vpc": "vpc-2"})
+
+    it "doesn't deploy or journal anything on a dry run":
+        stacks = [("network", {"type": "test_network"}, []), ("app", {"type": "test_app", "vpc": "{network.vpc_id}"}, ["network"])]
+        with a_temp_dir() as directory:
+            journal = os.path.join(directory, "deploy.journal")
+            self.execute(directory, stacks, "--dry-run", "--journal", journal)
+            self.assertEqual((NetworkStack.deploys, AppStack.deployed), (0, {}))
+
+            self.execute(directory, stacks, "--journal", journal, "--resume")
+            self.assertEqual(NetworkStack.deploys, 1)
+            self.assertEqual(AppStack.deployed, {"app": {"type": "test_app", "vpc": "vpc-1"}})
+
+    it "gives stacks clients from the --client-factory":
+        stacks = [
+              ("one", {"type": "test_client", "region": "ap-southeast-2", "account": "123"}, [])
+            , ("two", {"type": "test_client", "region": "ap-southeast-2", "account": "123"}, [])
+            , ("three", {"type": "test_client", "region": "us-east-1", "account": "123"}, ["one", "two"])
+            ]
+
+        with a_temp_dir() as directory:
+            self.execute(directory, stacks, "--client-factory", "tests.test_executor:make_client")
+
+        clients = ClientStack.clients
+        self.assertEqual(sorted(clients), ["one", "three", "two"])
+        self.assertIsInstance(clients["one"], FakeClient)
+        self.assertIs(clients["one"], clients["two"])
+        self.assertEqual((clients["three"].region, clients["three"].account), ("us-east-1", "123"))
+
+    it "complains when stacks want clients and there is no --client-factory":
+        with a_temp_dir() as directory:
+            with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+                with self.assertRaises(SystemExit):
+                    self.execute(directory, [("one", {"type": "test_client", "region": "ap-southeast-2", "account": "123"}, [])])
+        self.assertIn("Nothing knows how to make backend clients", stdout.getvalue())
+        self.assertEqual(ClientStack.clients, {})
+
+    it "checks mandatory options when deploying a plan":
+        stacks = [("account", {"type": "test_app", "name": "dev"}, []), ("app", {"type": "test_app"}, ["account"])]
+        with a_temp_dir() as directory:
+            with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+                with self.assertRaises(SystemExit):
+                    self.execute(directory, stacks, "--mandatory-option", "account.name", "--mandatory-option", "account.id")
+            self.assertIn("InvalidConfiguration", stdout.getvalue())
+            self.assertEqual(AppStack.deployed, {})
+
+            self.execute(directory, stacks, "--mandatory-option", "account.name")
+            self.assertEqual(sorted(AppStack.deployed), ["account", "app"])
+
+    it "complains about a --client-factory that can't be imported":
+        with mock.patch("sys.stderr", new_callable=StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                main(["--plan-in", "plan.json.gz", "--client-factory", "tests.test_executor:nope"])
+        self.assertIn("invalid client_factory value", stderr.getvalue())
+
+    it "still stops the log listener when the metrics can't be written":
+        listener = mock.Mock(name="listener")
+        with a_temp_dir() as directory:
+            location = os.path.join(directory, "plan.json.gz")
+            Plan("one", [["one"]], {"one": {"type": "config", "options": {"type": "config"}, "dependencies": [], "fingerprint": BaseStack("one", {"type": "config"}).fingerprint()}}).write(location)
+            with mock.patch("cloudcity.executor.setup_logging", return_value=listener):
+                with mock.patch("cloudcity.executor.log") as log:
+                    main(["--plan-in", location, "--metrics-out", os.path.join(directory, "nope", "cloudcity.prom")])
+        listener.stop.assert_called_once_with()
+        self.assertEqual(log.error.call_args[0][0], "Failed to write metrics to %s (%s)")
+
+describe TestCase, "Finding layers":
+    it "only keeps the stacks the target needs when streaming configs":
+        hierarchy = {"configs": [
+              ("one.json", json.dumps({"network": {"vpc": "vpc-1"}, "other": {"thing": 1}}))
+            , ("two.json", json.dumps({"app": {"vpc": "{network.vpc}"}}))
+            ]}
+
+        with setup_directory(hierarchy) as (root, record):
+            bootstrap = BootStrapper()
+            args = get_parser().parse_args(["--configs", record["configs"]["/folder/"], "--execute", "app", "--resolve-order", ",", "--stream-configs"])
+            layers = find_layers(bootstrap, args)
+
+        self.assertEqual(sorted(bootstrap.finder.found), ["app", "network"])
+        self.assertEqual([[name for name, _ in layer] for layer in layers.layered], [["network"], ["app"]])
+
+describe TestCase, "Simulating":
+    before_each:
+        self.deployer_log = logging.getLogger("deployer")
+        self.level = self.deployer_log.level
+        self.root_level = logging.getLogger("").level
+
+    after_each:
+        self.deployer_log.setLevel(self.level)
+        logging.getLogger("").setLevel(self.root_level)
+
+    it "doesn't warn about every skipped stack under the report":
+        handler = mock.Mock(name="handler", level=logging.DEBUG)
+        self.deployer_log.addHandler(handler)
+        try:
+            with mock.patch("cloudcity.executor.setup_logging", return_value=None):
+                with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+                    simulate_main(["--synthetic", "30", "--failure-rate", "0.5", "--latency", "fixed:1", "--strategy", "dag"])
+        finally:
+            self.deployer_log.removeHandler(handler)
+
+        levels = set(call[0][0].levelno for call in handler.handle.call_args_list)
+        self.assertEqual(levels, set([logging.ERROR]))
+        self.assertEqual(stdout.getvalue().split("\n")[0].split(), ["Strategy", "Makespan", "Deployed", "Failed", "Skipped", "Throttles"])
+        self.assertGreater(int(stdout.getvalue().split("\n")[1].split()[4]), 0)
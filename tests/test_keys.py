@@ -0,0 +1,45 @@
+# coding: spec
+
+from cloudcity.keys import KeyPath, key_path
+from cloudcity import keys
+
+from unittest import TestCase
+import mock
+
+describe TestCase, "Key paths":
+    it "splits the key once":
+        path = KeyPath("stack.some.option")
+        self.assertEqual(path.key, "stack.some.option")
+        self.assertEqual(path.parts, ("stack", "some", "option"))
+        self.assertEqual(path.root, "stack")
+        self.assertEqual(path.rest, "some.option")
+        self.assertEqual(path.type_key, "stack.type")
+
+    it "has no rest if there is only a root":
+        path = KeyPath("stack")
+        self.assertEqual(path.parts, ("stack", ))
+        self.assertIs(path.rest, None)
+
+    it "compares and hashes like the original key":
+        path = KeyPath("stack.option")
+        self.assertEqual(path, "stack.option")
+        self.assertEqual(path, KeyPath("stack.option"))
+        self.assertNotEqual(path, "stack.other")
+        self.assertEqual(str(path), "stack.option")
+        self.assertEqual(set([path]), set(["stack.option"]))
+
+    it "returns the same KeyPath for the same key":
+        path = key_path("stack.{0}".format("option"))
+        self.assertIs(key_path("stack.option"), path)
+        self.assertIs(key_path(u"stack.option"), path)
+        self.assertIsNot(key_path("stack.other"), path)
+
+    it "doesn't remember more than max_cached keys":
+        with mock.patch.dict(keys.cache, clear=True), mock.patch.object(keys, "max_cached", 3):
+            paths = [key_path("stack.option{0}".format(number)) for number in range(3)]
+            self.assertIs(key_path("stack.option0"), paths[0])
+            self.assertEqual(len(keys.cache), 3)
+
+            key_path("stack.option3")
+            self.assertEqual(sorted(keys.cache), ["stack.option3"])
+            self.assertEqual(key_path("stack.option0"), paths[0])
@@ -0,0 +1,100 @@
+# coding: spec
+
+from cloudcity.logs import QueueHandler, QueueListener, JsonFormatter
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp, noy_sup_tearDown
+from unittest import TestCase
+import threading
+import logging
+import Queue
+import json
+
+class BlockedStream(object):
+    """A stream that can't be written to until it's released"""
+    def __init__(self):
+        self.lines = []
+        self.released = threading.Event()
+
+    def write(self, line):
+        assert self.released.wait(5), "Stream was never released"
+        self.lines.append(line)
+
+    def flush(self):
+        pass
+
+describe TestCase, "Queued logging":
+    before_each:
+        self.log = logging.getLogger("test_logs")
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+
+    after_each:
+        self.log.handlers = []
+
+    it "doesn't make workers wait on the output":
+        stream = BlockedStream()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(threadName)s %(message)s"))
+
+        queue = Queue.Queue()
+        listener = QueueListener(queue, handler)
+        listener.start()
+        self.log.addHandler(QueueHandler(queue))
+
+        def work(index):
+            for number in range(10):
+                self.log.info("worker %s says %s", index, number)
+
+        workers = [threading.Thread(target=work, args=(index, ), name="worker{0}".format(index)) for index in range(5)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(5)
+            self.assertFalse(worker.is_alive(), "Worker was blocked by the output")
+
+        stream.released.set()
+        listener.stop()
+        lines = "".join(stream.lines).strip().split("\n")
+        self.assertEqual(len(lines), 50)
+        self.assertIn("worker3 worker 3 says 9", lines)
+
+    it "formats the message and exception before queueing":
+        queue = Queue.Queue()
+        self.log.addHandler(QueueHandler(queue))
+        things = ["one"]
+        try:
+            raise ValueError("nope")
+        except ValueError:
+            self.log.exception("things are %s", things)
+        things.append("two")
+
+        record = queue.get_nowait()
+        self.assertEqual((record.msg, record.args, record.exc_info), ("things are ['one']", None, None))
+        self.assertIn("ValueError: nope", record.exc_text)
+
+    it "leaves the record alone for the other handlers":
+        queue = Queue.Queue()
+        self.log.addHandler(QueueHandler(queue))
+        seen = []
+        handler = logging.Handler()
+        handler.emit = seen.append
+        self.log.addHandler(handler)
+
+        try:
+            raise ValueError("nope")
+        except ValueError:
+            self.log.exception("things are %s", "fine")
+
+        original = seen[0]
+        self.assertEqual((original.msg, original.args), ("things are %s", ("fine", )))
+        self.assertEqual(original.exc_info[0], ValueError)
+        self.assertIsNot(queue.get_nowait(), original)
+
+describe TestCase, "JsonFormatter":
+    it "formats records as a line of json":
+        record = logging.LogRecord("deployer", logging.INFO, __file__, 1, "Deploying %s", ("app", ), None)
+        dct = json.loads(JsonFormatter().format(record))
+        self.assertEqual(dct["message"], "Deploying app")
+        self.assertEqual(dct["level"], "INFO")
+        self.assertEqual(dct["name"], "deployer")
+        self.assertEqual(sorted(dct), ["level", "message", "name", "thread", "time"])
@@ -0,0 +1,76 @@
+# coding: spec
+
+from cloudcity.errors import CloudCityError
+from cloudcity.metrics import Metrics, NoMetrics
+from cloudcity.resolution.base import BaseStack
+
+from tests.helpers import a_temp_dir
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+import os
+
+describe TestCase, "Metrics":
+    it "renders counters and histograms in the OpenMetrics text format":
+        metrics = Metrics()
+        metrics.buckets = (1, 10)
+        metrics.descriptions = {
+              "things": ("counter", "Some things")
+            , "took_seconds": ("histogram", "How long things took")
+            }
+
+        metrics.inc("things", format="yaml")
+        metrics.inc("things", 2, format='a "json"')
+        metrics.observe("took_seconds", 0.5)
+        metrics.observe("took_seconds", 5)
+        metrics.observe("took_seconds", 50)
+
+        self.assertEqual(metrics.render().split("\n"), [
+              '# TYPE things counter'
+            , '# HELP things Some things'
+            , 'things_total{format="a \\"json\\""} 2'
+            , 'things_total{format="yaml"} 1'
+            , '# TYPE took_seconds histogram'
+            , '# HELP took_seconds How long things took'
+            , 'took_seconds_bucket{le="1"} 1'
+            , 'took_seconds_bucket{le="10"} 2'
+            , 'took_seconds_bucket{le="+Inf"} 3'
+            , 'took_seconds_count 3'
+            , 'took_seconds_sum 55.5'
+            , '# EOF'
+            , ''
+            ])
+
+    it "times things":
+        times = iter([10, 12.5])
+        metrics = Metrics(clock=lambda: next(times))
+        with metrics.timer("cloudcity_layering_seconds"):
+            pass
+        self.assertIn("cloudcity_layering_seconds_sum 2.5\n", metrics.render())
+
+    it "complains about metrics it doesn't know":
+        with self.assertRaisesRegexp(CloudCityError, "Unknown metric"):
+            Metrics().inc("cloudcity_layering_seconds")
+
+    it "writes to a file":
+        with a_temp_dir() as directory:
+            location = os.path.join(directory, "cloudcity.prom")
+            metrics = Metrics()
+            metrics.inc("cloudcity_stacks_resolved", 3)
+            metrics.write(location)
+            with open(location) as fle:
+                self.assertIn("cloudcity_stacks_resolved_total 3\n", fle.read())
+            self.assertEqual(os.listdir(directory), ["cloudcity.prom"])
+
+describe TestCase, "NoMetrics":
+    it "is what stacks have outside of a run":
+        stack = BaseStack("app", {})
+        stack.metrics.inc("cloudcity_throttles", stack=stack.name)
+        stack.metrics.observe("cloudcity_stack_deploy_seconds", 1, stack=stack.name)
+        self.assertIsInstance(stack.metrics, NoMetrics)
+        self.assertEqual(stack.metrics.counters, {})
+        self.assertEqual(stack.metrics.histograms, {})
+
+    it "still complains about metrics it doesn't know":
+        with self.assertRaisesRegexp(CloudCityError, "Unknown metric"):
+            NoMetrics().inc("cloudcity_layering_seconds")
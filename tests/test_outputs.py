@@ -0,0 +1,216 @@
+# coding: spec
+
+from cloudcity.configurations import MergedOptionStringFormatter, ReferenceResolver
+from cloudcity.resolution.outputs import OutputCache, StackOutputs
+from cloudcity.resolution.types.config import ConfigStack
+from cloudcity.resolution.tracker import NoWaiting
+from cloudcity.resolution.base import BaseStack
+from cloudcity.bootstrap import BootStrapper
+from cloudcity.errors import BadOptionFormat
+from cloudcity.resources import ResourceLimits
+from cloudcity.deployer import Deployer
+from cloudcity.layers import Layers
+from cloudcity.keys import key_path
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import threading
+import mock
+
+class FakeOutputProvider(object):
+    """Gives out outputs from a dictionary and records what it was asked for"""
+    def __init__(self, outputs, gate=None):
+        self.gate = gate
+        self.calls = []
+        self.outputs = outputs
+
+    def fetch_outputs(self, stack_name):
+        self.calls.append(stack_name)
+        if self.gate is not None:
+            self.gate.wait()
+        return dict(self.outputs[stack_name])
+
+class NetworkStack(BaseStack):
+    """A stack whose outputs change each time it's deployed"""
+    def __init__(self, name, options):
+        super(NetworkStack, self).__init__(name, options)
+        self.deploys = 0
+
+    def exists(self):
+        return True
+
+    def start_deployment(self):
+        self.deploys += 1
+
+    def deployment_tracker(self):
+        return NoWaiting()
+
+    def outputs(self):
+        return {"vpc_id": "vpc-{0}".format(self.deploys)}
+
+class AppStack(ConfigStack):
+    """Records what it was rendered with when it's deployed"""
+    deployed_with = None
+
+    def start_deployment(self):
+        self.deployed_with = self.rendered
+
+class RegionalAppStack(AppStack):
+    """An app whose region counts towards resource limits"""
+    resource_options = ["region"]
+
+describe TestCase, "OutputCache":
+    before_each:
+        self.now = 0
+        self.provider = FakeOutputProvider({"network": {"vpc_id": "vpc-1"}, "db": {"host": "db.local"}})
+        self.cache = OutputCache(self.provider, ttl=60, clock=lambda: self.now)
+
+    it "only fetches outputs once until they expire":
+        self.assertEqual(self.cache.get(key_path("network.vpc_id")), "vpc-1")
+        self.assertEqual(self.cache.get(key_path("network.vpc_id")), "vpc-1")
+        self.assertEqual(self.cache.get(key_path("db.host")), "db.local")
+        self.assertEqual(self.provider.calls, ["network", "db"])
+
+        self.now = 59
+        self.cache.outputs("network")
+        self.assertEqual(self.provider.calls, ["network", "db"])
+
+        self.now = 60
+        self.cache.outputs("network")
+        self.assertEqual(self.provider.calls, ["network", "db", "network"])
+        self.assertEqual((self.cache.hits, self.cache.fetches), (2, 3))
+
+    it "fetches again after the stack is invalidated":
+        self.cache.outputs("network")
+        self.provider.outputs["network"]["vpc_id"] = "vpc-2"
+        self.cache.invalidate("network")
+        self.assertEqual(self.cache.get(key_path("network.vpc_id")), "vpc-2")
+        self.assertEqual(self.provider.calls, ["network", "network"])
+
+    it "complains about outputs that don't exist":
+        with self.assertRaisesRegexp(BadOptionFormat, "Stack doesn't have that output.+output=subnet"):
+            self.cache.get(key_path("network.subnet"))
+
+    it "doesn't remember failed fetches":
+        with self.assertRaises(KeyError):
+            self.cache.outputs("nope")
+        self.provider.outputs["nope"] = {"a": 1}
+        self.assertEqual(self.cache.outputs("nope"), {"a": 1})
+        self.assertEqual(self.provider.calls, ["nope", "nope"])
+
+    it "only fetches once for concurrent requests":
+        gate = threading.Event()
+        self.provider.gate = gate
+
+        found = []
+        threads = [threading.Thread(target=lambda: found.append(self.cache.outputs("network"))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+
+        # Let the waiting threads pile up behind the first fetch
+        while self.cache.fetches == 0:
+            pass
+        gate.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(found, [{"vpc_id": "vpc-1"}] * 5)
+        self.assertEqual(self.provider.calls, ["network"])
+
+    it "doesn't keep outputs fetched while the stack was being redeployed":
+        original = self.provider.fetch_outputs
+        def fetch_outputs(stack_name):
+            result = original(stack_name)
+            self.cache.invalidate(stack_name)
+            return result
+        self.provider.fetch_outputs = fetch_outputs
+
+        self.cache.outputs("network")
+        self.provider.fetch_outputs = original
+        self.cache.outputs("network")
+        self.assertEqual(self.provider.calls, ["network", "network"])
+
+describe TestCase, "StackOutputs":
+    it "asks the stack for its outputs":
+        stack = mock.Mock(name="stack")
+        stack.outputs.return_value = {"one": 1}
+        self.assertEqual(StackOutputs({"network": stack}).fetch_outputs("network"), {"one": 1})
+
+describe TestCase, "Formatting with outputs":
+    before_each:
+        self.all_options = MergedOptions.using({"network": {"type": "cfn"}, "app": {"vpc": "{network.vpc_id}", "other": "{app.vpc}"}})
+        self.provider = FakeOutputProvider({"network": {"vpc_id": "vpc-1"}})
+
+    it "resolves references to other stack types from their outputs":
+        resolver = ReferenceResolver(self.all_options, outputs=OutputCache(self.provider))
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=resolver)
+        self.assertEqual(formatter.format("{app.other}-{network.vpc_id}"), "vpc-1-vpc-1")
+        self.assertEqual(self.provider.calls, ["network"])
+
+    it "doesn't remember values that were formatted from outputs":
+        outputs = OutputCache(self.provider)
+        resolver = ReferenceResolver(self.all_options, outputs=outputs)
+        self.all_options.update({"web": {"name": "web", "url": "{web.name}.{app.other}"}})
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=resolver)
+        self.assertEqual(formatter.format("{web.url}"), "web.vpc-1")
+        self.assertEqual(resolver.values, {"web.name": "web"})
+
+        self.provider.outputs["network"]["vpc_id"] = "vpc-2"
+        outputs.invalidate("network")
+        self.assertEqual(formatter.format("{web.url}"), "web.vpc-2")
+
+    it "still complains about other stack types without an output cache":
+        formatter = MergedOptionStringFormatter(self.all_options, resolver=ReferenceResolver(self.all_options))
+        with self.assertRaisesRegexp(BadOptionFormat, "Can only resolve options from 'config' stacks"):
+            formatter.format("{app.vpc}")
+
+describe TestCase, "Deploying with an output cache":
+    before_each:
+        self.stacks = {
+              "network": NetworkStack("network", MergedOptions.using({"type": "network", "cidr": "10.0.0.0/16"}))
+            , "app": AppStack("app", MergedOptions.using({"vpc": "{network.vpc_id}"}))
+            , "web": AppStack("web", MergedOptions.using({"app_vpc": "{app.vpc}", "cidr": "{settings.cidr}"}))
+            , "settings": AppStack("settings", MergedOptions.using({"cidr": "10.0.1.0/24"}))
+            }
+        self.stacks["app"].add_dependencies(["network"])
+        self.stacks["web"].add_dependencies(["app", "settings"])
+
+        self.layers = Layers(self.stacks)
+        self.layers.add_all_to_layers()
+        self.bootstrap = BootStrapper()
+        self.cache = OutputCache(StackOutputs(self.stacks))
+
+    it "finds the stacks that need the outputs of other stacks being deployed":
+        self.assertEqual(self.bootstrap.needs_outputs(self.layers), set(["app", "web"]))
+
+    it "renders stacks that need outputs once the stacks they need are deployed":
+        # Something looked at the network before it was redeployed
+        self.assertEqual(self.cache.get(key_path("network.vpc_id")), "vpc-0")
+
+        self.bootstrap.prepare_stacks(self.layers, outputs=self.cache)
+        self.assertEqual(self.stacks["network"].rendered, {"type": "network", "cidr": "10.0.0.0/16"})
+        self.assertEqual(self.stacks["settings"].rendered, {"cidr": "10.0.1.0/24"})
+        self.assertIs(self.stacks["app"].rendered, None)
+        self.assertIs(self.stacks["web"].rendered, None)
+
+        render = lambda name: self.bootstrap.render_stacks(self.layers, 1, [name], self.cache)
+        Deployer(outputs=self.cache, render=render, poll_interval=0, sleep=lambda seconds: None).deploy(self.layers)
+
+        self.assertEqual(self.stacks["app"].deployed_with, {"vpc": "vpc-1"})
+        self.assertEqual(self.stacks["web"].deployed_with, {"app_vpc": "vpc-1", "cidr": "10.0.1.0/24"})
+        self.assertEqual((self.cache.fetches, self.cache.hits), (2, 1))
+
+    it "works out resource keys from what the stacks are rendered with":
+        self.stacks["app"] = RegionalAppStack("app", MergedOptions.using({"region": "{network.vpc_id}-region"}))
+        self.stacks["app"].add_dependencies(["network"])
+        layers = Layers(self.stacks)
+        layers.add_all_to_layers()
+
+        self.bootstrap.prepare_stacks(layers, outputs=self.cache)
+        resources = ResourceLimits()
+        render = lambda name: self.bootstrap.render_stacks(layers, 1, [name], self.cache)
+        with mock.patch.object(resources, "take", wraps=resources.take) as take:
+            Deployer(outputs=self.cache, render=render, resources=resources, poll_interval=0, sleep=lambda seconds: None).deploy(layers)
+
+        self.assertIn(mock.call(["region=vpc-1-region"]), take.mock_calls)
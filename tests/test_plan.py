@@ -0,0 +1,67 @@
+# coding: spec
+
+from cloudcity.resolution.types.config import ConfigStack
+from cloudcity.errors import BadPlan
+from cloudcity.layers import Layers
+from cloudcity.plan import Plan
+
+from tests.helpers import a_temp_file
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import gzip
+import json
+
+describe TestCase, "Plan":
+    before_each:
+        self.network = ConfigStack("network", MergedOptions.using({"vpc": "vpc-1", "cidr": "10.0.0.0/16"}))
+        self.app = ConfigStack("app", MergedOptions.using({"vpc": "{network.vpc}", "tags": {"team": "a"}}))
+        self.app.add_dependencies(["network"])
+
+        self.layers = Layers({"network": self.network, "app": self.app})
+        self.layers.add_to_layers("app")
+
+    it "records the layering, dependencies, options and fingerprints":
+        plan = Plan.from_layers("app", self.layers)
+        self.assertEqual(plan.target, "app")
+        self.assertEqual(plan.layered, [["network"], ["app"]])
+        self.assertEqual(plan.stacks["app"]
+            , { "type": "config"
+              , "options": {"vpc": "{network.vpc}", "tags": {"team": "a"}}
+              , "dependencies": ["network"]
+              , "fingerprint": self.app.fingerprint()
+              }
+            )
+
+    it "can be written and read back into layers":
+        with a_temp_file() as filename:
+            Plan.from_layers("app", self.layers).write(filename)
+            layers = Plan.read(filename).layers()
+
+        self.assertEqual([[name for name, _ in layer] for layer in layers.layered], [["network"], ["app"]])
+        app = layers.stacks["app"]
+        self.assertEqual(app.dependencies, ["network"])
+        self.assertEqual(app["tags.team"], "a")
+        self.assertEqual(app.fingerprint(), self.app.fingerprint())
+
+    it "complains about plans from a different version":
+        with a_temp_file() as filename:
+            dct = Plan.from_layers("app", self.layers).as_dict()
+            dct["version"] = 0
+            with gzip.open(filename, "wb") as fle:
+                json.dump(dct, fle)
+
+            with self.assertRaisesRegexp(BadPlan, "Unsupported plan version"):
+                Plan.read(filename)
+
+    it "complains about files that aren't plans":
+        with a_temp_file("not a plan") as filename:
+            with self.assertRaisesRegexp(BadPlan, "Failed to read plan"):
+                Plan.read(filename)
+
+    it "complains if the options don't match the fingerprint":
+        plan = Plan.from_layers("app", self.layers)
+        plan.stacks["app"]["options"]["vpc"] = "vpc-2"
+        with self.assertRaisesRegexp(BadPlan, "Stack options don't match their fingerprint"):
+            plan.layers()
@@ -0,0 +1,95 @@
+# coding: spec
+
+from cloudcity.profiling import Profiler, NoProfiler
+
+from tests.helpers import a_temp_dir
+
+from unittest import TestCase
+import pstats
+import mock
+import os
+
+class FakeTracemalloc(object):
+    """Pretends to trace memory, with the current usage set by the test"""
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    def use(self, current):
+        self.current = current
+        self.peak = max(self.peak, current)
+
+    def is_tracing(self):
+        return True
+
+    def get_traced_memory(self):
+        return self.current, self.peak
+
+    def reset_peak(self):
+        self.peak = self.current
+
+    def take_snapshot(self):
+        return mock.Mock(name="snapshot", **{"statistics.return_value": []})
+
+describe TestCase, "Profiler":
+    it "writes stats for each phase and remembers how long they took":
+        with a_temp_dir() as directory:
+            profiler = Profiler(os.path.join(directory, "profile"))
+            with profiler.phase("outer"):
+                sorted(range(1000))
+                with profiler.phase("inner"):
+                    sorted(range(1000))
+
+            self.assertEqual(sorted(os.listdir(profiler.directory))[:2], ["00-outer.prof", "01-inner.prof"])
+            for name in ("00-outer.prof", "01-inner.prof"):
+                pstats.Stats(os.path.join(profiler.directory, name))
+
+            self.assertEqual([(record["name"], record["depth"]) for record in profiler.phases], [("outer", 0), ("inner", 1)])
+            for record in profiler.phases:
+                assert record["duration"] >= 0
+                assert record["peak_memory"] > 0
+
+    it "doesn't lose the peak memory of an outer phase to the phases inside it":
+        fake = FakeTracemalloc()
+        with a_temp_dir() as directory, mock.patch("cloudcity.profiling.tracemalloc", fake):
+            profiler = Profiler(directory)
+            with profiler.phase("outer"):
+                fake.use(100)
+                fake.use(10)
+                with profiler.phase("first"):
+                    fake.use(50)
+                    fake.use(10)
+                with profiler.phase("second"):
+                    fake.use(30)
+                    fake.use(10)
+                fake.use(20)
+
+        self.assertEqual([(record["name"], record["peak_memory"]) for record in profiler.phases], [("outer", 100), ("first", 50), ("second", 30)])
+
+    it "records the phase even if it fails":
+        with a_temp_dir() as directory:
+            profiler = Profiler(directory)
+            with self.assertRaises(ValueError):
+                with profiler.phase("failure"):
+                    raise ValueError("nope")
+            self.assertEqual([record["name"] for record in profiler.phases], ["failure"])
+            assert "duration" in profiler.phases[0]
+
+    it "has a summary table":
+        with a_temp_dir() as directory:
+            profiler = Profiler(directory)
+            with profiler.phase("outer"):
+                with profiler.phase("inner"):
+                    pass
+
+            lines = profiler.summary().split("\n")
+            self.assertEqual(lines[0].split(), ["Phase", "Seconds", "Peak", "memory"])
+            assert lines[1].startswith("outer ")
+            assert lines[2].startswith("  inner ")
+            self.assertEqual(lines[3], "Profiles written to {0}".format(directory))
+
+    it "has a profiler that does nothing":
+        profiler = NoProfiler()
+        with profiler.phase("anything"):
+            pass
+        self.assertEqual(profiler.summary(), "")
@@ -0,0 +1,101 @@
+# coding: spec
+
+from cloudcity.progress import ProgressView, ProgressHandler
+
+from tests.helpers import a_temp_file
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+from StringIO import StringIO
+import logging
+
+class TtyStream(StringIO):
+    def isatty(self):
+        return True
+
+describe TestCase, "ProgressView":
+    before_each:
+        self.now = 0
+        self.clock = lambda: self.now
+
+    it "only draws the latest event for each stack at most once an interval":
+        stream = StringIO()
+        progress = ProgressView(stream, interval=1, clock=self.clock)
+        progress.started("app")
+        progress.started("db")
+        self.assertEqual(progress.render_if_due(), True)
+
+        for number in range(100):
+            self.now += 0.001
+            progress.update("app", ["event {0}".format(number)])
+            self.assertEqual(progress.render_if_due(), False)
+
+        self.now = 1.5
+        self.assertEqual(progress.render_if_due(), True)
+        self.assertEqual(progress.render_if_due(), False)
+        self.assertEqual(stream.getvalue().strip().split("\n"), [
+              "Progress: 2 deploying, 0 finished; app: started (0 events); db: started (0 events)"
+            , "Progress: 2 deploying, 0 finished; app: event 99 (100 events); db: started (0 events)"
+            ])
+
+    it "redraws in place on a tty":
+        stream = TtyStream()
+        progress = ProgressView(stream, clock=self.clock)
+        progress.started("app")
+        progress.render()
+        progress.finished("app", "finished")
+        progress.render()
+        self.assertEqual(stream.getvalue(), "\033[J1 deploying, 0 finished\n  app: started (0 events)\n\033[2F\033[J0 deploying, 1 finished\n")
+
+    it "draws again under log lines written between renders":
+        stream = TtyStream()
+        progress = ProgressView(stream, clock=self.clock)
+
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.Logger("test_progress")
+        logger.addHandler(ProgressHandler(progress, handler))
+
+        progress.started("app")
+        progress.render()
+        logger.info("Deploying db")
+        progress.started("db")
+        progress.render()
+
+        self.assertEqual(stream.getvalue(), "".join([
+              "\033[J1 deploying, 0 finished\n  app: started (0 events)\n"
+            , "\033[2F\033[J"
+            , "Deploying db\n"
+            , "\033[J1 deploying, 0 finished\n  app: started (0 events)\n"
+            , "\033[2F\033[J2 deploying, 0 finished\n  app: started (0 events)\n  db: started (0 events)\n"
+            ]))
+
+    it "leaves log lines alone when it isn't drawing in place":
+        stream = StringIO()
+        progress = ProgressView(stream, clock=self.clock)
+
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.Logger("test_progress")
+        logger.addHandler(ProgressHandler(progress, handler))
+
+        progress.started("app")
+        progress.render()
+        logger.info("Deploying db")
+        self.assertEqual(stream.getvalue(), "Progress: 1 deploying, 0 finished; app: started (0 events)\nDeploying db\n")
+
+    it "limits how many stacks it draws":
+        progress = ProgressView(StringIO(), max_lines=2, clock=self.clock)
+        for name in ("one", "two", "three"):
+            self.now += 1
+            progress.started(name)
+        self.assertEqual(progress.lines(), ["3 deploying, 0 finished", "  three: started (0 events)", "  two: started (0 events)", "  ... and 1 more"])
+
+    it "writes every event to the events file":
+        with a_temp_file() as location:
+            progress = ProgressView(StringIO(), events_location=location, clock=self.clock)
+            progress.update("app", ["one", "two"])
+            progress.finished("app", "finished")
+            progress.close()
+            with open(location) as fle:
+                self.assertEqual(fle.read(), "0.000 app one\n0.000 app two\n0.000 app finished\n")
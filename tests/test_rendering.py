@@ -0,0 +1,58 @@
+# coding: spec
+
+from cloudcity.rendering import Renderer, render_stack
+from cloudcity.configurations import ReferenceResolver
+from cloudcity.errors import BadOptionFormat
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import mock
+
+describe TestCase, "Renderer":
+    before_each:
+        self.options = MergedOptions.using(
+              {"network": {"vpc": "vpc-1", "cidr": "10.0.0.0/16", "size": 3}}
+            , {"app": {"vpc": "{network.vpc}", "nested": {"name": "app-{network.size}"}, "count": 2}}
+            , {"db": {"subnet": "{network.cidr}"}}
+            )
+
+        self.expected = {
+              "network": {"vpc": "vpc-1", "cidr": "10.0.0.0/16", "size": 3}
+            , "app": {"vpc": "vpc-1", "nested": {"name": "app-3"}, "count": 2}
+            , "db": {"subnet": "10.0.0.0/16"}
+            }
+
+    it "renders one stack into a plain dictionary":
+        self.assertEqual(render_stack("app", self.options), ("app", self.expected["app"]))
+
+    it "renders in the current process when asked for one process":
+        self.assertEqual(Renderer(self.options, processes=1).render(["network", "app", "db"]), self.expected)
+
+    it "renders many stacks in a pool of processes":
+        self.assertEqual(Renderer(self.options, processes=2).render(["network", "app", "db"]), self.expected)
+
+    it "renders templates that refer to other templates":
+        self.options.update({"web": {"url": "{app.nested.name}.example.com", "vpc": "{app.vpc}"}})
+        self.expected["web"] = {"url": "app-3.example.com", "vpc": "vpc-1"}
+        self.assertEqual(Renderer(self.options, processes=1).render(["app", "web"]), {"app": self.expected["app"], "web": self.expected["web"]})
+        self.assertEqual(Renderer(self.options, processes=2).render(["app", "web"]), {"app": self.expected["app"], "web": self.expected["web"]})
+
+    it "remembers references between renders when given a resolver":
+        resolver = ReferenceResolver(self.options)
+        self.assertEqual(Renderer(self.options, resolver=resolver).render(["app"]), {"app": self.expected["app"]})
+
+        get = mock.Mock(name="get", side_effect=self.options.get)
+        with mock.patch.object(self.options, "get", get):
+            self.assertEqual(Renderer(self.options, resolver=resolver).render(["app", "db"]), {"app": self.expected["app"], "db": self.expected["db"]})
+        self.assertEqual(sorted(call[1][0] for call in get.mock_calls), ["db.subnet", "network.cidr"])
+
+    it "takes a frozen snapshot of the options":
+        snapshot = Renderer(self.options).snapshot()
+        self.assertIs(type(snapshot), dict)
+        self.assertIs(type(snapshot["app"]["nested"]), dict)
+
+    it "passes on errors from the workers":
+        self.options.update({"bad": {"thing": "{network}"}})
+        with self.assertRaisesRegexp(BadOptionFormat, "Shouldn't format a whole stack into the string"):
+            Renderer(self.options, processes=2).render(["app", "bad"])
@@ -0,0 +1,98 @@
+# coding: spec
+
+from cloudcity.resolution.types.config import ConfigStack
+from cloudcity.resolution.resolver import StackResolver
+from cloudcity.resolution.plugins import PluginCache
+from cloudcity.errors import UnknownStackType, BadImport
+
+from tests.helpers import a_temp_dir
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import mock
+import json
+import os
+
+describe TestCase, "StackResolver":
+    before_each:
+        self.plugin_cache = mock.Mock(name="plugin_cache")
+        self.plugin_cache.stack_types.return_value = {"cfn": "cloudcity.resolution.types.config:ConfigStack", "bad": "not an import"}
+        self.resolver = StackResolver(plugin_cache_kls=lambda: self.plugin_cache)
+
+    it "registers defaults and plugins without importing them":
+        with mock.patch("cloudcity.resolution.resolver.do_import") as do_import:
+            self.resolver.register_defaults()
+        self.assertEqual(len(do_import.mock_calls), 0)
+        self.assertEqual(self.resolver.lazy, {"config": "cloudcity.resolution.types.config:ConfigStack", "cfn": "cloudcity.resolution.types.config:ConfigStack"})
+        self.assertEqual(self.resolver.available(), ["cfn", "config"])
+
+    it "imports a lazy stack type the first time it's resolved":
+        self.resolver.register_defaults()
+        with mock.patch("cloudcity.resolution.resolver.do_import", return_value=ConfigStack) as do_import:
+            stack = self.resolver.resolve("one", MergedOptions.using({"type": "cfn"}))
+            self.resolver.resolve("two", MergedOptions.using({"type": "cfn"}))
+
+        self.assertIsInstance(stack, ConfigStack)
+        do_import.assert_called_once_with("cloudcity.resolution.types.config", "ConfigStack")
+        self.assertEqual(sorted(self.resolver.lazy), ["config"])
+
+    it "complains about unknown types":
+        self.resolver.register_defaults()
+        with self.assertRaisesRegexp(UnknownStackType, "only_have=\['cfn', 'config'\]\twanted=nope"):
+            self.resolver.resolve("one", MergedOptions.using({"type": "nope"}))
+
+    it "complains about lazy stack types that fail to import every time they're resolved":
+        self.plugin_cache.stack_types.return_value = {"broken": "cloudcity.resolution.types.nope:Stack", "missing": "cloudcity.resolution.types.config:Nope"}
+        self.resolver.register_defaults()
+
+        for _ in range(2):
+            with self.assertRaisesRegexp(BadImport, "Failed to import.+import_line=cloudcity.resolution.types.nope:Stack"):
+                self.resolver.resolve("one", MergedOptions.using({"type": "broken"}))
+        with self.assertRaisesRegexp(BadImport, "Failed to import.+error_type=AttributeError"):
+            self.resolver.resolve("two", MergedOptions.using({"type": "missing"}))
+        self.assertEqual(sorted(self.resolver.lazy), ["broken", "config", "missing"])
+
+    it "complains about invalid lazy imports":
+        with self.assertRaisesRegexp(BadImport, "Expecting '<path>:<obj>'"):
+            self.resolver.register_lazy("thing", "blah")
+
+describe TestCase, "PluginCache":
+    before_each:
+        self.discovered = {"cfn": "my_plugin.stacks:CfnStack"}
+
+    it "only looks at entry points when the installed packages change":
+        with a_temp_dir() as directory:
+            location = os.path.join(directory, "cache", "stack_types.json")
+            fingerprint = mock.Mock(name="fingerprint", return_value="one")
+            discover = mock.Mock(name="discover", return_value=self.discovered)
+
+            with mock.patch.multiple(PluginCache, fingerprint=fingerprint, discover=discover):
+                self.assertEqual(PluginCache(location).stack_types(), self.discovered)
+                self.assertEqual(PluginCache(location).stack_types(), self.discovered)
+                self.assertEqual(len(discover.mock_calls), 1)
+
+                fingerprint.return_value = "two"
+                self.assertEqual(PluginCache(location).stack_types(), self.discovered)
+                self.assertEqual(len(discover.mock_calls), 2)
+
+            with open(location) as fle:
+                self.assertEqual(json.load(fle), {"version": 1, "fingerprint": "two", "stack_types": self.discovered})
+
+    it "changes the fingerprint when package metadata changes":
+        with a_temp_dir() as directory:
+            cache = PluginCache(os.path.join(directory, "stack_types.json"))
+            with mock.patch("sys.path", [directory]):
+                first = cache.fingerprint()
+                os.makedirs(os.path.join(directory, "my_plugin-0.1.dist-info"))
+                second = cache.fingerprint()
+                os.makedirs(os.path.join(directory, "not_metadata"))
+                self.assertEqual(cache.fingerprint(), second)
+            self.assertNotEqual(first, second)
+
+    it "finds stack types from entry points":
+        entry_point = mock.Mock(name="entry_point", module_name="my_plugin.stacks", attrs=("CfnStack", ))
+        entry_point.name = "cfn"
+        with mock.patch("pkg_resources.iter_entry_points", return_value=[entry_point]) as iter_entry_points:
+            self.assertEqual(PluginCache("/nonexistant").discover(), self.discovered)
+        iter_entry_points.assert_called_once_with("cloudcity.stack_types")
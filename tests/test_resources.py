@@ -0,0 +1,46 @@
+# coding: spec
+
+from cloudcity.resources import ResourceLimits
+from cloudcity.errors import CloudCityError
+from cloudcity.executor import resource_limit, positive_int
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+
+describe TestCase, "ResourceLimits":
+    it "uses the first matching glob or the default":
+        limits = ResourceLimits([("account=123", 1), ("account=*", 2)], default=3)
+        self.assertEqual(limits.limit_for("account=123"), 1)
+        self.assertEqual(limits.limit_for("account=456"), 2)
+        self.assertEqual(limits.limit_for("region=ap-southeast-2"), 3)
+        self.assertEqual(ResourceLimits().limit_for("account=123"), None)
+
+    it "complains about limits that would never let a stack start":
+        with self.assertRaisesRegexp(CloudCityError, "limit=0\tresource=account=\*"):
+            ResourceLimits([("region=*", 2), ("account=*", 0)])
+        with self.assertRaisesRegexp(CloudCityError, "limit=-1\tresource=default"):
+            ResourceLimits(default=-1)
+
+        for value in ("account=*,0", "account=*,-1", "account=*,x"):
+            with self.assertRaises(ValueError):
+                resource_limit(value)
+        for value in ("0", "-1", "x"):
+            with self.assertRaises(ValueError):
+                positive_int(value)
+        self.assertEqual(resource_limit("account=*,2"), ("account=*", 2))
+        self.assertEqual(positive_int("3"), 3)
+
+    it "only has room while every key is under it's limit":
+        limits = ResourceLimits([("account=*", 1)], default=2)
+        self.assertEqual(limits.has_room(["account=a", "region=r"]), True)
+
+        limits.take(["account=a", "region=r"])
+        self.assertEqual(limits.has_room(["account=a", "region=r"]), False)
+        self.assertEqual(limits.has_room(["account=b", "region=r"]), True)
+
+        limits.take(["account=b", "region=r"])
+        self.assertEqual(limits.has_room(["account=c", "region=r"]), False)
+
+        limits.release(["account=a", "region=r"])
+        self.assertEqual(limits.has_room(["account=a", "region=r"]), True)
+        self.assertEqual(dict(limits.in_use), {"account=b": 1, "region=r": 1})
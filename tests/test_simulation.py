@@ -0,0 +1,92 @@
+# coding: spec
+
+from cloudcity.simulation import Simulation, Latency, VirtualClock
+from cloudcity.resources import ResourceLimits
+from cloudcity.durations import Durations
+from cloudcity.errors import CloudCityError
+from cloudcity.deployer import Deployer
+from cloudcity.metrics import Metrics
+from cloudcity.plan import Plan
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from unittest import TestCase
+import random
+
+describe TestCase, "Latency":
+    it "parses distributions":
+        rng = random.Random(1)
+        self.assertEqual(Latency.parse("fixed:60").sample(rng), 60)
+        self.assertTrue(30 <= Latency.parse("uniform:30:90").sample(rng) <= 90)
+        self.assertEqual(Latency.parse("uniform:30:90").mean(), 60)
+
+    it "complains about bad distributions":
+        with self.assertRaisesRegexp(CloudCityError, "Unknown latency distribution"):
+            Latency.parse("normal:1:2")
+        with self.assertRaisesRegexp(CloudCityError, "Wrong number of arguments"):
+            Latency.parse("fixed:1:2")
+        with self.assertRaisesRegexp(CloudCityError, "must be numbers"):
+            Latency.parse("fixed:soon")
+
+describe TestCase, "Simulation":
+    before_each:
+        # Three quick independent stacks and a chain that sorts last
+        self.graph = {"a": [], "b": [], "c": [], "z1": [], "z2": ["z1"], "z3": ["z2"]}
+
+    it "compares scheduling strategies":
+        simulation = Simulation(self.graph, latency=Latency("fixed", 10))
+        makespans = dict((strategy, simulation.run(strategy, 2)["makespan"]) for strategy in Deployer.strategies)
+        self.assertEqual(makespans, {"critical-path": 30, "dag": 40, "layered": 40})
+
+        simulation = Simulation({"a": [], "b": [], "c": ["a"]}, latencies={"a": Latency("fixed", 5)}, latency=Latency("fixed", 20))
+        self.assertEqual(simulation.run(Deployer.DAG, 2)["makespan"], 25)
+        self.assertEqual(simulation.run(Deployer.LAYERED, 2)["makespan"], 40)
+
+    it "is the same every time for the same seed":
+        first = Simulation.synthetic(50, seed=4, latency=Latency("lognormal", 3, 0.5), failure_rate=0.1).run(Deployer.CRITICAL_PATH, 5)
+        second = Simulation.synthetic(50, seed=4, latency=Latency("lognormal", 3, 0.5), failure_rate=0.1).run(Deployer.CRITICAL_PATH, 5)
+        self.assertEqual(first, second)
+        self.assertGreater(first["failed"], 0)
+        self.assertEqual(first["deployed"] + first["failed"] + first["skipped"], 50)
+
+    it "throttles deploys over the quota unless the deployer limits them":
+        options = dict((name, {"account": "one"}) for name in self.graph)
+        simulation = Simulation(self.graph, options=options, quotas=[("account=*", 2)], throttle_penalty=100)
+
+        throttled = simulation.run(Deployer.CRITICAL_PATH, 4)
+        self.assertGreater(throttled["throttles"], 0)
+
+        limited = simulation.run(Deployer.CRITICAL_PATH, 4, resources=ResourceLimits([("account=*", 2)]))
+        self.assertEqual(limited["throttles"], 0)
+        self.assertLess(limited["makespan"], throttled["makespan"])
+
+    it "records throttles and retries from the backend in the metrics":
+        options = dict((name, {"account": "one"}) for name in self.graph)
+        simulation = Simulation(self.graph, options=options, quotas=[("account=*", 2)], throttle_penalty=100)
+
+        metrics = Metrics()
+        result = simulation.run(Deployer.CRITICAL_PATH, 4, metrics=metrics)
+        self.assertGreater(result["throttles"], 0)
+
+        counted = lambda name: sum(value for (metric, _), value in metrics.counters.items() if metric == name)
+        self.assertEqual(counted("cloudcity_throttles"), result["throttles"])
+        self.assertEqual(counted("cloudcity_retries"), result["throttles"])
+        self.assertIn("cloudcity_throttles_total", metrics.render())
+
+    it "replays a plan with recorded durations":
+        plan = Plan("z3", [["z1"], ["z2"], ["z3"]], {
+              "z1": {"dependencies": [], "options": {}}
+            , "z2": {"dependencies": ["z1"], "options": {}}
+            , "z3": {"dependencies": ["z2"], "options": {}}
+            })
+        durations = Durations()
+        durations.record("z2", 100)
+        result = Simulation.from_plan(plan, durations, latency=Latency("fixed", 10)).run(Deployer.DAG, 5)
+        self.assertEqual(result["makespan"], 120)
+        self.assertEqual(result["deployed"], 3)
+
+describe TestCase, "VirtualClock":
+    it "only moves when something sleeps":
+        clock = VirtualClock()
+        self.assertEqual(clock.time(), 0)
+        clock.sleep(2.5)
+        self.assertEqual(clock.time(), 2.5)
@@ -1,6 +1,6 @@
 # coding: spec
 
-from cloudcity.errors import StackDepCycle
+from cloudcity.errors import StackDepCycle, CloudCityError
 from cloudcity.layers import Layers
 
 from noseOfYeti.tokeniser.support import noy_sup_setUp, noy_sup_tearDown
@@ -244,3 +244,57 @@ describe TestCase, "StackLayer":
                     self.assertCallsSame(self.fake_add_to_layers, expected_calls)
                     self.assertLayeredSame(self.instance, expected)
 
+
+    describe "Impacted stacks":
+        before_each:
+            self.stacks = {}
+            for i in range(1, 8):
+                name = "stack{0}".format(i)
+                obj = mock.Mock(name=name)
+                obj.dependencies = []
+                setattr(self, name, obj)
+                self.stacks[name] = obj
+            self.instance = Layers(self.stacks)
+
+            #      6      7
+            #      |      |
+            # 3    4      5
+            #  \  / \     |
+            #   1    2    |
+            #   \_________/
+            self.stack3.dependencies = ["stack1"]
+            self.stack4.dependencies = ["stack1", "stack2"]
+            self.stack5.dependencies = ["stack1"]
+            self.stack6.dependencies = ["stack4"]
+            self.stack7.dependencies = ["stack5"]
+
+        it "has a reverse index of dependencies":
+            self.assertEqual(dict(self.instance.dependents)
+                , { "stack1": set(["stack3", "stack4", "stack5"])
+                  , "stack2": set(["stack4"])
+                  , "stack4": set(["stack6"])
+                  , "stack5": set(["stack7"])
+                  }
+                )
+
+        it "finds everything that transitively depends on the changed stacks":
+            self.assertEqual(self.instance.impacted_by(["stack2"]), set(["stack2", "stack4", "stack6"]))
+            self.assertEqual(self.instance.impacted_by(["stack5", "stack6"]), set(["stack5", "stack6", "stack7"]))
+            self.assertEqual(self.instance.impacted_by(["stack1"]), set(["stack1", "stack3", "stack4", "stack5", "stack6", "stack7"]))
+
+        it "complains about unknown stacks":
+            with self.assertRaisesRegexp(CloudCityError, "Missing stack"):
+                self.instance.impacted_by(["stack1", "stack20"])
+
+        it "only layers the impacted stacks":
+            self.instance.add_impacted_to_layers(["stack2"])
+            self.assertEqual(self.instance._layered, [["stack2"], ["stack4"], ["stack6"]])
+
+        it "ignores dependencies that aren't impacted when layering":
+            self.instance.add_impacted_to_layers(["stack4", "stack5"])
+            self.assertEqual(self.instance._layered, [["stack4", "stack5"], ["stack6", "stack7"]])
+
+        it "complains about cyclic dependencies in the impacted stacks":
+            self.stack1.dependencies = ["stack6"]
+            with self.assertRaisesRegexp(StackDepCycle, "Stack dependency cycle"):
+                self.instance.add_impacted_to_layers(["stack2"])
@@ -0,0 +1,141 @@
+# coding: spec
+
+from cloudcity.uploads import Uploader, FolderStore, Manifest, content_hash
+from cloudcity.resolution.base import BaseStack
+from cloudcity.bootstrap import BootStrapper
+from cloudcity.errors import CloudCityError
+from cloudcity.layers import Layers
+
+from tests.helpers import a_temp_dir, a_temp_file, setup_directory
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+import threading
+import os
+
+class CountingStore(FolderStore):
+    """A FolderStore that records what it was asked to do"""
+    def __init__(self, directory):
+        super(CountingStore, self).__init__(directory)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def record(self, *call):
+        with self.lock:
+            self.calls.append(call)
+
+    def has(self, key):
+        self.record("has", key)
+        return super(CountingStore, self).has(key)
+
+    def put(self, key, body):
+        self.record("put", key)
+        return super(CountingStore, self).put(key, body)
+
+    def put_part(self, key, upload_id, number, body):
+        self.record("put_part", key, number)
+        return super(CountingStore, self).put_part(key, upload_id, number, body)
+
+    def called(self, kind):
+        return sorted(call[1:] for call in self.calls if call[0] == kind)
+
+class ArtifactStack(BaseStack):
+    def __init__(self, name, options, locations):
+        super(ArtifactStack, self).__init__(name, options)
+        self.locations = locations
+
+    def artifacts(self):
+        return self.locations
+
+describe TestCase, "Uploader":
+    it "uploads each distinct file once under the hash of it's contents":
+        hierarchy = {"files": [("one.json", "{}"), ("two.json", "{}"), ("three.json", "[]")]}
+        with setup_directory(hierarchy) as (root, record), a_temp_dir() as store_dir:
+            store = CountingStore(store_dir)
+            files = record["files"]
+            keys = Uploader(store).upload([files["one.json"], files["two.json"], files["three.json"]])
+
+            self.assertEqual(keys[files["one.json"]], keys[files["two.json"]])
+            self.assertEqual(keys[files["one.json"]], content_hash(files["one.json"]))
+            self.assertEqual(store.called("put"), sorted([(keys[files["one.json"]], ), (keys[files["three.json"]], )]))
+            with open(store.path(keys[files["three.json"]])) as fle:
+                self.assertEqual(fle.read(), "[]")
+
+    it "skips what the store or the manifest already has":
+        with a_temp_file("{}") as location, a_temp_file() as manifest_location, a_temp_dir() as store_dir:
+            store = CountingStore(store_dir)
+            Uploader(store).upload([location])
+            self.assertEqual(len(store.called("put")), 1)
+
+            Uploader(store, Manifest(manifest_location)).upload([location])
+            self.assertEqual(len(store.called("put")), 1)
+            self.assertEqual(len(store.called("has")), 2)
+
+            Uploader(store, Manifest(manifest_location)).upload([location])
+            self.assertEqual(len(store.called("has")), 2)
+
+    it "uploads big files in parts":
+        body = "".join(chr(index % 256) for index in range(2500))
+        with a_temp_file(body) as location, a_temp_dir() as store_dir:
+            store = CountingStore(store_dir)
+            key = Uploader(store, part_size=1000, threads=3).upload([location])[location]
+
+            self.assertEqual(store.called("put"), [])
+            self.assertEqual(store.called("put_part"), [(key, 1), (key, 2), (key, 3)])
+            with open(store.path(key), "rb") as fle:
+                self.assertEqual(fle.read(), body)
+            self.assertEqual(os.listdir(os.path.join(store_dir, ".multipart")), [])
+
+    it "complains about missing files":
+        with a_temp_dir() as store_dir:
+            with self.assertRaisesRegexp(CloudCityError, "Can't find file to upload"):
+                Uploader(FolderStore(store_dir)).upload(["/nonexistant/template.json"])
+
+describe TestCase, "Manifest":
+    it "replaces the manifest on disk without leaving a temporary file behind":
+        with a_temp_dir() as directory:
+            location = os.path.join(directory, "manifest.json")
+            with open(location, "w") as fle:
+                fle.write("not json")
+
+            manifest = Manifest(location)
+            manifest.keys = set(["one", "two"])
+            manifest.save()
+
+            self.assertEqual(os.listdir(directory), ["manifest.json"])
+            self.assertEqual(Manifest(location).keys, set(["one", "two"]))
+
+describe TestCase, "Uploading artifacts for stacks":
+    it "tells each stack where it's artifacts went":
+        with a_temp_file("{}") as one, a_temp_file("[]") as two, a_temp_dir() as store_dir:
+            stacks = {
+                  "app": ArtifactStack("app", MergedOptions.using({}), [one, two])
+                , "db": ArtifactStack("db", MergedOptions.using({}), [one])
+                , "dns": ArtifactStack("dns", MergedOptions.using({}), [])
+                }
+            layers = Layers(stacks)
+            layers.add_all_to_layers()
+
+            BootStrapper(uploader=Uploader(FolderStore(store_dir))).upload_artifacts(layers, ["app", "db"])
+            self.assertEqual(stacks["app"].uploaded, {one: content_hash(one), two: content_hash(two)})
+            self.assertEqual(stacks["db"].uploaded, {one: content_hash(one)})
+            self.assertEqual(stacks["dns"].uploaded, None)
+
+    it "complains if there are artifacts but no uploader":
+        with a_temp_file("{}") as one:
+            layers = Layers({"app": ArtifactStack("app", MergedOptions.using({}), [one])})
+            layers.add_all_to_layers()
+            with self.assertRaisesRegexp(CloudCityError, "nothing to upload them to"):
+                BootStrapper().upload_artifacts(layers)
+
+    it "only logs what it would upload on a dry run":
+        with a_temp_file("{}") as one, a_temp_dir() as store_dir:
+            stack = ArtifactStack("app", MergedOptions.using({}), [one])
+            layers = Layers({"app": stack})
+            layers.add_all_to_layers()
+
+            store = CountingStore(store_dir)
+            BootStrapper(uploader=Uploader(store), dry_run=True).upload_artifacts(layers)
+            self.assertEqual(store.calls, [])
+            self.assertEqual(stack.uploaded, None)
@@ -0,0 +1,98 @@
+# coding: spec
+
+from cloudcity.errors import InvalidConfiguration, MissingMandatoryOptions, UnknownStackType, BadOptionFormat, StackDepCycle, BadImport
+from cloudcity.resolution.resolver import StackResolver
+from cloudcity.resolution.base import BaseStack
+from cloudcity.validation import Validator, normalised_cycle
+
+from noseOfYeti.tokeniser.support import noy_sup_setUp
+from option_merge import MergedOptions
+from unittest import TestCase
+
+describe TestCase, "Validator":
+    before_each:
+        self.stack_resolver = StackResolver()
+        self.stack_resolver.register_defaults()
+
+    def validate(self, *options):
+        validator = Validator(MergedOptions.using({"global": {}}, *options), self.stack_resolver)
+        validator.check_mandatory_options()
+        validator.resolve_stacks()
+        validator.check_references()
+        validator.check_cycles()
+        return validator
+
+    def assertProblems(self, validator, expected):
+        found = sorted((problem.__class__, str(problem)) for problem in validator.problems)
+        self.assertEqual(found, sorted((kls, str(kls(*args, **kwargs))) for kls, args, kwargs in expected))
+
+    it "finds dependencies when there are no problems":
+        validator = self.validate({"network": {"vpc": "vpc-1"}, "app": {"vpc": "{network.vpc}"}, "web": {"a": "{app.vpc}", "b": "{network.vpc}"}})
+        validator.raise_problems()
+        self.assertEqual(validator.problems, [])
+        self.assertEqual(sorted(validator.stacks), ["app", "global", "network", "web"])
+        self.assertEqual(validator.stacks["web"].dependencies, ["app", "network"])
+        self.assertEqual(validator.stacks["app"].dependencies, ["network"])
+
+    it "reports every problem together":
+        validator = self.validate(
+              {"global": {"mandatory_options": ["global.account", "global.region"], "region": "ap-southeast-2"}}
+            , {"a": {"x": "{b.y}", "z": "{nope.y}", "m": "{b.missing}"}}
+            , {"b": {"y": "{a.x}", "w": "{c.anything}"}}
+            , {"c": {"type": "unknown"}}
+            )
+
+        self.assertProblems(validator
+            , [ (MissingMandatoryOptions, (), {"missing": ["global.account"]})
+              , (UnknownStackType, (), {"name": "c", "only_have": ["config"], "wanted": "unknown"})
+              , (BadOptionFormat, ("Reference to a stack that doesn't exist", ), {"stack": "a", "key": "z", "requires": "nope.y"})
+              , (BadOptionFormat, ("Missing required key", ), {"stack": "a", "key": "m", "requires": "b.missing"})
+              , (StackDepCycle, (), {"chain": ["a", "b", "a"]})
+              ]
+            )
+
+        with self.assertRaisesRegexp(InvalidConfiguration, "problems=5"):
+            validator.raise_problems()
+
+    it "reports stack types that fail to import as problems":
+        self.stack_resolver.register_lazy("broken", "cloudcity.resolution.types.nope:Stack")
+        validator = Validator(MergedOptions.using({"a": {"type": "broken"}, "b": {"type": "broken"}}), self.stack_resolver)
+        validator.resolve_stacks()
+
+        self.assertEqual(validator.stacks, {})
+        self.assertEqual([problem.__class__ for problem in validator.problems], [BadImport, BadImport])
+        self.assertIn("import_line=cloudcity.resolution.types.nope:Stack", str(validator.problems[0]))
+
+    it "reports each cycle once":
+        validator = self.validate(
+              {"a": {"x": "{b.x}"}, "b": {"x": "{c.x}"}, "c": {"x": "{a.x}"}}
+            , {"d": {"x": "{e.x}"}, "e": {"x": "{d.x}", "y": "{a.x}"}}
+            )
+        self.assertProblems(validator
+            , [ (StackDepCycle, (), {"chain": ["a", "b", "c", "a"]})
+              , (StackDepCycle, (), {"chain": ["d", "e", "d"]})
+              ]
+            )
+
+    it "only treats rotations of a cycle as the same cycle":
+        self.assertEqual(normalised_cycle(["b", "c", "a", "b"]), ("a", "b", "c"))
+        self.assertEqual(normalised_cycle(["c", "a", "b", "c"]), normalised_cycle(["a", "b", "c", "a"]))
+        self.assertNotEqual(normalised_cycle(["a", "c", "b", "a"]), normalised_cycle(["a", "b", "c", "a"]))
+
+    it "reports cycles between stacks that aren't from options":
+        validator = Validator(MergedOptions.using({"global": {}}), self.stack_resolver)
+        for name, dependencies in (("a", ["b", "c"]), ("b", ["c"]), ("c", ["a", "b"])):
+            validator.stacks[name] = BaseStack(name, {})
+            validator.stacks[name].add_dependencies(dependencies)
+        validator.check_cycles()
+
+        self.assertProblems(validator
+            , [ (StackDepCycle, (), {"chain": ["a", "b", "c", "a"]})
+              , (StackDepCycle, (), {"chain": ["b", "c", "b"]})
+              ]
+            )
+
+    it "checks mandatory options without a global":
+        validator = Validator(MergedOptions.using({"a": {"x": 1}}), self.stack_resolver)
+        validator.check_mandatory_options()
+        self.assertEqual(validator.problems, [])